@@ -7,6 +7,8 @@ from oauthlib.oauth2 import WebApplicationClient
 import json
 import requests
 
+import database
+
 class Base(DeclarativeBase):
     pass
 
@@ -27,20 +29,98 @@ login_manager.login_view = 'login'
 # OAuth2 client setup
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
+# Shared keep-alive session for Google API calls, sized for concurrent workers
+http_session = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.environ.get("GOOGLE_API_POOL_SIZE", 16)),
+    max_retries=2,
+)
+http_session.mount("https://", _http_adapter)
+http_session.mount("http://", _http_adapter)
+
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///routes.db"
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+    import user_cache
+    return user_cache.load_user(int(user_id))
+app.config["SQLALCHEMY_DATABASE_URI"] = database.database_url(os.environ.get("DATABASE_URL", "sqlite:///routes.db"))
+# Connection pool for server databases (Postgres); size it to web threads plus OPTIMIZE_JOB_WORKERS
+app.config["DATABASE_POOL_SIZE"] = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+app.config["DATABASE_MAX_OVERFLOW"] = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+app.config["DATABASE_POOL_TIMEOUT"] = int(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+app.config["DATABASE_POOL_RECYCLE"] = int(os.environ.get("DATABASE_POOL_RECYCLE", 300))
+# SQLite pragmas applied to every connection of a file database
+app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options(app.config)
+# Sign-in: fallback lifetime of Google's discovery document when it sends no max-age, and the
+# in-process cache behind Flask-Login's user loader (0 disables)
+app.config["OAUTH_DISCOVERY_TTL_SECONDS"] = int(os.environ.get("OAUTH_DISCOVERY_TTL_SECONDS", 3600))
+app.config["USER_CACHE_TTL_SECONDS"] = int(os.environ.get("USER_CACHE_TTL_SECONDS", 60))
+app.config["USER_CACHE_SIZE"] = int(os.environ.get("USER_CACHE_SIZE", 1024))
 app.config["GOOGLE_MAPS_API_KEY"] = os.environ.get("GOOGLE_MAPS_API_KEY")
 app.config["GOOGLE_MAPS_MAP_ID"] = "DEMO_MAP_ID"  # We'll use a default Map ID for now
+# Geocoding cache: in-process LRU in front of the geocode_cache table
+app.config["GEOCODE_CACHE_SIZE"] = int(os.environ.get("GEOCODE_CACHE_SIZE", 1024))
+app.config["GEOCODE_CACHE_TTL_DAYS"] = int(os.environ.get("GEOCODE_CACHE_TTL_DAYS", 30))
+app.config["GEOCODE_MAX_WORKERS"] = int(os.environ.get("GEOCODE_MAX_WORKERS", 8))
+app.config["GOOGLE_API_TIMEOUT"] = float(os.environ.get("GOOGLE_API_TIMEOUT", 10))
+# Distance Matrix API limits per request (standard plan) and tile concurrency
+app.config["DISTANCE_MATRIX_MAX_ELEMENTS"] = int(os.environ.get("DISTANCE_MATRIX_MAX_ELEMENTS", 100))
+app.config["DISTANCE_MATRIX_MAX_DIMENSION"] = int(os.environ.get("DISTANCE_MATRIX_MAX_DIMENSION", 25))
+app.config["DISTANCE_MATRIX_MAX_WORKERS"] = int(os.environ.get("DISTANCE_MATRIX_MAX_WORKERS", 8))
+app.config["TRAVEL_TIME_CACHE_TTL_DAYS"] = int(os.environ.get("TRAVEL_TIME_CACHE_TTL_DAYS", 7))
+# Directions API waypoints per request (standard plan) and concurrent segment requests
+app.config["DIRECTIONS_MAX_WAYPOINTS"] = int(os.environ.get("DIRECTIONS_MAX_WAYPOINTS", 25))
+app.config["DIRECTIONS_MAX_WORKERS"] = int(os.environ.get("DIRECTIONS_MAX_WORKERS", 4))
+# Distance provider: "google", "haversine" (offline estimate) or "file" (precomputed .npz)
+app.config["DISTANCE_PROVIDER"] = os.environ.get("DISTANCE_PROVIDER", "google")
+app.config["DISTANCE_PROVIDER_FALLBACK"] = os.environ.get("DISTANCE_PROVIDER_FALLBACK", "")
+app.config["DISTANCE_MATRIX_FILE"] = os.environ.get("DISTANCE_MATRIX_FILE", "")
+app.config["HAVERSINE_SPEED_KMH"] = float(os.environ.get("HAVERSINE_SPEED_KMH", 40))
+app.config["HAVERSINE_DETOUR_FACTOR"] = float(os.environ.get("HAVERSINE_DETOUR_FACTOR", 1.3))
+# Solver time budget for /optimize (max_solve_ms); 0 runs a single construction + local search pass
+app.config["SOLVER_DEFAULT_BUDGET_MS"] = int(os.environ.get("SOLVER_DEFAULT_BUDGET_MS", 0))
+app.config["SOLVER_MAX_BUDGET_MS"] = int(os.environ.get("SOLVER_MAX_BUDGET_MS", 30000))
+# Route listing page size (?limit= is capped at ROUTES_MAX_PAGE_SIZE)
+app.config["ROUTES_PAGE_SIZE"] = int(os.environ.get("ROUTES_PAGE_SIZE", 50))
+app.config["ROUTES_MAX_PAGE_SIZE"] = int(os.environ.get("ROUTES_MAX_PAGE_SIZE", 200))
+# Seconds a rendered /statistics page is reused (0 disables)
+app.config["STATISTICS_CACHE_SECONDS"] = int(os.environ.get("STATISTICS_CACHE_SECONDS", 30))
+# Bulk contact import: rows per INSERT batch and invalid rows reported individually
+app.config["CONTACT_IMPORT_BATCH_SIZE"] = int(os.environ.get("CONTACT_IMPORT_BATCH_SIZE", 500))
+app.config["CONTACT_IMPORT_MAX_REPORTED_ERRORS"] = int(os.environ.get("CONTACT_IMPORT_MAX_REPORTED_ERRORS", 100))
+# Time-window routing: objective units added per second of lateness at a stop
+app.config["TIME_WINDOW_LATENESS_PENALTY"] = float(os.environ.get("TIME_WINDOW_LATENESS_PENALTY", 100.0))
+# Large routes: at this many stops (0 disables) /optimize fetches costs only to each stop's
+# nearest LARGE_ROUTE_CANDIDATES stops and solves on those lists, with a default time budget
+app.config["LARGE_ROUTE_STOPS"] = int(os.environ.get("LARGE_ROUTE_STOPS", 1000))
+app.config["LARGE_ROUTE_CANDIDATES"] = int(os.environ.get("LARGE_ROUTE_CANDIDATES", 10))
+app.config["LARGE_ROUTE_BUDGET_MS"] = int(os.environ.get("LARGE_ROUTE_BUDGET_MS", 2000))
+# Per-request Server-Timing header with pipeline stage and database timings (off in production)
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "").lower() in ('1', 'true', 'yes')
+# Identical /optimize requests share one computation; results are reused for this long (0 disables)
+app.config["OPTIMIZE_DEDUP_TTL_SECONDS"] = int(os.environ.get("OPTIMIZE_DEDUP_TTL_SECONDS", 300))
+app.config["OPTIMIZE_DEDUP_MAX_ENTRIES"] = int(os.environ.get("OPTIMIZE_DEDUP_MAX_ENTRIES", 256))
+# Longest a duplicate request waits on the in-flight one before optimizing on its own
+app.config["OPTIMIZE_DEDUP_WAIT_SECONDS"] = float(os.environ.get("OPTIMIZE_DEDUP_WAIT_SECONDS", 120))
+# Background workers for asynchronous /optimize jobs
+app.config["OPTIMIZE_JOB_WORKERS"] = int(os.environ.get("OPTIMIZE_JOB_WORKERS", 4))
+app.config["OPTIMIZE_JOB_RETENTION_SECONDS"] = int(os.environ.get("OPTIMIZE_JOB_RETENTION_SECONDS", 3600))
+# Batch planning: route specs per call and solver processes (defaults to CPU count)
+app.config["BATCH_MAX_ROUTES"] = int(os.environ.get("BATCH_MAX_ROUTES", 200))
+app.config["BATCH_SOLVER_PROCESSES"] = int(os.environ.get("BATCH_SOLVER_PROCESSES", os.cpu_count() or 1))
+# Multi-vehicle planning: weight of the longest route in the objective (0 = total distance only)
+app.config["FLEET_MAX_VEHICLES"] = int(os.environ.get("FLEET_MAX_VEHICLES", 50))
+app.config["FLEET_BALANCE_WEIGHT"] = float(os.environ.get("FLEET_BALANCE_WEIGHT", 1.0))
 db.init_app(app)
 
 with app.app_context():
+    database.install_sqlite_pragmas(db.engine, app.config)
     import models
     import routes
+    import migrations
     db.create_all()
+    migrations.upgrade_schema()
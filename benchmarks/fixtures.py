@@ -0,0 +1,138 @@
+"""Synthetic stops and an offline stand-in for the Google Geocoding, Distance Matrix and Directions APIs."""
+import json
+import math
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import requests
+
+# Same box as the map bounds in static/js/main.js and maps.js
+SWISS_BOUNDS = {'north': 47.8084, 'south': 45.8183, 'west': 5.9562, 'east': 10.4922}
+EARTH_RADIUS_M = 6371000
+GOOGLE_MAPS_PREFIX = 'https://maps.googleapis.com/'
+
+
+def swiss_coordinates(n, seed=0):
+    """n uniformly random (lat, lng) points inside SWISS_BOUNDS, reproducible per seed."""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(SWISS_BOUNDS['south'], SWISS_BOUNDS['north'], n)
+    lng = rng.uniform(SWISS_BOUNDS['west'], SWISS_BOUNDS['east'], n)
+    return np.round(np.column_stack([lat, lng]), 6)
+
+
+def stop_addresses(coordinates, prefix='Benchmark stop'):
+    """One unique street-like address per coordinate, mapped back to it for the mock geocoder."""
+    return {f'{prefix} {i}, Switzerland': (float(lat), float(lng))
+            for i, (lat, lng) in enumerate(coordinates)}
+
+
+def haversine(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+
+def mst_weight(matrix):
+    """Weight of a minimum spanning tree (Prim, O(n^2)) over min(d_ij, d_ji).
+
+    Dropping one edge of any route leaves a spanning path, so this is a
+    lower bound on both open and closed tours over the same stops.
+    """
+    matrix = np.minimum(matrix, matrix.T)
+    n = len(matrix)
+    if n < 2:
+        return 0.0
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best = matrix[0].astype(float)
+    total = 0.0
+    for _ in range(n - 1):
+        candidates = np.where(in_tree, np.inf, best)
+        node = int(np.argmin(candidates))
+        total += candidates[node]
+        in_tree[node] = True
+        best = np.minimum(best, matrix[node])
+    return float(total)
+
+
+class MockGoogleMaps(requests.adapters.BaseAdapter):
+    """Transport adapter answering Geocoding, Distance Matrix and Directions calls locally.
+
+    Mounted on the shared http_session it sits below the real request code,
+    so parameter building, JSON parsing, tiling and the metrics hooks all
+    run as in production. Road distance is the great-circle distance times
+    detour_factor, driven at speed_kmh; latency_ms delays every response.
+    """
+
+    def __init__(self, addresses, detour_factor=1.3, speed_kmh=40.0, latency_ms=0.0):
+        super().__init__()
+        self.addresses = addresses
+        self.detour_factor = detour_factor
+        self.speed_kmh = speed_kmh
+        self.latency_ms = latency_ms
+        self.calls = {'geocode': 0, 'distance_matrix': 0, 'elements': 0, 'directions': 0}
+
+    def _geocode(self, params):
+        self.calls['geocode'] += 1
+        address = params.get('address', [''])[0]
+        if address not in self.addresses:
+            return {'status': 'ZERO_RESULTS', 'results': []}
+        lat, lng = self.addresses[address]
+        return {'status': 'OK', 'results': [{
+            'formatted_address': address,
+            'geometry': {'location': {'lat': lat, 'lng': lng}}
+        }]}
+
+    def _element(self, origin, destination):
+        distance = haversine(origin, destination) * self.detour_factor
+        return {'status': 'OK',
+                'distance': {'value': int(distance)},
+                'duration': {'value': int(distance / (self.speed_kmh / 3.6))}}
+
+    def _distance_matrix(self, params):
+        origins = [tuple(map(float, point.split(','))) for point in params['origins'][0].split('|')]
+        destinations = [tuple(map(float, point.split(','))) for point in params['destinations'][0].split('|')]
+        self.calls['distance_matrix'] += 1
+        self.calls['elements'] += len(origins) * len(destinations)
+        return {'status': 'OK', 'rows': [
+            {'elements': [self._element(origin, destination) for destination in destinations]}
+            for origin in origins
+        ]}
+
+    def _directions(self, params):
+        # One straight-line step per leg; enough for the polyline stitching to run
+        from directions import encode_polyline
+
+        stops = [params['origin'][0]] + (params['waypoints'][0].split('|') if 'waypoints' in params else [])
+        stops = [tuple(map(float, point.split(','))) for point in stops + [params['destination'][0]]]
+        self.calls['directions'] += 1
+        return {'status': 'OK', 'routes': [{'legs': [
+            {'steps': [{'polyline': {'points': encode_polyline([origin, destination])}}]}
+            for origin, destination in zip(stops, stops[1:])
+        ]}]}
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        params = parse_qs(url.query)
+        if '/geocode/' in url.path:
+            body = self._geocode(params)
+        elif '/distancematrix/' in url.path:
+            body = self._distance_matrix(params)
+        elif '/directions/' in url.path:
+            body = self._directions(params)
+        else:
+            body = {'status': 'INVALID_REQUEST'}
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(body).encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,172 @@
+"""Parallel write load test for the database layer: concurrent /optimize calls and raw route commits.
+
+    python -m benchmarks.load
+    python -m benchmarks.load --workers 16 --requests 200 --stops 25
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL python -m benchmarks.load
+    python -m benchmarks.load --database-url postgresql://localhost/easyroute_load
+
+Each /optimize call gets its own stop list (so neither the result cache
+nor the geocode cache short-circuits it) and Google APIs are answered by
+benchmarks.fixtures.MockGoogleMaps. The commit phase inserts and commits
+one Route per iteration from every worker, which is the write pattern
+that serializes on SQLite's lock. Database settings come from the usual
+environment variables; the app uses a throwaway SQLite file unless
+--database-url is given.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import GOOGLE_MAPS_PREFIX, MockGoogleMaps, stop_addresses, swiss_coordinates
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+
+def _summary(latencies_ms, errors, elapsed):
+    return {
+        'completed': len(latencies_ms),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'per_second': round(len(latencies_ms) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(statistics.median(latencies_ms), 2) if latencies_ms else None,
+        'p95_ms': round(_percentile(latencies_ms, 0.95), 2) if latencies_ms else None
+    }
+
+
+def _run_parallel(workers, count, task):
+    """Call task(i) for i in range(count) on workers threads; (latencies_ms, errors, elapsed)."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            ok = task(i)
+        except Exception as e:
+            ok = False
+            with lock:
+                errors.append(str(e))
+        with lock:
+            if ok:
+                latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed, range(count)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def load_optimize(app, mock, args):
+    """POST /optimize from args.workers threads, one distinct stop list per request."""
+    payloads = []
+    for i in range(args.requests):
+        addresses = stop_addresses(swiss_coordinates(args.stops, seed=args.seed + i),
+                                   prefix=f'Load {args.seed}-{i} stop')
+        mock.addresses.update(addresses)
+        payloads.append({'addresses': list(addresses), 'name': f'Load test {i}'})
+    failures = []
+
+    def optimize(i):
+        response = app.test_client().post('/optimize', json=payloads[i])
+        if response.status_code != 200:
+            failures.append((response.get_json() or {}).get('error') or str(response.status_code))
+            return False
+        return True
+
+    latencies, errors, elapsed = _run_parallel(args.workers, args.requests, optimize)
+    return _summary(latencies, len(errors) + len(failures), elapsed), sorted(set(errors + failures))
+
+
+def load_commits(app, args):
+    """Insert and commit one Route per call from args.workers threads."""
+    from app import db
+    from models import Route
+
+    def commit(i):
+        with app.app_context():
+            route = Route(name=f'Commit load {i}', addresses=['A', 'B'], optimized_route=['A', 'B'])
+            db.session.add(route)
+            db.session.commit()
+        return True
+
+    latencies, errors, elapsed = _run_parallel(args.workers, args.commits, commit)
+    return _summary(latencies, len(errors), elapsed), sorted(set(errors))
+
+
+def _database_settings():
+    from app import db
+    from sqlalchemy import text
+
+    settings = {'backend': db.engine.dialect.name, 'pool': db.engine.pool.status()}
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as connection:
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                settings[pragma] = connection.execute(text(f'PRAGMA {pragma}')).scalar()
+    return settings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=64, help='/optimize calls')
+    parser.add_argument('--stops', type=int, default=15, help='stops per /optimize call')
+    parser.add_argument('--commits', type=int, default=1000, help='single-route commits')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--api-latency-ms', type=float, default=20.0, help='simulated latency per API call')
+    parser.add_argument('--database-url', help='database for the app (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.TemporaryDirectory(prefix='easyroute-load-')
+    # The app reads these at import time
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir.name, 'load.db')}"
+    os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'benchmark')
+    os.environ['DISTANCE_PROVIDER'] = 'google'
+    os.environ['DISTANCE_PROVIDER_FALLBACK'] = ''
+
+    from app import app, http_session
+    import directions
+
+    app.config['OPTIMIZE_DEDUP_TTL_SECONDS'] = 0
+    mock = MockGoogleMaps({}, detour_factor=app.config['HAVERSINE_DETOUR_FACTOR'],
+                          speed_kmh=app.config['HAVERSINE_SPEED_KMH'], latency_ms=args.api_latency_ms)
+    http_session.mount(GOOGLE_MAPS_PREFIX, mock)
+
+    with app.app_context():
+        settings = _database_settings()
+    print(f"Database: {settings}", flush=True)
+
+    report = {'database': settings, 'args': vars(args)}
+    for name, run in (('optimize', lambda: load_optimize(app, mock, args)),
+                      ('commits', lambda: load_commits(app, args))):
+        result, errors = run()
+        report[name] = dict(result, error_messages=errors[:10])
+        print(f"{name:>9}: {result['completed']} ok, {result['errors']} failed in {result['seconds']:.1f} s  "
+              f"{result['per_second']}/s  p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms", flush=True)
+        for error in errors[:3]:
+            print(f"           {error}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    # Saved routes get their directions in the background; let that finish before the database goes
+    directions.wait_for_backfill()
+    workdir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""Offline benchmarks for the solver, the distance matrix pipeline and /optimize.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 10 100 1000 --budget-ms 2000 --output run.json
+    python -m benchmarks.run --baseline benchmarks/results/previous.json
+
+Stops are random points inside Switzerland. Google APIs are answered by
+benchmarks.fixtures.MockGoogleMaps, and the app uses a throwaway SQLite
+database unless --database-url is given, so no network or real data is
+touched. Results are written as JSON; --baseline prints the ratio of each
+headline number to an earlier run.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.fixtures import GOOGLE_MAPS_PREFIX, MockGoogleMaps, mst_weight, stop_addresses, swiss_coordinates
+
+DEFAULT_SIZES = (10, 25, 50, 100, 250, 500, 1000, 2000)
+# The mocked API pipelines fetch and cache n^2 elements; above this they are skipped
+DEFAULT_MATRIX_MAX_STOPS = 250
+DEFAULT_E2E_MAX_STOPS = 250
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Numbers compared against --baseline: (section, case, field)
+HEADLINE = (
+    ('solver', 'nearest_neighbor', 'ms'),
+    ('solver', 'solve', 'ms'),
+    ('solver', 'solve', 'peak_kb'),
+    ('solver', 'solve', 'gap'),
+    ('solver', 'solve_budget', 'gap'),
+    ('solver', 'solve_candidates', 'ms'),
+    ('solver', 'solve_candidates', 'peak_kb'),
+    ('solver', 'solve_candidates', 'gap'),
+    ('solver', 'solve_candidates_budget', 'gap'),
+    ('matrix', 'haversine', 'ms'),
+    ('matrix', 'google_cold', 'ms'),
+    ('matrix', 'google_warm', 'ms'),
+    ('e2e', 'cold', 'ms'),
+    ('e2e', 'warm', 'ms'),
+)
+
+
+def _timed(fn, repeat):
+    """Result of the last call and the median wall time in ms over repeat calls."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - started) * 1000.0)
+    return result, statistics.median(times)
+
+
+def _peak_kb(fn):
+    """Peak Python/NumPy allocation of one call, in KiB (separate run: tracing slows the code)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024.0, 1)
+
+
+def _locations(coordinates):
+    return [f'{lat},{lng}' for lat, lng in coordinates]
+
+
+def _solve_candidates(locations, k, budget_ms=0, seed=None):
+    from distance_matrix import get_pair_costs, nearest_candidates, planar_points
+    from optimizer import solve_candidates
+
+    points = planar_points(locations)
+    neighbors = nearest_candidates(points, k)
+    distances, _ = get_pair_costs(locations, np.repeat(np.arange(len(locations)), neighbors.shape[1]),
+                                  neighbors.ravel(), provider='haversine')
+    return solve_candidates(neighbors, distances.reshape(neighbors.shape), points, is_loop_route=True,
+                            max_solve_ms=budget_ms, seed=seed)['path']
+
+
+def bench_solver(coordinates, repeat, budget_ms, seed):
+    from app import app
+    from distance_matrix import haversine_matrix
+    from optimizer import nearest_neighbor, route_cost, solve
+
+    # A loop route is solved over the stops plus the start's duplicate, as in the pipeline
+    locations = _locations(np.vstack([coordinates, coordinates[:1]]))
+    matrix, _ = haversine_matrix(locations)
+    bound = mst_weight(matrix[:-1, :-1])
+    k = app.config['LARGE_ROUTE_CANDIDATES']
+    # solve_candidates includes the grid index and the candidate cost lookups
+    cases = {
+        'nearest_neighbor': lambda: nearest_neighbor(matrix, is_loop_route=True),
+        'solve': lambda: solve(matrix, is_loop_route=True)['path'],
+        'solve_candidates': lambda: _solve_candidates(locations, k),
+    }
+    if budget_ms:
+        cases['solve_budget'] = lambda: solve(matrix, is_loop_route=True, max_solve_ms=budget_ms, seed=seed)['path']
+        cases['solve_candidates_budget'] = lambda: _solve_candidates(locations, k, budget_ms, seed)
+
+    results = {'lower_bound_m': round(bound, 1)}
+    for name, run in cases.items():
+        budgeted = name.endswith('_budget')
+        path, ms = _timed(run, 1 if budgeted else repeat)
+        length = route_cost(matrix, path)
+        results[name] = {
+            'ms': round(ms, 3),
+            'peak_kb': None if budgeted else _peak_kb(run),
+            'length_m': round(length, 1),
+            'gap': round(length / bound, 4) if bound else None
+        }
+    return results
+
+
+def bench_matrix(coordinates, repeat, mock, include_google):
+    from distance_matrix import get_distance_matrix
+
+    locations = _locations(coordinates)
+    results = {}
+    _, ms = _timed(lambda: get_distance_matrix(locations, provider='haversine'), repeat)
+    results['haversine'] = {'ms': round(ms, 3), 'peak_kb': _peak_kb(
+        lambda: get_distance_matrix(locations, provider='haversine'))}
+    if not include_google:
+        return results
+
+    # Cold: every element is fetched from the mock and written to travel_time_cache; warm: all cached
+    for name in ('google_cold', 'google_warm'):
+        before = dict(mock.calls)
+        stats = {}
+        _, ms = _timed(lambda: get_distance_matrix(locations, 'benchmark', stats=stats, provider='google'), 1)
+        results[name] = {
+            'ms': round(ms, 3),
+            'requests': mock.calls['distance_matrix'] - before['distance_matrix'],
+            'hits': stats.get('hits'),
+            'misses': stats.get('misses')
+        }
+    return results
+
+
+def _server_timing(header):
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, rest = entry.strip().partition(';dur=')
+        if name and rest:
+            stages[name] = float(rest.split(';')[0])
+    return stages
+
+
+def bench_e2e(client, addresses):
+    """POST /optimize twice for the same stops: cold caches, then warm geocode and travel-time caches."""
+    payload = {'addresses': list(addresses), 'is_loop_route': True}
+    results = {}
+    for name in ('cold', 'warm'):
+        started = time.perf_counter()
+        response = client.post('/optimize', json=payload)
+        ms = (time.perf_counter() - started) * 1000.0
+        body = response.get_json() or {}
+        results[name] = {
+            'status': response.status_code,
+            'ms': round(ms, 3),
+            'stages_ms': _server_timing(response.headers.get('Server-Timing')),
+            'total_distance_m': body.get('total_distance')
+        }
+    return results
+
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args)
+    }
+
+
+def _lookup(results, stops, section, case, field):
+    for entry in results:
+        if entry['stops'] == stops:
+            return ((entry.get(section) or {}).get(case) or {}).get(field)
+    return None
+
+
+def compare(current, baseline):
+    """Print current / baseline for each headline number present in both runs."""
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for entry in current['results']:
+        for section, case, field in HEADLINE:
+            now = _lookup(current['results'], entry['stops'], section, case, field)
+            before = _lookup(baseline['results'], entry['stops'], section, case, field)
+            if now is not None and before:
+                print(f"  {entry['stops']:>5} stops  {section}.{case}.{field:<8} "
+                      f"{before:>12.3f} -> {now:>12.3f}  x{now / before:.2f}")
+
+
+def _summary_line(entry):
+    solver = entry['solver']
+    parts = [f"{entry['stops']:>5} stops",
+             f"nn {solver['nearest_neighbor']['ms']:.1f} ms",
+             f"solve {solver['solve']['ms']:.1f} ms gap {solver['solve']['gap']:.3f}",
+             f"candidates {solver['solve_candidates']['ms']:.1f} ms gap {solver['solve_candidates']['gap']:.3f}"]
+    if 'solve_budget' in solver:
+        parts.append(f"budget gap {solver['solve_budget']['gap']:.3f}/{solver['solve_candidates_budget']['gap']:.3f}")
+    if 'google_cold' in entry['matrix']:
+        parts.append(f"matrix {entry['matrix']['google_cold']['ms']:.0f}/{entry['matrix']['google_warm']['ms']:.0f} ms")
+    if entry.get('e2e'):
+        parts.append(f"/optimize {entry['e2e']['cold']['ms']:.0f}/{entry['e2e']['warm']['ms']:.0f} ms")
+    return '  '.join(parts)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='stop counts')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per solver case (median reported)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budget-ms', type=int, default=0,
+                        help='also run the iterated local search with this max_solve_ms')
+    parser.add_argument('--matrix-max-stops', type=int, default=DEFAULT_MATRIX_MAX_STOPS)
+    parser.add_argument('--e2e-max-stops', type=int, default=DEFAULT_E2E_MAX_STOPS)
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help='simulated latency per API call')
+    parser.add_argument('--database-url', help='database for the app (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.TemporaryDirectory(prefix='easyroute-bench-')
+    # The app reads these at import time
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir.name, 'benchmark.db')}"
+    os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'benchmark')
+    os.environ['DISTANCE_PROVIDER'] = 'google'
+    os.environ['DISTANCE_PROVIDER_FALLBACK'] = ''
+
+    from app import app, http_session
+    import directions
+
+    app.config['SERVER_TIMING'] = True
+    # The warm e2e run measures the pipeline on warm caches, not the identical-request result cache
+    app.config['OPTIMIZE_DEDUP_TTL_SECONDS'] = 0
+    mock = MockGoogleMaps({}, detour_factor=app.config['HAVERSINE_DETOUR_FACTOR'],
+                          speed_kmh=app.config['HAVERSINE_SPEED_KMH'], latency_ms=args.api_latency_ms)
+    http_session.mount(GOOGLE_MAPS_PREFIX, mock)
+    client = app.test_client()
+
+    results = []
+    for stops in args.sizes:
+        coordinates = swiss_coordinates(stops, seed=args.seed + stops)
+        with app.app_context():
+            entry = {
+                'stops': stops,
+                'solver': bench_solver(coordinates, args.repeat, args.budget_ms, args.seed),
+                'matrix': bench_matrix(coordinates, args.repeat, mock, stops <= args.matrix_max_stops),
+                'e2e': None
+            }
+        if stops <= args.e2e_max_stops:
+            addresses = stop_addresses(swiss_coordinates(stops, seed=args.seed + stops + 1),
+                                       prefix=f'Benchmark {args.seed}-{stops} stop')
+            mock.addresses.update(addresses)
+            entry['e2e'] = bench_e2e(client, addresses)
+        results.append(entry)
+        print(_summary_line(entry), flush=True)
+
+    report = {'meta': _metadata(args), 'mock_api_calls': mock.calls, 'results': results}
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+    # Saved routes get their directions in the background; let that finish before the database goes
+    directions.wait_for_backfill()
+    workdir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import codecs
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import insert
+
+from app import app, db
+from models import Contact
+from geocoding import geocode_addresses
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('business_name', 'contact_name', 'address', 'notes')
+REQUIRED_FIELDS = ('business_name', 'contact_name', 'address')
+MAX_LENGTHS = {
+    'business_name': Contact.business_name.type.length,
+    'contact_name': Contact.contact_name.type.length,
+    'address': Contact.address.type.length
+}
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def detect_format(requested=None, content_type=None, filename=None):
+    """csv or jsonl from an explicit choice, the upload's file name or its content type."""
+    if requested:
+        if requested not in FORMATS:
+            raise ImportFormatError(f'Unknown format: {requested}')
+        return requested
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    if content_type and ('json' in content_type):
+        return 'jsonl'
+    return 'csv'
+
+
+def detach_upload(upload):
+    """Copy a multipart upload (already spooled by Werkzeug) to a file that outlives the request.
+
+    Flask closes request.files when the view returns, before a streamed
+    response is consumed; raw request bodies don't need this.
+    """
+    detached = tempfile.TemporaryFile()
+    shutil.copyfileobj(upload.stream, detached)
+    detached.seek(0)
+    return detached
+
+
+def _lines(stream, chunk_size=64 * 1024):
+    """Decode a binary stream incrementally and yield its lines."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _records(stream, fmt):
+    """Yield (line_number, record or None, error or None) from a CSV or JSONL upload."""
+    if fmt == 'jsonl':
+        for number, line in enumerate(_lines(stream), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield number, None, 'Each line must be a JSON object'
+                continue
+            yield number, record, None
+    else:
+        reader = csv.DictReader(_lines(stream))
+        missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ImportFormatError(f'CSV header is missing: {", ".join(missing)}')
+        for record in reader:
+            # Header is line 1; quoted newlines make reader.line_num the accurate count
+            yield reader.line_num, record, None
+
+
+def validate(record):
+    """Cleaned contact values for one record, or raise ValueError naming the problem."""
+    values = {}
+    for field in FIELDS:
+        value = record.get(field)
+        value = '' if value is None else str(value).strip()
+        if field in REQUIRED_FIELDS and not value:
+            raise ValueError(f'{field} is required')
+        if field in MAX_LENGTHS and len(value) > MAX_LENGTHS[field]:
+            raise ValueError(f'{field} is longer than {MAX_LENGTHS[field]} characters')
+        values[field] = value
+    values['notes'] = values['notes'] or None
+    return values
+
+
+def _prewarm_geocoding(addresses, api_key):
+    _, errors = geocode_addresses(addresses, api_key)
+    return len(errors)
+
+
+def import_contacts(stream, fmt, geocode=False, batch_size=None):
+    """Stream contacts from an upload into the database, yielding progress events.
+
+    Rows are validated one by one and inserted with one bulk INSERT per
+    batch; invalid rows are reported and skipped. With geocode set, each
+    batch's addresses are geocoded to warm the geocode cache for later
+    routes. Events are dicts with a type of error, progress or summary.
+    """
+    batch_size = batch_size or app.config["CONTACT_IMPORT_BATCH_SIZE"]
+    max_errors = app.config["CONTACT_IMPORT_MAX_REPORTED_ERRORS"]
+    counts = {'rows': 0, 'imported': 0, 'invalid': 0, 'geocode_failures': 0}
+    batch = []
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if geocode and not api_key:
+        app.logger.error("Google Maps API key not found in environment variables")
+        yield {'type': 'error', 'error': 'Geocoding is not configured, importing without it'}
+        geocode = False
+
+    def flush():
+        db.session.execute(insert(Contact), batch)
+        db.session.commit()
+        counts['imported'] += len(batch)
+        if geocode:
+            counts['geocode_failures'] += _prewarm_geocoding([row['address'] for row in batch], api_key)
+        batch.clear()
+        return {'type': 'progress', **counts}
+
+    try:
+        for line, record, error in _records(stream, fmt):
+            counts['rows'] += 1
+            if error is None:
+                try:
+                    batch.append(validate(record))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                counts['invalid'] += 1
+                if counts['invalid'] <= max_errors:
+                    yield {'type': 'error', 'line': line, 'error': error}
+            if len(batch) >= batch_size:
+                yield flush()
+        if batch:
+            yield flush()
+    except ImportFormatError as e:
+        yield {'type': 'error', 'error': str(e), **counts}
+        return
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Contact import failed after {counts['imported']} rows: {str(e)}")
+        yield {'type': 'error', 'error': 'Import aborted', **counts}
+        return
+
+    app.logger.info(f"Imported {counts['imported']} contacts ({counts['invalid']} invalid rows)")
+    yield {'type': 'summary', **counts}
+
+
+def export_contacts(fmt, chunk_rows=500):
+    """Yield all contacts as CSV or JSONL text chunks, reading the table in batches."""
+    query = db.session.query(*[getattr(Contact, field) for field in ('id',) + FIELDS]) \
+        .order_by(Contact.id).execution_options(yield_per=chunk_rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(FIELDS)
+
+    for count, row in enumerate(query, start=1):
+        values = dict(zip(FIELDS, row[1:]))
+        if fmt == 'csv':
+            writer.writerow([values[field] or '' for field in FIELDS])
+        else:
+            buffer.write(json.dumps(values) + '\n')
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
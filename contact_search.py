@@ -0,0 +1,237 @@
+import re
+
+from sqlalchemy import text, func
+from sqlalchemy.exc import DBAPIError
+
+from app import app, db
+from models import Contact
+
+# Searched columns and their weight in the ranking
+SEARCH_FIELDS = (('business_name', 3.0), ('contact_name', 2.0), ('address', 1.0))
+# Rows fetched from the index before re-ranking in Python
+CANDIDATE_LIMIT = 50
+MIN_TRIGRAM_TERM = 3
+# Typo matching skips trigrams found in more rows than this (unless none are rarer)
+FUZZY_MAX_TRIGRAM_ROWS = 2000
+
+_backend = None
+
+_SQLITE_SETUP = (
+    """CREATE VIRTUAL TABLE contact_fts USING fts5(
+        business_name, contact_name, address,
+        content='contact', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS contact_fts_insert AFTER INSERT ON contact BEGIN
+        INSERT INTO contact_fts(rowid, business_name, contact_name, address)
+        VALUES (new.id, new.business_name, new.contact_name, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS contact_fts_delete AFTER DELETE ON contact BEGIN
+        INSERT INTO contact_fts(contact_fts, rowid, business_name, contact_name, address)
+        VALUES ('delete', old.id, old.business_name, old.contact_name, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS contact_fts_update AFTER UPDATE ON contact BEGIN
+        INSERT INTO contact_fts(contact_fts, rowid, business_name, contact_name, address)
+        VALUES ('delete', old.id, old.business_name, old.contact_name, old.address);
+        INSERT INTO contact_fts(rowid, business_name, contact_name, address)
+        VALUES (new.id, new.business_name, new.contact_name, new.address);
+    END""",
+    "INSERT INTO contact_fts(contact_fts) VALUES ('rebuild')",
+)
+_SQLITE_VOCAB = "CREATE VIRTUAL TABLE IF NOT EXISTS contact_fts_vocab USING fts5vocab(contact_fts, 'row')"
+
+
+def install():
+    """Create the search index for the current database and remember which one is in use.
+
+    SQLite gets an FTS5 trigram table kept in sync by triggers; PostgreSQL
+    gets pg_trgm GIN indexes. Anything else (or a SQLite build without
+    FTS5 trigram support) falls back to prefix matching.
+    """
+    global _backend
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as connection:
+            if dialect == 'sqlite':
+                exists = connection.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contact_fts'")).first()
+                if not exists:
+                    app.logger.info("Creating contact_fts search index")
+                    for statement in _SQLITE_SETUP:
+                        connection.execute(text(statement))
+                connection.execute(text(_SQLITE_VOCAB))
+                _backend = 'fts5'
+            elif dialect == 'postgresql':
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for field, _ in SEARCH_FIELDS:
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_contact_{field}_trgm "
+                        f"ON contact USING gin ({field} gin_trgm_ops)"))
+                _backend = 'trgm'
+    except DBAPIError as e:
+        app.logger.warning(f"Contact search index unavailable, using prefix matching: {e}")
+        _backend = None
+
+
+def _words(term):
+    return [word for word in re.split(r'[\s,]+', (term or '').lower()) if word]
+
+
+def _fts_phrase(word):
+    return '"' + word.replace('"', '""') + '"'
+
+
+def _trigrams(word):
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _fts_candidate_ids(words, limit):
+    long_words = [word for word in words if len(word) >= MIN_TRIGRAM_TERM]
+    # Substring match of every word: no ranking in SQL so the scan stops at the limit
+    ids = [row[0] for row in db.session.execute(
+        text("SELECT rowid FROM contact_fts WHERE contact_fts MATCH :query LIMIT :limit"),
+        {'query': ' AND '.join(_fts_phrase(word) for word in long_words), 'limit': CANDIDATE_LIMIT}
+    )]
+    if len(ids) >= limit:
+        return ids
+
+    # Typo tolerance: per word, any of its trigrams; words are AND-ed (OR-ed if
+    # that finds too little) and the best bm25 rows kept. Very common trigrams
+    # would make bm25 score a large share of the table, so a word uses only its
+    # rarer ones, or its single rarest one.
+    word_grams = [sorted({word[i:i + 3] for i in range(len(word) - 2)}) for word in long_words]
+    frequency = dict(db.session.execute(
+        text("SELECT term, doc FROM contact_fts_vocab WHERE term IN :terms").bindparams(
+            db.bindparam('terms', expanding=True)),
+        {'terms': sorted({gram for grams in word_grams for gram in grams})}
+    ).all())
+    clauses = []
+    for grams in word_grams:
+        grams = [gram for gram in grams if gram in frequency]
+        rare = [gram for gram in grams if frequency[gram] <= FUZZY_MAX_TRIGRAM_ROWS]
+        if grams:
+            selected = rare or [min(grams, key=frequency.get)]
+            clauses.append('(' + ' OR '.join(_fts_phrase(gram) for gram in selected) + ')')
+
+    if not clauses:
+        return ids
+    for operator in ((' AND ', ' OR ') if len(clauses) > 1 else (' AND ',)):
+        fuzzy = db.session.execute(
+            text("SELECT rowid FROM contact_fts WHERE contact_fts MATCH :query "
+                 "ORDER BY bm25(contact_fts, 3.0, 2.0, 1.0) LIMIT :limit"),
+            {'query': operator.join(clauses), 'limit': CANDIDATE_LIMIT}
+        )
+        ids = list(dict.fromkeys(ids + [row[0] for row in fuzzy]))
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def _trgm_candidate_ids(words):
+    query = ' '.join(words)
+    similar = ' OR '.join(f':query <% {field}' for field, _ in SEARCH_FIELDS)
+    best = ', '.join(f'word_similarity(:query, {field})' for field, _ in SEARCH_FIELDS)
+    return [row[0] for row in db.session.execute(
+        text(f"SELECT id FROM contact WHERE {similar} ORDER BY GREATEST({best}) DESC LIMIT :limit"),
+        {'query': query, 'limit': CANDIDATE_LIMIT}
+    )]
+
+
+def _candidate_query():
+    # Only the columns suggestions need; rows expose them as attributes like Contact
+    return db.session.query(Contact.id, *[getattr(Contact, field) for field, _ in SEARCH_FIELDS])
+
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _word_prefix_match(field, word):
+    # word starts the field or a word in it (words split on spaces and commas, like _words)
+    value = func.lower(getattr(Contact, field))
+    word = _like_escape(word)
+    return db.or_(*[value.like(pattern, escape='\\') for pattern in (f'{word}%', f'% {word}%', f'%,{word}%')])
+
+
+def _fts_word_start_ids(word):
+    # A two-character word after a space or comma is a trigram the index holds
+    return [row[0] for row in db.session.execute(
+        text("SELECT rowid FROM contact_fts WHERE contact_fts MATCH :query LIMIT :limit"),
+        {'query': ' OR '.join(_fts_phrase(separator + word) for separator in ' ,'), 'limit': CANDIDATE_LIMIT}
+    )]
+
+
+def _prefix_candidates(words):
+    """Candidates for terms too short for trigrams: every word starts a word of some field.
+
+    Rows where the whole term starts a field come from range scans on the
+    lower(...) indexes. Words starting later in a field come from the
+    trigram index for a single two-character word, else from a scan that
+    stops at CANDIDATE_LIMIT.
+    """
+    prefix = ' '.join(words)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    contacts = _candidate_query().filter(db.or_(*[
+        db.and_(func.lower(getattr(Contact, field)) >= prefix, func.lower(getattr(Contact, field)) < upper)
+        for field, _ in SEARCH_FIELDS
+    ])).limit(CANDIDATE_LIMIT).all()
+    if len(contacts) >= CANDIDATE_LIMIT:
+        return contacts
+
+    if _backend == 'fts5' and len(words) == 1 and len(words[0]) == 2:
+        ids = _fts_word_start_ids(words[0])
+        word_starts = _candidate_query().filter(Contact.id.in_(ids)).all() if ids else []
+    else:
+        word_starts = _candidate_query().filter(*[
+            db.or_(*[_word_prefix_match(field, word) for field, _ in SEARCH_FIELDS]) for word in words
+        ]).limit(CANDIDATE_LIMIT).all()
+    found = {contact.id for contact in contacts}
+    return contacts + [contact for contact in word_starts if contact.id not in found]
+
+
+def _word_score(word, value):
+    value = (value or '').lower()
+    if value.startswith(word):
+        return 1.0
+    tokens = _words(value)
+    if any(token.startswith(word) for token in tokens):
+        return 0.9
+    if word in value:
+        return 0.75
+    grams = _trigrams(word)
+    best = 0.0
+    for token in tokens:
+        for candidate in (token, token[:len(word)]):
+            other = _trigrams(candidate)
+            best = max(best, len(grams & other) / len(grams | other))
+    return 0.7 * best
+
+
+def score(words, contact):
+    """Relevance of a contact: per word, the best weighted match over the searched fields."""
+    return sum(max(weight * _word_score(word, getattr(contact, field)) for field, weight in SEARCH_FIELDS)
+               for word in words)
+
+
+def search(term, limit=5):
+    """Contact rows (id and searched fields) matching term, best first.
+
+    Tolerant of partial words and small typos; terms shorter than three
+    characters match the start of any word.
+    """
+    words = _words(term)
+    if not words:
+        return []
+
+    if _backend == 'fts5' and any(len(word) >= MIN_TRIGRAM_TERM for word in words):
+        ids = _fts_candidate_ids(words, limit)
+        contacts = _candidate_query().filter(Contact.id.in_(ids)).all() if ids else []
+    elif _backend == 'trgm' and any(len(word) >= MIN_TRIGRAM_TERM for word in words):
+        ids = _trgm_candidate_ids(words)
+        contacts = _candidate_query().filter(Contact.id.in_(ids)).all() if ids else []
+    else:
+        contacts = _prefix_candidates(words)
+
+    scored = [(score(words, contact), contact) for contact in contacts]
+    scored.sort(key=lambda item: (-item[0], len(item[1].business_name), item[1].id))
+    return [contact for relevance, contact in scored if relevance > 0][:limit]
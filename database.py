@@ -0,0 +1,53 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def database_url(url):
+    """SQLAlchemy URL for url; accepts the postgres:// scheme many hosts hand out."""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def _is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for config's database.
+
+    Server databases get a sized, pre-pinged, recycled connection pool.
+    SQLite keeps SQLAlchemy's defaults; its tuning happens per connection
+    in install_sqlite_pragmas.
+    """
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": True,
+    }
+
+
+def install_sqlite_pragmas(engine, config):
+    """Set the SQLITE_* pragmas on every new connection of a file-backed SQLite engine.
+
+    WAL lets readers run alongside the single writer and, with
+    synchronous=NORMAL, makes each commit an append to the log instead of
+    a rewrite plus fsync of the database file. busy_timeout makes a second
+    writer wait for the lock instead of failing with "database is locked".
+    """
+    if not _is_sqlite_file(str(engine.url)):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.close()
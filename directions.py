@@ -0,0 +1,241 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db, http_session
+from models import Route
+
+DIRECTIONS_URL = 'https://maps.googleapis.com/maps/api/directions/json'
+# Route fields the geometry is derived from; changing them without new geometry drops it
+SOURCE_FIELDS = ('coordinates', 'stop_order')
+
+# Background directions fetches for saved routes; one batch at a time
+_backfill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='directions-backfill')
+_backfill_pending = set()
+_backfill_lock = threading.Lock()
+
+
+class DirectionsError(Exception):
+    pass
+
+
+def encode_polyline(points):
+    """[(lat, lng), ...] -> Google encoded polyline string (5 decimals)."""
+    chunks = []
+    previous = (0, 0)
+    for lat, lng in points:
+        current = (int(round(lat * 1e5)), int(round(lng * 1e5)))
+        for delta in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous = current
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded):
+    """Google encoded polyline string -> [(lat, lng), ...]."""
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / 1e5, lng / 1e5))
+    return points
+
+
+def _extend(path, points):
+    # Consecutive pieces share their joining point
+    if path and points and path[-1] == points[0]:
+        points = points[1:]
+    path.extend(points)
+
+
+def segments(count, max_waypoints):
+    """Split stops 0..count-1 into (start, end) index ranges of at most max_waypoints + 2 stops.
+
+    Consecutive segments share their boundary stop, so the legs of all
+    segments together are exactly the count - 1 legs of the route.
+    """
+    step = max_waypoints + 1
+    return [(start, min(start + step, count - 1)) for start in range(0, count - 1, step)]
+
+
+def _fetch_segment(points, api_key, mode, timeout):
+    """Directions for one segment: a decoded point list per leg."""
+    location = lambda point: f"{point[0]},{point[1]}"
+    params = {
+        'origin': location(points[0]),
+        'destination': location(points[-1]),
+        'mode': mode,
+        'key': api_key
+    }
+    if len(points) > 2:
+        params['waypoints'] = '|'.join(location(point) for point in points[1:-1])
+    response = http_session.get(DIRECTIONS_URL, params=params, timeout=timeout)
+    result = response.json()
+
+    if result['status'] != 'OK':
+        raise DirectionsError(f"Directions API failed: {result['status']}")
+
+    legs = []
+    for leg in result['routes'][0]['legs']:
+        path = []
+        for step in leg['steps']:
+            _extend(path, decode_polyline(step['polyline']['points']))
+        legs.append(path)
+    if len(legs) != len(points) - 1:
+        raise DirectionsError(f"Directions API returned {len(legs)} legs for {len(points)} stops")
+    return legs
+
+
+def _stitch(legs):
+    path = []
+    for leg in legs:
+        _extend(path, leg)
+    return encode_polyline(path), [encode_polyline(leg) for leg in legs]
+
+
+def routes_directions(point_lists, api_key, mode='driving'):
+    """Road geometry through each list of points in order, as (polyline, [leg polyline, ...]) or an exception.
+
+    Routes longer than the DIRECTIONS_MAX_WAYPOINTS limit are requested in
+    segments. The segments of all routes share one pool of concurrent
+    requests on the shared HTTP session and are stitched back per route. A
+    failed segment fails only its own route, whose entry is the exception.
+    """
+    if not api_key:
+        raise ValueError("API key is required for directions")
+    timeout = app.config["GOOGLE_API_TIMEOUT"]
+    point_lists = [[tuple(point) for point in points] for points in point_lists]
+    tasks = [(number, start, end) for number, points in enumerate(point_lists)
+             for start, end in segments(len(points), app.config["DIRECTIONS_MAX_WAYPOINTS"])]
+
+    def fetch(task):
+        number, start, end = task
+        try:
+            return _fetch_segment(point_lists[number][start:end + 1], api_key, mode, timeout)
+        except Exception as e:
+            return e
+
+    legs = [[] for _ in point_lists]
+    errors = [None] * len(point_lists)
+    max_workers = max(min(app.config["DIRECTIONS_MAX_WORKERS"], len(tasks)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (number, _, _), segment_legs in zip(tasks, executor.map(fetch, tasks)):
+            if isinstance(segment_legs, Exception):
+                errors[number] = errors[number] or segment_legs
+            else:
+                legs[number].extend(segment_legs)
+    return [errors[number] or _stitch(legs[number]) for number in range(len(point_lists))]
+
+
+def route_directions(points, api_key, mode='driving'):
+    """Road geometry through points in order: (polyline, [leg polyline, ...]), both encoded.
+
+    Raises DirectionsError.
+    """
+    result = routes_directions([points], api_key, mode)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def store_routes_directions(routes, api_key):
+    """Fill polyline and leg_polylines along each route's optimized order and stamp directions_fetched_at.
+
+    Failures are logged and leave that route's geometry empty but stamped,
+    so it is not fetched again until its stops change; the map then uses
+    client-side directions or straight lines. Returns how many were stored.
+    """
+    routes = [route for route in routes if len(route.optimized_coordinates() or []) >= 2]
+    if not routes or not api_key:
+        return 0
+    results = routes_directions([route.optimized_coordinates() for route in routes], api_key)
+    stored = 0
+    for route, result in zip(routes, results):
+        route.directions_fetched_at = datetime.utcnow()
+        if isinstance(result, Exception):
+            app.logger.warning(f"Directions for route {route.id} failed: {str(result)}")
+            route.polyline = route.leg_polylines = None
+        else:
+            route.polyline, route.leg_polylines = result
+            stored += 1
+    return stored
+
+
+def skip_directions(routes):
+    """Stamp routes as fetched without geometry, so neither save nor backfill calls the Directions API.
+
+    For routes built from an offline distance provider; the map draws them
+    with client-side directions or straight lines.
+    """
+    for route in routes:
+        route.polyline = route.leg_polylines = None
+        route.directions_fetched_at = datetime.utcnow()
+
+
+def _backfill(route_ids):
+    with app.app_context():
+        try:
+            routes = [db.session.get(Route, route_id) for route_id in route_ids]
+            routes = [route for route in routes if route is not None and route.directions_fetched_at is None]
+            if routes:
+                store_routes_directions(routes, app.config["GOOGLE_MAPS_API_KEY"])
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Directions backfill for routes {route_ids} failed: {str(e)}")
+        finally:
+            with _backfill_lock:
+                _backfill_pending.difference_update(route_ids)
+
+
+def request_backfill(routes):
+    """Queue a background directions fetch for the routes that have none yet.
+
+    Called after a route is committed, so saving never waits on the
+    Directions API, and when older routes are viewed. Routes that were
+    already attempted (directions_fetched_at set) are skipped, whether or
+    not that attempt succeeded.
+    """
+    route_ids = [route.id for route in routes
+                 if route.directions_fetched_at is None and route.optimized_coordinates()]
+    with _backfill_lock:
+        route_ids = [route_id for route_id in route_ids if route_id not in _backfill_pending]
+        _backfill_pending.update(route_ids)
+    if route_ids:
+        _backfill_executor.submit(_backfill, route_ids)
+
+
+
+def wait_for_backfill():
+    """Block until every queued background fetch has finished."""
+    _backfill_executor.submit(lambda: None).result()
+
+
+@event.listens_for(Session, 'before_flush')
+def _drop_stale_geometry(session, flush_context, instances):
+    for route in session.dirty:
+        if not isinstance(route, Route) or route.directions_fetched_at is None:
+            continue
+        state = db.inspect(route).attrs
+        if (any(state[field].history.has_changes() for field in SOURCE_FIELDS)
+                and not state.directions_fetched_at.history.has_changes()):
+            route.polyline = route.leg_polylines = route.directions_fetched_at = None
@@ -0,0 +1,614 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import event, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import requests
+
+from app import app, db, http_session
+from models import TravelTimeCache
+import metrics
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+CACHE_QUERY_CHUNK = 500
+# Above this many distinct destination sets, _cache_queries chunks origins instead of grouping them
+CACHE_QUERY_GROUPS = 32
+EARTH_RADIUS_M = 6371008.8
+
+
+class DistanceMatrixError(Exception):
+    pass
+
+
+def plan_tiles(n_origins, n_destinations, max_elements=None, max_dimension=None):
+    """Split an origins x destinations problem into API-sized tiles.
+
+    Picks the tile shape that needs the fewest requests while respecting the
+    per-request element limit and the per-side origin/destination limit.
+    Returns a list of (row_start, row_end, col_start, col_end) slices.
+    """
+    max_elements = max_elements or app.config["DISTANCE_MATRIX_MAX_ELEMENTS"]
+    max_dimension = max_dimension or app.config["DISTANCE_MATRIX_MAX_DIMENSION"]
+
+    best = None
+    for cols in range(1, min(n_destinations, max_dimension) + 1):
+        rows = min(n_origins, max_dimension, max_elements // cols)
+        if rows < 1:
+            break
+        requests_needed = math.ceil(n_origins / rows) * math.ceil(n_destinations / cols)
+        if best is None or requests_needed < best[0]:
+            best = (requests_needed, rows, cols)
+
+    _, rows, cols = best
+    return [(r, min(r + rows, n_origins), c, min(c + cols, n_destinations))
+            for r in range(0, n_origins, rows)
+            for c in range(0, n_destinations, cols)]
+
+
+def _fetch_tile(origins, destinations, api_key, mode, timeout):
+    params = {
+        'origins': '|'.join(origins),
+        'destinations': '|'.join(destinations),
+        'key': api_key,
+        'mode': mode
+    }
+    response = http_session.get(DISTANCE_MATRIX_URL, params=params, timeout=timeout)
+    result = response.json()
+
+    if result['status'] != 'OK':
+        raise DistanceMatrixError(f"Distance Matrix API failed: {result['status']}")
+
+    elements = [element for row in result['rows'] for element in row['elements']]
+    shape = (len(origins), len(destinations))
+    ok = np.array([element['status'] == 'OK' for element in elements]).reshape(shape)
+    distances = np.array([element['distance']['value'] if element['status'] == 'OK' else np.nan
+                          for element in elements], dtype=float).reshape(shape)
+    durations = np.array([element['duration']['value'] if element['status'] == 'OK' else np.nan
+                          for element in elements], dtype=float).reshape(shape)
+    return ok, distances, durations
+
+
+def coordinate_key(location):
+    """Canonical "lat,lng" string (6 decimals, ~10 cm) used as the pair cache key."""
+    lat, lng = (float(part) for part in location.split(','))
+    return f"{lat:.6f},{lng:.6f}"
+
+
+def _cache_queries(keys, wanted):
+    """(origin indices, destination keys) per cache query covering the wanted pairs.
+
+    Origins wanting the same destinations (e.g. the old stops of a route
+    that gained one stop, or the stops of one route in a batch) are queried
+    together, so a few full rows do not widen the others' destination list.
+    With many distinct sets (candidate lists) origins are chunked and each
+    query reads the union of its chunk's destinations.
+    """
+    if wanted is None:
+        groups = [(list(range(len(keys))), None)]
+    else:
+        by_targets = {}
+        for i, targets in wanted.items():
+            by_targets.setdefault(frozenset(targets), []).append(i)
+        if len(by_targets) <= CACHE_QUERY_GROUPS:
+            groups = [(origins, targets) for targets, origins in by_targets.items()]
+        else:
+            groups = [(list(wanted), None)]
+    for origins, targets in groups:
+        for start in range(0, len(origins), CACHE_QUERY_CHUNK):
+            chunk = origins[start:start + CACHE_QUERY_CHUNK]
+            if wanted is None:
+                yield chunk, keys
+            else:
+                chunk_targets = targets if targets is not None else set().union(*(wanted[i] for i in chunk))
+                yield chunk, [keys[j] for j in sorted(chunk_targets)]
+
+
+def _load_cached_pairs(keys, mode, wanted=None):
+    """Return ({(origin, destination): (distance, duration)}, {(origin, destination): id}).
+
+    The first dict holds fresh pairs, the second the ids of expired rows to refresh.
+    wanted, an optional {origin index: destination indices} map, limits the
+    lookup to those pairs; by default every pair among keys is read.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=app.config["TRAVEL_TIME_CACHE_TTL_DAYS"])
+    fresh = {}
+    stale = {}
+    index_of = {key: i for i, key in enumerate(keys)}
+    # Pairs fetched earlier in this transaction are not in the table until it commits
+    for (origin, destination, pair_mode), (distance, duration, _) in _staged_pairs(db.session).items():
+        i, j = index_of.get(origin), index_of.get(destination)
+        if pair_mode == mode and i is not None and j is not None and (wanted is None or j in wanted.get(i, ())):
+            fresh[(origin, destination)] = (distance, duration)
+    for chunk, destinations in _cache_queries(keys, wanted):
+        rows = TravelTimeCache.query.with_entities(
+            TravelTimeCache.id,
+            TravelTimeCache.origin,
+            TravelTimeCache.destination,
+            TravelTimeCache.distance,
+            TravelTimeCache.duration,
+            TravelTimeCache.updated_at
+        ).filter(
+            TravelTimeCache.mode == mode,
+            TravelTimeCache.origin.in_([keys[i] for i in chunk]),
+            TravelTimeCache.destination.in_(destinations)
+        ).all()
+        for row in rows:
+            if wanted is not None and index_of[row.destination] not in wanted[index_of[row.origin]]:
+                continue
+            if (row.origin, row.destination) in fresh:
+                continue
+            if row.updated_at and row.updated_at >= cutoff:
+                fresh[(row.origin, row.destination)] = (row.distance, row.duration)
+            else:
+                stale[(row.origin, row.destination)] = row.id
+    return fresh, stale
+
+
+def _staged_pairs(session):
+    return session.info.setdefault('travel_time_pairs', {})
+
+
+def _store_pairs(keys, mode, fetched, stale):
+    """Stage cache rows for fetched (i, j, distance, duration) pairs of keys.
+
+    They are written when the caller commits its transaction, so a fetch
+    never commits the caller's half-built route, and a rollback drops them.
+    """
+    staged = _staged_pairs(db.session)
+    for i, j, distance, duration in fetched:
+        staged[(keys[i], keys[j], mode)] = (float(distance), float(duration), stale.get((keys[i], keys[j])))
+
+
+def _write_staged_pairs(session, staged):
+    """Insert or refresh the staged rows; an upsert where the database has one."""
+    now = datetime.utcnow()
+    rows = [{'origin': origin, 'destination': destination, 'mode': mode, 'distance': distance,
+             'duration': duration, 'updated_at': now}
+            for (origin, destination, mode), (distance, duration, _) in staged.items()]
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(session.get_bind().dialect.name)
+    if dialect is not None:
+        # Concurrent requests may have stored the same pairs since they were read
+        statement = dialect.insert(TravelTimeCache)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['origin', 'destination', 'mode'],
+            set_={field: statement.excluded[field] for field in ('distance', 'duration', 'updated_at')}
+        ), rows)
+        return
+
+    updates = [{'id': row_id, 'distance': row['distance'], 'duration': row['duration'], 'updated_at': now}
+               for row, (_, _, row_id) in zip(rows, staged.values()) if row_id is not None]
+    inserts = [row for row, (_, _, row_id) in zip(rows, staged.values()) if row_id is None]
+    if inserts:
+        session.execute(insert(TravelTimeCache), inserts)
+    if updates:
+        session.execute(update(TravelTimeCache), updates)
+
+
+@event.listens_for(Session, 'before_commit')
+def _commit_staged_pairs(session):
+    staged = session.info.pop('travel_time_pairs', None)
+    if staged:
+        _write_staged_pairs(session, staged)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_staged_pairs(session):
+    session.info.pop('travel_time_pairs', None)
+
+
+def _group_missing(missing):
+    """Group missing (row, col) cells into dense origin x destination blocks.
+
+    Rows that miss the same set of columns share a block, so a new stop in a
+    known route becomes one full row plus one column (2n - 1 elements). A row
+    may also pick up its own diagonal cell when that lets it join a larger
+    block, which keeps a cold matrix at a handful of full-width tiles.
+    """
+    candidates = []
+    counts = {}
+    for i in np.flatnonzero(missing.any(axis=1)):
+        cols = np.flatnonzero(missing[i])
+        exact = tuple(cols)
+        with_diagonal = tuple(np.union1d(cols, [i]))
+        candidates.append((int(i), exact, with_diagonal))
+        counts[exact] = counts.get(exact, 0) + 1
+        counts[with_diagonal] = counts.get(with_diagonal, 0) + 1
+
+    groups = {}
+    for i, exact, with_diagonal in candidates:
+        key = with_diagonal if counts[with_diagonal] > counts[exact] else exact
+        groups.setdefault(key, []).append(i)
+    return [(rows, list(cols)) for cols, rows in groups.items()]
+
+
+def _unique_keys(locations):
+    """Return (keys, {key: index}, inverse): repeated stops (loop routes) share one key."""
+    keys = []
+    index_of = {}
+    inverse = []
+    for location in locations:
+        key = coordinate_key(location)
+        if key not in index_of:
+            index_of[key] = len(keys)
+            keys.append(key)
+        inverse.append(index_of[key])
+    return keys, index_of, np.array(inverse, dtype=int)
+
+
+def _fetch_tiles(keys, tiles, api_key, mode):
+    """Fetch (rows, cols) tiles of keys concurrently, yielding (rows, cols, distances, durations)."""
+    timeout = app.config["GOOGLE_API_TIMEOUT"]
+
+    def fetch(tile):
+        rows, cols = tile
+        return _fetch_tile([keys[i] for i in rows], [keys[j] for j in cols], api_key, mode, timeout)
+
+    max_workers = min(app.config["DISTANCE_MATRIX_MAX_WORKERS"], len(tiles))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (rows, cols), (ok, distances, durations) in zip(tiles, executor.map(fetch, tiles)):
+            if not ok.all():
+                i, j = np.argwhere(~ok)[0]
+                raise DistanceMatrixError(
+                    f"Unable to calculate distance between points {rows[i]} and {cols[j]}")
+            yield rows, cols, distances, durations
+
+
+def google_matrix(locations, api_key, mode='driving', stats=None, required=None):
+    """Build the matrices from Google's Distance Matrix API.
+
+    Pairs already in the travel_time_cache table (within TRAVEL_TIME_CACHE_TTL_DAYS)
+    are served from it; only the missing pairs are fetched, in tiles of several
+    origins x destinations run concurrently on the shared HTTP session. When a
+    stats dict is passed it is filled with element hit/miss and request counts.
+    required, an optional n x n boolean mask, limits the pairs that are looked
+    up at all; cells outside it are left at zero.
+    """
+    if not api_key:
+        raise ValueError("API key is required for distance matrix calculation")
+
+    keys, index_of, inverse = _unique_keys(locations)
+    m = len(keys)
+
+    distance_matrix = np.zeros((m, m))
+    duration_matrix = np.zeros((m, m))
+    if required is None:
+        missing = ~np.eye(m, dtype=bool)
+    else:
+        rows, cols = np.nonzero(required)
+        missing = np.zeros((m, m), dtype=bool)
+        missing[inverse[rows], inverse[cols]] = True
+        np.fill_diagonal(missing, False)
+    wanted = missing.copy()
+
+    # With a mask, read only the cache rows for the pairs it asks for
+    wanted_pairs = None if required is None else {
+        i: set(np.flatnonzero(missing[i]).tolist()) for i in range(m) if missing[i].any()}
+    fresh, stale = _load_cached_pairs(keys, mode, wanted_pairs)
+    for (origin, destination), (distance, duration) in fresh.items():
+        i, j = index_of[origin], index_of[destination]
+        if wanted[i, j]:
+            distance_matrix[i, j] = distance
+            duration_matrix[i, j] = duration
+            missing[i, j] = False
+
+    total = int(wanted.sum())
+    misses = int(missing.sum())
+    tiles = []
+    for rows, cols in _group_missing(missing):
+        for r0, r1, c0, c1 in plan_tiles(len(rows), len(cols)):
+            tiles.append((rows[r0:r1], cols[c0:c1]))
+    app.logger.info(f"Distance matrix {m}x{m}: {total - misses} cached elements, "
+                    f"{misses} to fetch in {len(tiles)} requests")
+    metrics.record_cache('travel_time', hits=total - misses, misses=misses)
+
+    if tiles:
+        fetched = set()
+        for rows, cols, distances, durations in _fetch_tiles(keys, tiles, api_key, mode):
+            block = np.ix_(rows, cols)
+            distance_matrix[block] = distances
+            duration_matrix[block] = durations
+            fetched.update((i, j) for i in rows for j in cols if i != j)
+        np.fill_diagonal(distance_matrix, 0)
+        np.fill_diagonal(duration_matrix, 0)
+        _store_pairs(keys, mode, [(i, j, distance_matrix[i, j], duration_matrix[i, j]) for i, j in fetched],
+                     stale)
+
+    if stats is not None:
+        stats.update({
+            'elements': total,
+            'hits': total - misses,
+            'misses': misses,
+            'requests': len(tiles)
+        })
+
+    if m != len(locations):
+        expand = np.ix_(inverse, inverse)
+        return distance_matrix[expand], duration_matrix[expand]
+    return distance_matrix, duration_matrix
+
+
+def parse_locations(locations):
+    """Return an (n, 2) array of [lat, lng] for "lat,lng" location strings."""
+    return np.array([[float(part) for part in location.split(',')] for location in locations])
+
+
+def _haversine_estimate(lat1, lng1, lat2, lng2):
+    """Road distance and duration estimates between points given in radians (arrays broadcast)."""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    distance = distance * app.config["HAVERSINE_DETOUR_FACTOR"]
+    return distance, distance / (app.config["HAVERSINE_SPEED_KMH"] / 3.6)
+
+
+def haversine_matrix(locations, api_key=None, mode='driving', stats=None, required=None):
+    """Great-circle matrices computed in one broadcast, no network needed.
+
+    Distances are scaled by HAVERSINE_DETOUR_FACTOR to approximate road
+    distance; durations assume HAVERSINE_SPEED_KMH on average.
+    """
+    coords = np.radians(parse_locations(locations))
+    lat = coords[:, 0]
+    lng = coords[:, 1]
+    distance_matrix, duration_matrix = _haversine_estimate(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+
+    if stats is not None:
+        n = len(locations)
+        stats.update({'elements': n * n - n, 'hits': 0, 'misses': 0, 'requests': 0})
+    return distance_matrix, duration_matrix
+
+
+_matrix_file = {'path': None, 'mtime': None, 'data': None}
+_matrix_file_lock = threading.Lock()
+
+
+def save_matrix_file(path, locations, distance_matrix, duration_matrix):
+    """Write matrices in the format read by the "file" provider."""
+    np.savez_compressed(
+        path,
+        locations=np.array([coordinate_key(location) for location in locations]),
+        distance=np.asarray(distance_matrix, dtype=float),
+        duration=np.asarray(duration_matrix, dtype=float)
+    )
+
+
+def _load_matrix_file():
+    path = app.config["DISTANCE_MATRIX_FILE"]
+    if not path:
+        raise DistanceMatrixError("DISTANCE_MATRIX_FILE is not configured")
+    mtime = os.path.getmtime(path)
+    with _matrix_file_lock:
+        if _matrix_file['path'] != path or _matrix_file['mtime'] != mtime:
+            with np.load(path) as archive:
+                keys = [str(key) for key in archive['locations']]
+                _matrix_file['data'] = (
+                    {key: i for i, key in enumerate(keys)},
+                    archive['distance'],
+                    archive['duration']
+                )
+            _matrix_file['path'] = path
+            _matrix_file['mtime'] = mtime
+        return _matrix_file['data']
+
+
+def file_matrix(locations, api_key=None, mode='driving', stats=None, required=None):
+    """Slice the matrices out of a precomputed .npz file (see save_matrix_file)."""
+    index_of, distance, duration = _load_matrix_file()
+    try:
+        indices = [index_of[coordinate_key(location)] for location in locations]
+    except KeyError as e:
+        raise DistanceMatrixError(f"Location {e.args[0]} is not in the precomputed matrix file")
+
+    block = np.ix_(indices, indices)
+    if stats is not None:
+        n = len(locations)
+        stats.update({'elements': n * n - n, 'hits': n * n - n, 'misses': 0, 'requests': 0})
+    return distance[block].astype(float), duration[block].astype(float)
+
+
+PROVIDERS = {
+    'google': google_matrix,
+    'haversine': haversine_matrix,
+    'file': file_matrix,
+}
+# Providers that work without Google; routes built from them get no road geometry either
+OFFLINE_PROVIDERS = ('haversine', 'file')
+
+
+def get_distance_matrix(locations, api_key=None, mode='driving', stats=None, provider=None,
+                        required=None):
+    """Build the n x n distance (m) and duration (s) matrices for "lat,lng" locations.
+
+    provider selects the backend from PROVIDERS and defaults to the
+    DISTANCE_PROVIDER config. If the chosen backend fails and
+    DISTANCE_PROVIDER_FALLBACK names another one, that is used instead.
+    required is an optional boolean mask of the pairs the caller will read;
+    network-backed providers skip the others.
+    """
+    provider = provider or app.config["DISTANCE_PROVIDER"]
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown distance provider: {provider}")
+    return _with_fallback(PROVIDERS, provider, stats, lambda backend: backend(
+        locations, api_key, mode=mode, stats=stats, required=required))
+
+
+def _with_fallback(providers, provider, stats, call):
+    """call(providers[provider]), retried with DISTANCE_PROVIDER_FALLBACK if that backend fails."""
+    if stats is not None:
+        stats['provider'] = provider
+
+    try:
+        return call(providers[provider])
+    except (DistanceMatrixError, requests.RequestException) as e:
+        fallback = app.config["DISTANCE_PROVIDER_FALLBACK"]
+        if not fallback or fallback == provider:
+            raise
+        app.logger.warning(f"Distance provider {provider} failed ({e}), falling back to {fallback}")
+        if stats is not None:
+            stats['provider'] = fallback
+            stats['fallback_from'] = provider
+        return call(providers[fallback])
+
+
+# Large routes: costs between selected pairs only, so fetches and memory grow with n * k, not n^2
+
+def planar_points(locations):
+    """Project "lat,lng" locations to x/y metres (equirectangular) for neighbor searches.
+
+    The distortion stays well under a percent across a region the size of
+    Switzerland, which is plenty for choosing candidates.
+    """
+    coords = np.radians(parse_locations(locations))
+    x = coords[:, 1] * np.cos(coords[:, 0].mean()) * EARTH_RADIUS_M
+    y = coords[:, 0] * EARTH_RADIUS_M
+    return np.column_stack([x, y])
+
+
+def nearest_candidates(points, k):
+    """Indices of each point's k nearest other points, closest first, from a uniform grid.
+
+    Points are bucketed into cells of about two points each. A cell's points
+    are compared with the points in the cells up to r rings around it, r
+    growing until the k-th neighbor found is provably closer than anything
+    outside the rings, so the result is exact and the work about O(n k) for
+    spread-out stops.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros((n, 0), dtype=int)
+
+    side = max(1, int(math.sqrt(n / 2)))
+    cell = max(float(np.ptp(points, axis=0).max()), 1.0) / side
+    cells = np.minimum(((points - points.min(axis=0)) / cell).astype(int), side - 1)
+    cell_ids = cells[:, 0] * side + cells[:, 1]
+    order = np.argsort(cell_ids, kind='stable')
+    # order[bounds[c]:bounds[c + 1]] are the points in cell c; cells of one grid row are contiguous
+    bounds = np.searchsorted(cell_ids[order], np.arange(side * side + 1))
+
+    neighbors = np.empty((n, k), dtype=int)
+    for cell_id in np.unique(cell_ids):
+        members = order[bounds[cell_id]:bounds[cell_id + 1]]
+        cx, cy = divmod(int(cell_id), side)
+        rings = 1
+        while True:
+            x0, x1 = max(cx - rings, 0), min(cx + rings, side - 1)
+            y0, y1 = max(cy - rings, 0), min(cy + rings + 1, side)
+            nearby = np.concatenate([order[bounds[x * side + y0]:bounds[x * side + y1]]
+                                     for x in range(x0, x1 + 1)])
+            whole_grid = x0 == 0 and y0 == 0 and x1 == side - 1 and y1 == side
+            if len(nearby) > k or whole_grid:
+                squared = ((points[members, None, :] - points[None, nearby, :]) ** 2).sum(axis=2)
+                squared[members[:, None] == nearby[None, :]] = np.inf
+                nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+                found = np.take_along_axis(squared, nearest, axis=1)
+                if whole_grid or np.sqrt(found.max()) <= rings * cell:
+                    ranked = np.take_along_axis(nearest, np.argsort(found, axis=1), axis=1)
+                    neighbors[members] = nearby[ranked]
+                    break
+            rings += 1
+    return neighbors
+
+
+def google_pairs(locations, origins, destinations, api_key, mode='driving', stats=None):
+    """Distances and durations for the (origins[t], destinations[t]) pairs from the Distance Matrix API.
+
+    Only the listed pairs are read from travel_time_cache, and the missing
+    ones are fetched as one row per origin, so n stops with k candidates
+    cost about n * k elements instead of n^2.
+    """
+    if not api_key:
+        raise ValueError("API key is required for distance matrix calculation")
+
+    keys, _, inverse = _unique_keys(locations)
+    rows = inverse[np.asarray(origins, dtype=int)]
+    cols = inverse[np.asarray(destinations, dtype=int)]
+    wanted = {}
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        if i != j:
+            wanted.setdefault(i, set()).add(j)
+
+    fresh, stale = _load_cached_pairs(keys, mode, wanted)
+    values = {}
+    missing = {}
+    for i, targets in wanted.items():
+        for j in sorted(targets):
+            cached = fresh.get((keys[i], keys[j]))
+            if cached is None:
+                missing.setdefault(i, []).append(j)
+            else:
+                values[(i, j)] = cached
+
+    total = sum(map(len, wanted.values()))
+    misses = sum(map(len, missing.values()))
+    tiles = [([i], targets[c0:c1]) for i, targets in missing.items()
+             for _, _, c0, c1 in plan_tiles(1, len(targets))]
+    app.logger.info(f"Distance pairs for {len(keys)} locations: {total - misses} cached, "
+                    f"{misses} to fetch in {len(tiles)} requests")
+    metrics.record_cache('travel_time', hits=total - misses, misses=misses)
+
+    if tiles:
+        fetched = []
+        for tile_rows, tile_cols, distances, durations in _fetch_tiles(keys, tiles, api_key, mode):
+            for j, distance, duration in zip(tile_cols, distances[0], durations[0]):
+                values[(tile_rows[0], j)] = (distance, duration)
+                fetched.append((tile_rows[0], j, distance, duration))
+        _store_pairs(keys, mode, fetched, stale)
+
+    if stats is not None:
+        stats.update({'elements': total, 'hits': total - misses, 'misses': misses, 'requests': len(tiles)})
+
+    pairs = np.array([values.get((i, j), (0.0, 0.0)) for i, j in zip(rows.tolist(), cols.tolist())],
+                     dtype=float).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def haversine_pairs(locations, origins, destinations, api_key=None, mode='driving', stats=None):
+    """Great-circle estimates for the (origins[t], destinations[t]) pairs."""
+    coords = np.radians(parse_locations(locations))
+    a = coords[np.asarray(origins, dtype=int)]
+    b = coords[np.asarray(destinations, dtype=int)]
+    if stats is not None:
+        stats.update({'elements': len(a), 'hits': 0, 'misses': 0, 'requests': 0})
+    return _haversine_estimate(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+
+
+def file_pairs(locations, origins, destinations, api_key=None, mode='driving', stats=None):
+    """Look the (origins[t], destinations[t]) pairs up in the precomputed .npz file."""
+    index_of, distance, duration = _load_matrix_file()
+    try:
+        indices = np.array([index_of[coordinate_key(location)] for location in locations], dtype=int)
+    except KeyError as e:
+        raise DistanceMatrixError(f"Location {e.args[0]} is not in the precomputed matrix file")
+
+    rows = indices[np.asarray(origins, dtype=int)]
+    cols = indices[np.asarray(destinations, dtype=int)]
+    if stats is not None:
+        stats.update({'elements': len(rows), 'hits': len(rows), 'misses': 0, 'requests': 0})
+    return distance[rows, cols].astype(float), duration[rows, cols].astype(float)
+
+
+PAIR_PROVIDERS = {
+    'google': google_pairs,
+    'haversine': haversine_pairs,
+    'file': file_pairs,
+}
+
+
+def get_pair_costs(locations, origins, destinations, api_key=None, mode='driving', stats=None, provider=None):
+    """Distances (m) and durations (s) from locations[origins[t]] to locations[destinations[t]].
+
+    The sparse counterpart of get_distance_matrix, with the same provider
+    choice and fallback; returns two arrays aligned with the pairs.
+    """
+    provider = provider or app.config["DISTANCE_PROVIDER"]
+    if provider not in PAIR_PROVIDERS:
+        raise ValueError(f"Unknown distance provider: {provider}")
+    return _with_fallback(PAIR_PROVIDERS, provider, stats, lambda backend: backend(
+        locations, origins, destinations, api_key, mode=mode, stats=stats))
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape, quoteattr
+
+from sqlalchemy import select
+from sqlalchemy.orm import defer
+
+from app import db
+from models import Route
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'gpx': ('application/gpx+xml', 'gpx'),
+    'geojson': ('application/geo+json', 'geojson')
+}
+CSV_COLUMNS = ('sequence', 'address', 'lat', 'lng', 'leg_distance', 'leg_duration',
+               'cumulative_distance', 'eta_seconds', 'eta')
+
+
+def route_stops(route):
+    """One dict per stop in optimized order with coordinates, leg stats and cumulative ETA.
+
+    The ETA comes from the stored schedule (time windows, service times)
+    when there is one, otherwise from the cumulative leg durations. Routes
+    stored before coordinates or legs were kept get None for those fields.
+    """
+    addresses = route.optimized_route or route.addresses or []
+    coordinates = route.optimized_coordinates() or [None] * len(addresses)
+    legs = route.legs or []
+    schedule = route.schedule or []
+    distance = duration = 0.0
+    for index, address in enumerate(addresses):
+        leg = legs[index - 1] if 0 < index <= len(legs) else None
+        if leg:
+            distance += leg['distance']
+            duration += leg['duration']
+        stop = schedule[index] if index < len(schedule) else None
+        location = coordinates[index] if index < len(coordinates) else None
+        yield {
+            'sequence': index + 1,
+            'address': address,
+            'lat': location[0] if location else None,
+            'lng': location[1] if location else None,
+            'leg_distance': leg['distance'] if leg else (0.0 if index == 0 else None),
+            'leg_duration': leg['duration'] if leg else (0.0 if index == 0 else None),
+            'cumulative_distance': distance if legs else None,
+            'eta_seconds': stop['arrival'] if stop else (duration if legs else None),
+            'eta': stop.get('eta') if stop else None
+        }
+
+
+def _csv_chunks(route):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for stop in route_stops(route):
+        writer.writerow(['' if stop[column] is None else stop[column] for column in CSV_COLUMNS])
+    yield buffer.getvalue()
+
+
+def _gpx_chunks(route):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="Easy-route" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           f'  <rte>\n    <name>{escape(route.name or "")}</name>\n')
+    for stop in route_stops(route):
+        if stop['lat'] is None:
+            continue
+        description = ', '.join(f'{key}={stop[key]:.0f}' for key in
+                                ('leg_distance', 'leg_duration', 'eta_seconds') if stop[key] is not None)
+        yield (f'    <rtept lat={quoteattr(str(stop["lat"]))} lon={quoteattr(str(stop["lng"]))}>\n'
+               f'      <name>{escape(stop["address"])}</name>\n'
+               f'      <desc>{escape(description)}</desc>\n'
+               f'      <type>{stop["sequence"]}</type>\n'
+               '    </rtept>\n')
+    yield '  </rte>\n</gpx>\n'
+
+
+def _geojson_chunks(route):
+    yield ('{"type": "FeatureCollection", "properties": '
+           + json.dumps({'route_id': route.id, 'name': route.name,
+                         'total_distance': route.total_distance, 'total_duration': route.total_duration})
+           + ', "features": [\n')
+    line = []
+    separator = ''
+    for stop in route_stops(route):
+        if stop['lat'] is None:
+            continue
+        line.append([stop['lng'], stop['lat']])
+        properties = {key: value for key, value in stop.items() if key not in ('lat', 'lng')}
+        yield separator + json.dumps({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [stop['lng'], stop['lat']]},
+            'properties': properties
+        })
+        separator = ',\n'
+    if len(line) > 1:
+        yield separator + json.dumps({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': line},
+            'properties': {'route_id': route.id}
+        })
+    yield '\n]}\n'
+
+
+_WRITERS = {'csv': _csv_chunks, 'gpx': _gpx_chunks, 'geojson': _geojson_chunks}
+
+
+def export_chunks(route, fmt):
+    """Yield the route in the given format as text chunks."""
+    return _WRITERS[fmt](route)
+
+
+def filename(route, fmt):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route.name or '').strip('_')[:40]
+    return f"route_{route.id}{'_' + slug if slug else ''}.{FORMATS[fmt][1]}"
+
+
+class _ZipBuffer:
+    """Write-only sink for zipfile; drained after each member so the archive is streamed."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def select_routes(ids=None, day=None):
+    """Routes for a bulk export: given ids, one creation day, or everything (oldest first).
+
+    Loaded in batches, without the packed matrices and road geometry.
+    """
+    query = select(Route).options(defer(Route.distance_matrix), defer(Route.duration_matrix),
+                                  defer(Route.polyline), defer(Route.leg_polylines))
+    if ids:
+        query = query.where(Route.id.in_(ids))
+    if day:
+        start = datetime.combine(day, datetime.min.time())
+        query = query.where(Route.created_at >= start, Route.created_at < start + timedelta(days=1))
+    return db.session.scalars(query.order_by(Route.created_at, Route.id).execution_options(yield_per=50))
+
+
+def zip_chunks(fmt, ids=None, day=None):
+    """Stream a zip of the select_routes routes, one file each; one member is buffered at a time.
+
+    The query runs when iteration starts, i.e. in the session of the streamed response.
+    """
+    sink = _ZipBuffer()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for route in select_routes(ids, day):
+            with archive.open(filename(route, fmt), 'w') as member:
+                for chunk in export_chunks(route, fmt):
+                    member.write(chunk.encode('utf-8'))
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+            db.session.expunge(route)
+    yield sink.drain()
@@ -0,0 +1,166 @@
+import re
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app import app, db, http_session
+from models import GeocodeCache
+from lru import LRUCache
+import metrics
+
+GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+
+class GeocodingError(Exception):
+    pass
+
+
+# Normalized address -> (result, fetched_at)
+_lru = LRUCache(app.config["GEOCODE_CACHE_SIZE"])
+
+
+def normalize_address(address):
+    """Canonical cache key: case, accents form, whitespace and comma spacing folded."""
+    text = unicodedata.normalize('NFKC', address or '').lower().strip()
+    text = re.sub(r'\s*,\s*', ', ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' ,.;')
+
+
+def _is_fresh(fetched_at):
+    ttl = timedelta(days=app.config["GEOCODE_CACHE_TTL_DAYS"])
+    return fetched_at is not None and datetime.utcnow() - fetched_at < ttl
+
+
+def _lookup_cached(key):
+    entry = _lru.get(key)
+    if entry and _is_fresh(entry[1]):
+        return entry[0]
+
+    cached = GeocodeCache.query.filter_by(normalized_address=key).first()
+    if cached and _is_fresh(cached.updated_at):
+        result = cached.to_dict()
+        _lru.put(key, (result, cached.updated_at))
+        return result
+    return None
+
+
+def _fetch_geocode(address, api_key, timeout=None):
+    params = {
+        'address': address,
+        'key': api_key
+    }
+    app.logger.info(f"Geocoding address: {address}")
+    response = http_session.get(GEOCODE_URL, params=params, timeout=timeout)
+    result = response.json()
+
+    if result['status'] != 'OK':
+        raise GeocodingError(f"Geocoding failed for address: {address}")
+
+    location = result['results'][0]
+    return {
+        'formatted_address': location['formatted_address'],
+        'lat': location['geometry']['location']['lat'],
+        'lng': location['geometry']['location']['lng']
+    }
+
+
+def _store(key, address, result, commit=True):
+    try:
+        cached = GeocodeCache.query.filter_by(normalized_address=key).first()
+        if not cached:
+            cached = GeocodeCache(normalized_address=key)
+            db.session.add(cached)
+        cached.address = address[:255]
+        cached.formatted_address = result['formatted_address'][:255]
+        cached.latitude = result['lat']
+        cached.longitude = result['lng']
+        cached.updated_at = datetime.utcnow()
+        if commit:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Failed to store geocode cache entry for {address}: {e}")
+
+
+def geocode_address(address, api_key):
+    """Geocode one address, serving repeat lookups from the LRU and the geocode_cache table.
+
+    Returns a dict with formatted_address, lat and lng. Raises GeocodingError when
+    the Geocoding API cannot resolve the address.
+    """
+    key = normalize_address(address)
+    result = _lookup_cached(key)
+    if result is not None:
+        app.logger.info(f"Geocode cache hit: {address}")
+        metrics.record_cache('geocode', hits=1)
+        return result
+    metrics.record_cache('geocode', misses=1)
+
+    result = _fetch_geocode(address, api_key, app.config["GOOGLE_API_TIMEOUT"])
+    _store(key, address, result)
+    _lru.put(key, (result, datetime.utcnow()))
+    return result
+
+
+def geocode_addresses(addresses, api_key, max_workers=None):
+    """Geocode a list of addresses, fetching cache misses concurrently.
+
+    Returns (results, errors): results is aligned with addresses and holds None
+    where geocoding failed; errors maps the failed index to its error message.
+    Cache reads and writes stay on the calling thread, only the HTTP calls run
+    in the worker pool.
+    """
+    max_workers = max_workers or app.config["GEOCODE_MAX_WORKERS"]
+    timeout = app.config["GOOGLE_API_TIMEOUT"]
+    results = [None] * len(addresses)
+    errors = {}
+
+    # Group indices by cache key so repeated stops (e.g. loop routes) are fetched once
+    pending = OrderedDict()
+    for i, address in enumerate(addresses):
+        key = normalize_address(address)
+        cached = _lookup_cached(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(key, []).append(i)
+
+    misses = sum(map(len, pending.values()))
+    metrics.record_cache('geocode', hits=len(addresses) - misses, misses=misses)
+    if not pending:
+        return results, errors
+
+    app.logger.info(f"Geocode cache: {len(addresses) - misses} hits, "
+                    f"{len(pending)} addresses to fetch")
+
+    def fetch(key):
+        address = addresses[pending[key][0]]
+        try:
+            return _fetch_geocode(address, api_key, timeout), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+        fetched = list(executor.map(fetch, pending))
+
+    for (key, indices), (result, error) in zip(pending.items(), fetched):
+        address = addresses[indices[0]]
+        if error is not None:
+            app.logger.error(f"Geocoding error: {str(error)}")
+            for i in indices:
+                errors[i] = f'Failed to geocode address: {addresses[i]}'
+            continue
+        _store(key, address, result, commit=False)
+        _lru.put(key, (result, datetime.utcnow()))
+        for i in indices:
+            results[i] = result
+
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Failed to store geocode cache entries: {e}")
+
+    return results, errors
@@ -0,0 +1,106 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db
+from models import Route
+from pipeline import STAGES, OptimizationError, run_optimization
+from optimize_cache import complete, run_once
+
+_executor = ThreadPoolExecutor(max_workers=app.config["OPTIMIZE_JOB_WORKERS"],
+                               thread_name_prefix='optimize-job')
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _update(job_id, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields, updated_at=time.time())
+
+
+def _prune():
+    cutoff = time.time() - app.config["OPTIMIZE_JOB_RETENTION_SECONDS"]
+    with _lock:
+        for job_id in [job_id for job_id, job in _jobs.items()
+                       if job['status'] in ('completed', 'failed') and job['updated_at'] < cutoff]:
+            del _jobs[job_id]
+
+
+def _report_stage(job_id, stage):
+    _update(job_id, status='running', stage=stage, step=STAGES.index(stage) + 1)
+
+
+def _run(job_id, route_id, params, key, flight):
+    def load():
+        route = db.session.get(Route, route_id)
+        if route is None:
+            raise OptimizationError('Route no longer exists', 404)
+        return route
+
+    def optimize(route):
+        return run_optimization(route, params, progress=lambda stage: _report_stage(job_id, stage))
+
+    with app.app_context():
+        try:
+            if flight is not None:
+                result = complete(key, flight, lambda: optimize(load()))
+            else:
+                result, _ = run_once(key, load, optimize)
+            _update(job_id, status='completed', stage='completed', step=len(STAGES), result=result)
+        except OptimizationError as e:
+            _update(job_id, status='failed', error=e.to_dict())
+        except Exception as e:
+            app.logger.error(f"Optimization job {job_id} failed: {str(e)}")
+            _update(job_id, status='failed',
+                    error={'success': False, 'error': 'An unexpected error occurred'})
+
+
+def submit_optimization(route_id, params, key, flight=None):
+    """Queue run_optimization for a stored route on the local worker pool; returns the job id.
+
+    key is the optimize_cache request key; identical jobs share one computation.
+    flight, from optimize_cache.claim_route, is completed by this job.
+    """
+    _prune()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        _jobs[job_id] = {
+            'id': job_id,
+            'route_id': route_id,
+            'key': key,
+            'status': 'queued',
+            'stage': 'queued',
+            'step': 0,
+            'total_steps': len(STAGES),
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+    _executor.submit(_run, job_id, route_id, params, key, flight)
+    app.logger.info(f"Queued optimization job {job_id} for route {route_id}")
+    return job_id
+
+
+def get_job(job_id):
+    """Snapshot of a job's status, or None for unknown (or pruned) ids."""
+    with _lock:
+        job = _jobs.get(job_id)
+        return _public(job) if job is not None else None
+
+
+def find_active_job(key):
+    """Snapshot of a queued or running job for the same request key, or None."""
+    with _lock:
+        for job in _jobs.values():
+            if job['key'] == key and job['status'] in ('queued', 'running'):
+                return _public(job)
+    return None
+
+
+def _public(job):
+    return {field: value for field, value in job.items() if field != 'key'}
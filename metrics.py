@@ -0,0 +1,213 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, http_session
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class _Metric:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{self._format_labels(key)} {value}'
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{self._format_labels(key, [("le", repr(float(bound)))])} {bucket_count}'
+            yield f'{self.name}_bucket{self._format_labels(key, [("le", "+Inf")])} {count}'
+            yield f'{self.name}_sum{self._format_labels(key)} {total}'
+            yield f'{self.name}_count{self._format_labels(key)} {count}'
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+http_requests = _register(Histogram(
+    'easyroute_http_request_duration_seconds', 'Time spent handling HTTP requests',
+    ('endpoint', 'method', 'status')))
+stage_duration = _register(Histogram(
+    'easyroute_stage_duration_seconds', 'Time spent in each optimization pipeline stage', ('stage',)))
+external_requests = _register(Histogram(
+    'easyroute_external_request_duration_seconds', 'Latency of calls to external APIs', ('api', 'status')))
+external_errors = _register(Counter(
+    'easyroute_external_request_errors_total', 'External API calls that failed without a response', ('api',)))
+cache_lookups = _register(Counter(
+    'easyroute_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result')))
+db_queries = _register(Counter(
+    'easyroute_db_queries_total', 'SQL statements executed'))
+db_query_duration = _register(Histogram(
+    'easyroute_db_query_duration_seconds', 'Time spent executing SQL statements'))
+db_queries_per_request = _register(Histogram(
+    'easyroute_db_queries_per_request', 'SQL statements executed per HTTP request', ('endpoint',),
+    buckets=COUNT_BUCKETS))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (this process only)."""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def _request_timings():
+    if not has_request_context():
+        return None
+    if 'metrics_timings' not in g:
+        g.metrics_timings = {}
+    return g.metrics_timings
+
+
+@contextmanager
+def timed_stage(stage):
+    """Time a pipeline stage into the stage histogram and the request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_duration.observe(elapsed, stage=stage)
+        timings = _request_timings()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def record_cache(cache, hits=0, misses=0):
+    if hits:
+        cache_lookups.inc(hits, cache=cache, result='hit')
+    if misses:
+        cache_lookups.inc(misses, cache=cache, result='miss')
+
+
+def _api_name(url):
+    path = urlparse(url).path
+    for marker, name in (('/geocode/', 'geocode'), ('/distancematrix/', 'distance_matrix'),
+                         ('/directions/', 'directions')):
+        if marker in path:
+            return name
+    return urlparse(url).hostname or 'other'
+
+
+def _observe_response(response, *args, **kwargs):
+    external_requests.observe(response.elapsed.total_seconds(), api=_api_name(response.url),
+                              status=response.status_code)
+
+
+def _counting_errors(send):
+    def wrapper(prepared, **kwargs):
+        try:
+            return send(prepared, **kwargs)
+        except Exception:
+            external_errors.inc(api=_api_name(prepared.url))
+            raise
+    return wrapper
+
+
+# Response hooks only see successful round trips; timeouts and connection errors are counted in send
+http_session.hooks['response'].append(_observe_response)
+http_session.send = _counting_errors(http_session.send)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+    db_queries.inc()
+    db_query_duration.observe(elapsed)
+    if has_request_context():
+        g.metrics_db_queries = g.get('metrics_db_queries', 0) + 1
+        g.metrics_db_time = g.get('metrics_db_time', 0.0) + elapsed
+
+
+@app.before_request
+def _start_request_timer():
+    # g lives on the app context, which a request may share (e.g. the test client inside app_context())
+    g.metrics_timings = {}
+    g.metrics_db_queries = 0
+    g.metrics_db_time = 0.0
+    g.metrics_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    http_requests.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    db_queries_per_request.observe(g.get('metrics_db_queries', 0), endpoint=endpoint)
+
+    if app.config["SERVER_TIMING"]:
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in (_request_timings() or {}).items()]
+        entries.append(f'db;dur={g.get("metrics_db_time", 0.0) * 1000:.1f};desc="{g.get("metrics_db_queries", 0)} queries"')
+        entries.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
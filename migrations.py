@@ -0,0 +1,82 @@
+from sqlalchemy import inspect, text
+
+from app import app, db
+
+
+def add_missing_columns():
+    """Add model columns that an existing database table does not have yet.
+
+    db.create_all() only creates missing tables, so columns added to a model
+    later are applied here with ALTER TABLE ... ADD COLUMN. Only nullable
+    columns are supported, which is what new model fields should be.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    app.logger.error(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                app.logger.info(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                ))
+
+
+def _index_names(inspector, table_name):
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite reflection skips expression indexes such as lower(address)
+        with db.engine.connect() as connection:
+            return set(connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+            ), {'table': table_name}).scalars())
+    return {index['name'] for index in inspector.get_indexes(table_name)}
+
+
+def create_missing_indexes():
+    """Create indexes declared on models that an existing table does not have yet."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = _index_names(inspector, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                app.logger.info(f"Creating index {index.name}")
+                index.create(db.engine)
+
+
+def backfill_route_stop_counts(batch_size=500):
+    """Fill route.stop_count for rows stored before the column existed."""
+    from models import Route
+
+    while True:
+        rows = db.session.query(Route.id, Route.addresses).filter(
+            Route.stop_count.is_(None)).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(db.update(Route), [
+            {'id': route_id, 'stop_count': len(addresses or [])} for route_id, addresses in rows
+        ])
+        db.session.commit()
+        app.logger.info(f"Backfilled stop_count for {len(rows)} routes")
+
+
+def upgrade_schema():
+    add_missing_columns()
+    create_missing_indexes()
+    backfill_route_stop_counts()
+
+    import route_stats
+    route_stats.ensure_aggregates()
+
+    import contact_search
+    contact_search.install()
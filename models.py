@@ -1,6 +1,20 @@
 from app import db
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+import numpy as np
+
+
+def pack_matrix(matrix):
+    """Square matrix -> compact little-endian float32 bytes."""
+    return np.ascontiguousarray(matrix, dtype='<f4').tobytes()
+
+
+def unpack_matrix(data):
+    values = np.frombuffer(data, dtype='<f4').astype(float)
+    n = int(round(len(values) ** 0.5))
+    return values.reshape((n, n))
+
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -27,11 +41,61 @@ class Route(db.Model):
     description = db.Column(db.Text, nullable=True)
     addresses = db.Column(db.JSON, nullable=False)
     optimized_route = db.Column(db.JSON, nullable=True)
+    # len(addresses), kept so listings don't have to load the JSON
+    stop_count = db.Column(db.Integer, nullable=True)
     total_distance = db.Column(db.Float, nullable=True)
     total_duration = db.Column(db.Float, nullable=True)
+    is_loop_route = db.Column(db.Boolean, nullable=True)
+    has_end_point = db.Column(db.Boolean, nullable=True)
+    # What the stop order minimizes: 'distance' or 'duration' (null for older rows: distance)
+    objective = db.Column(db.String(20), nullable=True)
+    # [lat, lng] per entry of addresses, and the optimized order as indices into it
+    coordinates = db.Column(db.JSON, nullable=True)
+    stop_order = db.Column(db.JSON, nullable=True)
+    # Per-leg {distance, duration} along the optimized order
+    legs = db.Column(db.JSON, nullable=True)
+    # Road geometry along the optimized order as Google encoded polylines: whole route and per leg,
+    # and when it was last fetched (set on failure too, so a failed fetch is not retried)
+    polyline = db.Column(db.Text, nullable=True)
+    leg_polylines = db.Column(db.JSON, nullable=True)
+    directions_fetched_at = db.Column(db.DateTime, nullable=True)
+    # Per-address [earliest, latest] seconds after departure (or null) and service seconds
+    time_windows = db.Column(db.JSON, nullable=True)
+    service_times = db.Column(db.JSON, nullable=True)
+    departure_time = db.Column(db.String(5), nullable=True)
+    # Per-stop {arrival, departure, late_by} seconds along the optimized order
+    schedule = db.Column(db.JSON, nullable=True)
+    # n x n matrices over addresses, packed as little-endian float32
+    distance_matrix = db.Column(db.LargeBinary, nullable=True)
+    duration_matrix = db.Column(db.LargeBinary, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Keyset pagination order for the route listing
+    __table_args__ = (
+        db.Index('ix_route_created_at_id', 'created_at', 'id'),
+    )
+
+    @validates('addresses')
+    def _count_stops(self, key, addresses):
+        self.stop_count = len(addresses or [])
+        return addresses
+
+    def set_matrices(self, distance_matrix, duration_matrix):
+        self.distance_matrix = pack_matrix(distance_matrix)
+        self.duration_matrix = pack_matrix(duration_matrix)
+
+    def get_matrices(self):
+        """Return (distance, duration) as float arrays, or (None, None) if not stored."""
+        if self.distance_matrix is None or self.duration_matrix is None:
+            return None, None
+        return unpack_matrix(self.distance_matrix), unpack_matrix(self.duration_matrix)
+
+    def optimized_coordinates(self):
+        if not self.coordinates or self.stop_order is None:
+            return None
+        return [self.coordinates[i] for i in self.stop_order]
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -39,6 +103,14 @@ class Route(db.Model):
             'description': self.description,
             'addresses': self.addresses,
             'optimized_route': self.optimized_route,
+            'optimized_coordinates': self.optimized_coordinates(),
+            'stop_count': self.stop_count,
+            'legs': self.legs,
+            'polyline': self.polyline,
+            'leg_polylines': self.leg_polylines,
+            'schedule': self.schedule,
+            'departure_time': self.departure_time,
+            'objective': self.objective,
             'total_distance': self.total_distance,
             'total_duration': self.total_duration,
             'created_at': self.created_at.isoformat(),
@@ -54,6 +126,15 @@ class Contact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Case-insensitive prefix lookups for short /contacts/suggest terms, and the
+    # business_name order of the contacts page
+    __table_args__ = (
+        db.Index('ix_contact_business_name', business_name),
+        db.Index('ix_contact_business_name_lower', db.func.lower(business_name)),
+        db.Index('ix_contact_contact_name_lower', db.func.lower(contact_name)),
+        db.Index('ix_contact_address_lower', db.func.lower(address)),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -64,3 +145,56 @@ class Contact(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
+
+class GeocodeCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    normalized_address = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    address = db.Column(db.String(255), nullable=False)
+    formatted_address = db.Column(db.String(255), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'formatted_address': self.formatted_address,
+            'lat': self.latitude,
+            'lng': self.longitude
+        }
+
+class TravelTimeCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(64), nullable=False)
+    destination = db.Column(db.String(64), nullable=False)
+    mode = db.Column(db.String(20), nullable=False, default='driving')
+    distance = db.Column(db.Float, nullable=False)
+    duration = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('origin', 'destination', 'mode', name='uq_travel_time_pair'),
+    )
+
+# Running aggregates for /statistics, maintained by route_stats.py on every flush
+class RouteTotals(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    route_count = db.Column(db.Integer, nullable=False, default=0)
+    distance_count = db.Column(db.Integer, nullable=False, default=0)
+    distance_sum = db.Column(db.Float, nullable=False, default=0.0)
+    duration_count = db.Column(db.Integer, nullable=False, default=0)
+    duration_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+class RouteMonthlyCount(db.Model):
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    route_count = db.Column(db.Integer, nullable=False, default=0)
+
+class RouteDistanceBucket(db.Model):
+    bucket = db.Column(db.String(10), primary_key=True)
+    route_count = db.Column(db.Integer, nullable=False, default=0)
+
+class StopFrequency(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    address = db.Column(db.Text, unique=True, nullable=False)
+    route_count = db.Column(db.Integer, nullable=False, default=0, index=True)
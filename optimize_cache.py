@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db
+from models import Route
+from geocoding import normalize_address
+from lru import LRUCache
+import metrics
+
+# Parameters that change the optimized route; name and description do not
+KEY_FIELDS = ('has_end_point', 'is_loop_route', 'distance_provider', 'objective', 'max_solve_ms',
+              'departure_time', 'time_windows', 'service_times')
+
+_results = LRUCache(app.config["OPTIMIZE_DEDUP_MAX_ENTRIES"])
+_inflight = {}
+_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.route_ready = threading.Event()
+        self.route_id = None
+        self.result = None
+        self.error = None
+
+
+def request_key(params):
+    """Canonical hash of a parsed /optimize request: normalized addresses plus KEY_FIELDS."""
+    canonical = {field: params.get(field) for field in KEY_FIELDS}
+    canonical['addresses'] = [normalize_address(address) for address in params['addresses']]
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cached_result(key):
+    """The stored result for key if it is younger than OPTIMIZE_DEDUP_TTL_SECONDS, else None."""
+    entry = _results.get(key)
+    if entry is None:
+        return None
+    result, stored_at = entry
+    if time.time() - stored_at >= app.config["OPTIMIZE_DEDUP_TTL_SECONDS"]:
+        return None
+    return result
+
+
+def _enabled():
+    return app.config["OPTIMIZE_DEDUP_TTL_SECONDS"] > 0
+
+
+def _join(key):
+    """(cached result, None, False), or (None, flight, leader) with the flight for key claimed or joined."""
+    with _lock:
+        result = cached_result(key)
+        if result is not None:
+            metrics.record_cache('optimize', hits=1)
+            return result, None, False
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+    metrics.record_cache('optimize', misses=1 if leader else 0, hits=0 if leader else 1)
+    return None, flight, leader
+
+
+def _release(key, flight):
+    with _lock:
+        if _inflight.get(key) is flight:
+            del _inflight[key]
+    flight.route_ready.set()
+    flight.done.set()
+
+
+def _create(key, flight, create):
+    """Run the leader's create() and publish the new route's id to followers."""
+    try:
+        route = create()
+    except Exception as e:
+        flight.error = e
+        _release(key, flight)
+        raise
+    flight.route_id = route.id
+    flight.route_ready.set()
+    return route
+
+
+def complete(key, flight, compute):
+    """Finish a flight claimed with claim_route: run compute(), share and cache its result."""
+    try:
+        flight.result = compute()
+        _results.put(key, (flight.result, time.time()))
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        _release(key, flight)
+
+
+def _waited(event):
+    """Wait up to OPTIMIZE_DEDUP_WAIT_SECONDS for event; False (and a warning) if it did not come."""
+    if event.wait(app.config["OPTIMIZE_DEDUP_WAIT_SECONDS"]):
+        return True
+    app.logger.warning("Identical /optimize request still running after "
+                       f"{app.config['OPTIMIZE_DEDUP_WAIT_SECONDS']:g} s; optimizing separately")
+    return False
+
+
+def run_once(key, create, optimize):
+    """Return (result, shared): create() a route and optimize(route) it at most once per key at a time.
+
+    A fresh cached result is returned as is. Otherwise the first caller
+    creates and optimizes a route while identical concurrent callers wait
+    for and share its result (or its exception). A caller that has waited
+    OPTIMIZE_DEDUP_WAIT_SECONDS optimizes on its own instead, so a stuck
+    leader does not hold up its duplicates. Results are kept for
+    OPTIMIZE_DEDUP_TTL_SECONDS; errors are not cached. A TTL of 0 turns
+    deduplication off.
+    """
+    if not _enabled():
+        return optimize(create()), False
+
+    result, flight, leader = _join(key)
+    if result is not None:
+        return result, True
+    if not leader:
+        if _waited(flight.done):
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        # A flight of its own that no other caller joins
+        flight = _Flight()
+
+    route = _create(key, flight, create)
+    return complete(key, flight, lambda: optimize(route)), False
+
+
+def claim_route(key, create):
+    """Return (route_id, flight, shared) for an asynchronous request, inserting a route only when needed.
+
+    An identical cached or in-flight request lends its route id (shared,
+    flight None). Otherwise create() stores a new route and, with
+    deduplication on, the returned flight is held for the caller, who must
+    finish it with complete(). If the in-flight request has not stored its
+    route within OPTIMIZE_DEDUP_WAIT_SECONDS, the caller gets a route and a
+    flight of its own.
+    """
+    if not _enabled():
+        return create().id, None, False
+
+    while True:
+        result, flight, leader = _join(key)
+        if result is not None:
+            return result['route_id'], None, True
+        if leader:
+            return _create(key, flight, create).id, flight, False
+        if not _waited(flight.route_ready):
+            flight = _Flight()
+            return _create(key, flight, create).id, flight, False
+        if flight.route_id is not None:
+            return flight.route_id, None, True
+        # The leader failed before storing its route; claim the key again
+
+
+def forget_routes(route_ids):
+    """Drop cached results that point at any of route_ids."""
+    route_ids = set(route_ids)
+    _results.remove_if(lambda entry: entry[0].get('route_id') in route_ids)
+
+
+@event.listens_for(Session, 'before_flush')
+def _forget_changed_routes(session, flush_context, instances):
+    # Edited or deleted routes no longer match the request that produced them
+    route_ids = [route.id for route in session.deleted if isinstance(route, Route)]
+    route_ids += [route.id for route in session.dirty if isinstance(route, Route) and route.id is not None
+                  and db.inspect(route).attrs.optimized_route.history.has_changes()]
+    if route_ids:
+        forget_routes(route_ids)
@@ -0,0 +1,1019 @@
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+# Moves must improve the tour by more than this (metres/seconds) to be applied
+IMPROVEMENT_EPSILON = 1e-7
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+# Anytime search: restart from a randomized construction after this many non-improving kicks
+RESTART_AFTER = 50
+RANDOMIZED_NN_CANDIDATES = 3
+# Large routes: double-bridge kicks cut the tour within this many consecutive positions
+CANDIDATE_KICK_WINDOW = 30
+
+
+def route_cost(matrix, path):
+    """Sum of matrix[path[k], path[k + 1]] along the path."""
+    path = np.asarray(path)
+    if len(path) < 2:
+        return 0.0
+    return float(np.asarray(matrix)[path[:-1], path[1:]].sum())
+
+
+def nearest_neighbor(distance_matrix, has_end_point=False, is_loop_route=False):
+    """Greedy tour from the first location, using a masked argmin over each matrix row.
+
+    With has_end_point the last location is kept as the end of the tour; with
+    is_loop_route the last location is the start's duplicate and the tour
+    returns to index 0.
+    """
+    matrix = np.asarray(distance_matrix, dtype=float)
+    n = len(matrix)
+
+    if n <= 2:  # If only start and end points, return as is
+        return list(range(n))
+
+    fixed_end = has_end_point or is_loop_route
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    if fixed_end:
+        visited[n - 1] = True  # End point (or the start's duplicate) is appended last
+
+    current = 0
+    path = [current]
+    for _ in range(int((~visited).sum())):
+        row = np.where(visited, np.inf, matrix[current])
+        current = int(np.argmin(row))
+        visited[current] = True
+        path.append(current)
+
+    if is_loop_route:
+        path.append(0)  # Return to start point for loop routes
+    elif has_end_point:
+        path.append(n - 1)  # Add end point for regular routes
+    return path
+
+
+def _with_free_end(matrix):
+    """Append a dummy node reachable from everywhere at zero cost.
+
+    An open route (no fixed end) then becomes a path between two fixed
+    endpoints, so the same local search handles every route type.
+    """
+    n = len(matrix)
+    extended = np.zeros((n + 1, n + 1))
+    extended[:n, :n] = matrix
+    return extended
+
+
+def _expired(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def two_opt(matrix, path, max_sweeps=50, deadline=None):
+    """Segment-reversal local search with fixed first and last positions.
+
+    For every i the gain of reversing path[i+1..j] is evaluated for all j at
+    once. Prefix sums over the forward and backward edge costs keep the
+    evaluation exact on asymmetric matrices. Stops early once deadline (a
+    time.perf_counter() value) has passed. Returns (path, improved).
+    """
+    path = np.array(path)
+    size = len(path)
+    if size < 4:
+        return path.tolist(), False
+
+    improved = False
+    for _ in range(max_sweeps):
+        sweep_improved = False
+        for i in range(size - 3):
+            if _expired(deadline):
+                return path.tolist(), improved
+            forward = np.concatenate(([0.0], np.cumsum(matrix[path[:-1], path[1:]])))
+            backward = np.concatenate(([0.0], np.cumsum(matrix[path[1:], path[:-1]])))
+            a, b = path[i], path[i + 1]
+            j = np.arange(i + 2, size - 1)
+            c, d = path[j], path[j + 1]
+            delta = (matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+                     + (backward[j] - backward[i + 1]) - (forward[j] - forward[i + 1]))
+            best = int(np.argmin(delta))
+            if delta[best] < -IMPROVEMENT_EPSILON:
+                end = j[best]
+                path[i + 1:end + 1] = path[i + 1:end + 1][::-1]
+                sweep_improved = improved = True
+        if not sweep_improved:
+            break
+    return path.tolist(), improved
+
+
+def or_opt(matrix, path, max_sweeps=50, deadline=None):
+    """Move segments of 1-3 consecutive stops to their cheapest position.
+
+    Insertion costs for all candidate edges are evaluated in one vectorized
+    step per segment. The first and last positions stay fixed. Returns
+    (path, improved).
+    """
+    path = list(path)
+    size = len(path)
+    if size < 4:
+        return path, False
+
+    improved = False
+    for _ in range(max_sweeps):
+        sweep_improved = False
+        for length in OR_OPT_SEGMENT_LENGTHS:
+            start = 1
+            while start + length <= size - 1:
+                if _expired(deadline):
+                    return path, improved
+                end = start + length - 1
+                nodes = np.array(path)
+                prev_node, next_node = nodes[start - 1], nodes[end + 1]
+                first, last = nodes[start], nodes[end]
+                removal_gain = (matrix[prev_node, first] + matrix[last, next_node]
+                                - matrix[prev_node, next_node])
+
+                # Candidate edges (t, t + 1) that do not touch the segment
+                t = np.concatenate((np.arange(0, start - 1), np.arange(end + 1, size - 1)))
+                if len(t):
+                    u, v = nodes[t], nodes[t + 1]
+                    insertion = matrix[u, first] + matrix[last, v] - matrix[u, v]
+                    best = int(np.argmin(insertion))
+                    if insertion[best] - removal_gain < -IMPROVEMENT_EPSILON:
+                        target = int(t[best])
+                        segment = path[start:end + 1]
+                        rest = path[:start] + path[end + 1:]
+                        insert_at = target + 1 if target < start else target + 1 - length
+                        path = rest[:insert_at] + segment + rest[insert_at:]
+                        sweep_improved = improved = True
+                        continue
+                start += 1
+        if not sweep_improved:
+            break
+    return path, improved
+
+
+def improve_route(matrix, path, max_rounds=20, deadline=None):
+    """Alternate 2-opt and Or-opt until neither finds an improving move."""
+    for _ in range(max_rounds):
+        path, reversed_any = two_opt(matrix, path, deadline=deadline)
+        path, moved_any = or_opt(matrix, path, deadline=deadline)
+        if not (reversed_any or moved_any) or _expired(deadline):
+            break
+    return list(path)
+
+
+def _search_space(matrix, path, has_end_point, is_loop_route):
+    """Return (matrix, path) where both ends of path are fixed.
+
+    Open routes (no fixed end) get a zero-cost dummy end node appended.
+    """
+    if has_end_point or is_loop_route:
+        return matrix, list(path)
+    # Open route: search on a path ending at a zero-cost dummy node, then drop it
+    return _with_free_end(matrix), list(path) + [len(matrix)]
+
+
+def _from_search_space(path, has_end_point, is_loop_route):
+    if has_end_point or is_loop_route:
+        return [int(i) for i in path]
+    return [int(i) for i in path[:-1]]
+
+
+def optimize_tour(distance_matrix, has_end_point=False, is_loop_route=False, local_search=True):
+    """Nearest-neighbor construction followed by 2-opt / Or-opt improvement.
+
+    Returns the visiting order as indices into distance_matrix, with the same
+    start, end point and loop semantics as nearest_neighbor.
+    """
+    matrix = np.asarray(distance_matrix, dtype=float)
+    path = nearest_neighbor(matrix, has_end_point=has_end_point, is_loop_route=is_loop_route)
+    if not local_search or len(path) < 4:
+        return path
+
+    search_matrix, search_path = _search_space(matrix, path, has_end_point, is_loop_route)
+    improved = improve_route(search_matrix, search_path)
+    return _from_search_space(improved, has_end_point, is_loop_route)
+
+
+def _randomized_construction(matrix, path, rng):
+    """Nearest-neighbor over the interior of path, picking among the few closest stops."""
+    interior = np.array(path[1:-1])
+    remaining = np.ones(len(interior), dtype=bool)
+    current = path[0]
+    tour = [current]
+    for _ in range(len(interior)):
+        candidates = np.flatnonzero(remaining)
+        costs = matrix[current, interior[candidates]]
+        k = min(RANDOMIZED_NN_CANDIDATES, len(candidates))
+        nearest = np.argpartition(costs, k - 1)[:k]
+        choice = candidates[nearest[rng.integers(k)]]
+        remaining[choice] = False
+        current = int(interior[choice])
+        tour.append(current)
+    tour.append(path[-1])
+    return tour
+
+
+def _perturb(path, rng):
+    """Double-bridge kick on the interior (segment swap for short routes)."""
+    interior = list(path[1:-1])
+    if len(interior) >= 8:
+        i, j, k = sorted(rng.choice(np.arange(1, len(interior)), size=3, replace=False))
+        interior = interior[:i] + interior[j:k] + interior[i:j] + interior[k:]
+    elif len(interior) >= 2:
+        i, j = sorted(rng.choice(len(interior), size=2, replace=False))
+        interior[i], interior[j] = interior[j], interior[i]
+    return [path[0]] + interior + [path[-1]]
+
+
+def solve(distance_matrix, has_end_point=False, is_loop_route=False, max_solve_ms=0, seed=None,
+          initial_path=None):
+    """Anytime solver: optimize_tour, then iterated local search until the budget runs out.
+
+    Each iteration kicks the best tour with a double-bridge move and repairs
+    it with 2-opt / Or-opt; after RESTART_AFTER kicks without progress it
+    restarts from a randomized nearest-neighbor construction. initial_path
+    replaces the nearest-neighbor construction (e.g. a stored tour). Returns
+    a dict with the best path and objective plus iteration and timing counters.
+    """
+    started = time.perf_counter()
+    deadline = started + max_solve_ms / 1000.0 if max_solve_ms else None
+    matrix = np.asarray(distance_matrix, dtype=float)
+
+    if initial_path is not None:
+        path = [int(i) for i in initial_path]
+    else:
+        path = nearest_neighbor(matrix, has_end_point=has_end_point, is_loop_route=is_loop_route)
+    initial_objective = route_cost(matrix, path)
+    search_matrix, best = _search_space(matrix, path, has_end_point, is_loop_route)
+    iterations = 0
+    improvements = 0
+
+    if len(best) >= 4:
+        best = improve_route(search_matrix, best, deadline=deadline)
+        best_cost = route_cost(search_matrix, best)
+        rng = np.random.default_rng(seed)
+        current, current_cost = best, best_cost
+        stale = 0
+
+        while deadline is not None and not _expired(deadline) and len(best) > 4:
+            iterations += 1
+            if stale >= RESTART_AFTER:
+                candidate = _randomized_construction(search_matrix, best, rng)
+                stale = 0
+            else:
+                candidate = _perturb(current, rng)
+            candidate = improve_route(search_matrix, candidate, deadline=deadline)
+            candidate_cost = route_cost(search_matrix, candidate)
+
+            if candidate_cost < current_cost - IMPROVEMENT_EPSILON:
+                current, current_cost = candidate, candidate_cost
+                stale = 0
+            else:
+                stale += 1
+            if current_cost < best_cost - IMPROVEMENT_EPSILON:
+                best, best_cost = current, current_cost
+                improvements += 1
+
+    path = _from_search_space(best, has_end_point, is_loop_route)
+    objective = route_cost(matrix, path)
+    return {
+        'path': path,
+        'objective': objective,
+        'initial_objective': initial_objective,
+        'improvement': initial_objective - objective,
+        'iterations': iterations,
+        'improvements': improvements,
+        'elapsed_ms': (time.perf_counter() - started) * 1000.0
+    }
+
+
+def insert_stops(distance_matrix, path, new_nodes, has_end_point=False, is_loop_route=False):
+    """Cheapest insertion of new_nodes into an existing path, one at a time.
+
+    The first position (and the last, for fixed-end routes) never moves;
+    open routes may also append after the last stop.
+    """
+    matrix = np.asarray(distance_matrix, dtype=float)
+    path = [int(i) for i in path]
+    fixed_end = has_end_point or is_loop_route
+    for node in new_nodes:
+        nodes = np.array(path)
+        u, v = nodes[:-1], nodes[1:]
+        costs = matrix[u, node] + matrix[node, v] - matrix[u, v]
+        if not fixed_end:
+            costs = np.append(costs, matrix[nodes[-1], node])
+        path.insert(int(np.argmin(costs)) + 1, int(node))
+    return path
+
+
+def reoptimize(distance_matrix, path, new_nodes=(), has_end_point=False, is_loop_route=False,
+               max_solve_ms=0):
+    """Insert new stops into a known tour and repair it with local search (see solve)."""
+    inserted = insert_stops(distance_matrix, path, new_nodes, has_end_point, is_loop_route)
+    return solve(distance_matrix, has_end_point=has_end_point, is_loop_route=is_loop_route,
+                 max_solve_ms=max_solve_ms, initial_path=inserted)
+
+
+def _candidate_costs(neighbors, costs, points, free_end):
+    """Return (cost, candidates) for a route known only through candidate lists.
+
+    cost(i, j) is the candidate cost when j is a candidate of i (or i of j);
+    other pairs are estimated from the straight-line distance between the
+    planar points, scaled by the median cost/distance ratio of the known
+    pairs. candidates[i] lists i's candidates, cheapest first. With
+    free_end, node n is a dummy end reachable from everywhere at zero cost
+    (see _with_free_end).
+    """
+    neighbors = np.asarray(neighbors, dtype=int)
+    costs = np.asarray(costs, dtype=float)
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    order = np.argsort(costs, axis=1, kind='stable')
+    neighbors = np.take_along_axis(neighbors, order, axis=1)
+    costs = np.take_along_axis(costs, order, axis=1)
+    known = [dict(zip(row, values)) for row, values in zip(neighbors.tolist(), costs.tolist())]
+
+    straight = np.hypot(*(points[neighbors] - points[:, None, :]).transpose(2, 0, 1))
+    usable = straight > 0
+    scale = float(np.median(costs[usable] / straight[usable])) if usable.any() else 1.0
+    xs = points[:, 0].tolist()
+    ys = points[:, 1].tolist()
+
+    def cost(i, j):
+        if i == n or j == n:
+            return 0.0
+        value = known[i].get(j)
+        if value is None:
+            value = known[j].get(i)
+            if value is None:
+                value = scale * math.hypot(xs[i] - xs[j], ys[i] - ys[j])
+        return value
+
+    candidates = neighbors.tolist() + ([[]] if free_end else [])
+    return cost, candidates
+
+
+def _candidate_path_cost(cost, path):
+    return float(sum(cost(a, b) for a, b in zip(path[:-1], path[1:])))
+
+
+def _candidate_nearest_neighbor(cost, candidates, points, end):
+    """Greedy path from node 0 to end: the cheapest unvisited candidate, else the nearest point."""
+    n = len(points)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    if end < n:
+        visited[end] = True
+
+    current = 0
+    path = [current]
+    for _ in range(int((~visited).sum())):
+        step = next((c for c in candidates[current] if not visited[c]), None)
+        if step is None:
+            # Every candidate is taken: fall back to the nearest unvisited point in the plane
+            squared = ((points - points[current]) ** 2).sum(axis=1)
+            squared[visited] = np.inf
+            step = int(np.argmin(squared))
+        visited[step] = True
+        path.append(step)
+        current = step
+    path.append(end)
+    return path
+
+
+def _candidate_local_search(path, cost, candidates, active=None, deadline=None):
+    """2-opt and Or-opt moves that create at least one candidate edge.
+
+    Nodes wait in a queue (all of them, or active) and are re-queued when
+    a move touches them, so repairs after a local change stay local. The
+    first and last positions never move. Reversed segments are costed as if
+    travel were symmetric, which road distances nearly are. Returns
+    (path, delta) with delta the change in cost.
+    """
+    path = np.array(path, dtype=int)
+    size = len(path)
+    pos = np.empty(int(path.max()) + 1, dtype=int)
+    pos[path] = np.arange(size)
+    queue = deque(path.tolist() if active is None else active)
+    queued = set(queue)
+    total = 0.0
+
+    def reverse(i, j):
+        path[i:j + 1] = path[i:j + 1][::-1]
+        pos[path[i:j + 1]] = np.arange(i, j + 1)
+
+    def move_segment(s, e, t, flip=False):
+        # Move path[s..e] (reversed with flip) to just after position t outside it
+        segment = path[s:e + 1][::-1].copy() if flip else path[s:e + 1].copy()
+        length = e - s + 1
+        if t < s:
+            path[t + 1 + length:e + 1] = path[t + 1:s].copy()
+            path[t + 1:t + 1 + length] = segment
+            lo, hi = t + 1, e
+        else:
+            path[s:t - length + 1] = path[e + 1:t + 1].copy()
+            path[t - length + 1:t + 1] = segment
+            lo, hi = s, t
+        pos[path[lo:hi + 1]] = np.arange(lo, hi + 1)
+
+    def two_opt_move(a):
+        i = int(pos[a])
+        if i < size - 1:
+            b = int(path[i + 1])
+            ab = cost(a, b)
+            for c in candidates[a]:
+                ac = cost(a, c)
+                if ac >= ab - IMPROVEMENT_EPSILON:
+                    break
+                j = int(pos[c])
+                if j <= i + 1 or j >= size - 1:
+                    continue
+                d = int(path[j + 1])
+                delta = ac + cost(b, d) - ab - cost(c, d)
+                if delta < -IMPROVEMENT_EPSILON:
+                    reverse(i + 1, j)
+                    return delta, (a, b, c, d)
+        if i > 0:
+            p = int(path[i - 1])
+            pa = cost(p, a)
+            for c in candidates[a]:
+                if cost(a, c) >= pa - IMPROVEMENT_EPSILON:
+                    break
+                j = int(pos[c])
+                if j >= i - 1 or j < 1:
+                    continue
+                e = int(path[j - 1])
+                delta = cost(e, p) + cost(c, a) - cost(e, c) - pa
+                if delta < -IMPROVEMENT_EPSILON:
+                    reverse(j, i - 1)
+                    return delta, (e, p, c, a)
+        return None
+
+    def or_opt_move(a):
+        s = int(pos[a])
+        if s < 1:
+            return None
+        for length in OR_OPT_SEGMENT_LENGTHS:
+            e = s + length - 1
+            if e > size - 2:
+                break
+            first, last = a, int(path[e])
+            prev, after = int(path[s - 1]), int(path[e + 1])
+            removal = cost(prev, first) + cost(last, after) - cost(prev, after)
+            # The segment goes next to a candidate c of one of its ends, either way round
+            for end, other, flip in ((first, last, False), (last, first, True)):
+                for c in candidates[end]:
+                    if cost(end, c) >= removal:
+                        break
+                    j = int(pos[c])
+                    # c -> end ... other -> v: segment after c
+                    if not (s - 1 <= j <= e or j >= size - 1):
+                        v = int(path[j + 1])
+                        delta = cost(c, end) + cost(other, v) - cost(c, v) - removal
+                        if delta < -IMPROVEMENT_EPSILON:
+                            move_segment(s, e, j, flip=flip)
+                            return delta, (prev, after, first, last, c, v)
+                    # u -> other ... end -> c: segment before c
+                    if not (s <= j <= e + 1 or j <= 0):
+                        u = int(path[j - 1])
+                        delta = cost(u, other) + cost(end, c) - cost(u, c) - removal
+                        if delta < -IMPROVEMENT_EPSILON:
+                            move_segment(s, e, j - 1, flip=not flip)
+                            return delta, (prev, after, first, last, u, c)
+        return None
+
+    while queue and not _expired(deadline):
+        a = queue.popleft()
+        queued.discard(a)
+        result = two_opt_move(a) or or_opt_move(a)
+        if result is None:
+            continue
+        delta, touched = result
+        total += delta
+        for node in (a,) + touched:
+            if node not in queued:
+                queued.add(node)
+                queue.append(node)
+    return path.tolist(), total
+
+
+def _candidate_kick(path, rng):
+    """Double-bridge within CANDIDATE_KICK_WINDOW positions; returns (path, delta edges, active nodes)."""
+    size = len(path)
+    span = min(CANDIDATE_KICK_WINDOW, size - 2)
+    start = int(rng.integers(1, size - span))
+    i, j, k = sorted(int(x) for x in rng.choice(np.arange(start + 1, start + span), size=3, replace=False))
+    kicked = path[:i] + path[j:k] + path[i:j] + path[k:]
+    removed = [(path[i - 1], path[i]), (path[j - 1], path[j]), (path[k - 1], path[k])]
+    added = [(path[i - 1], path[j]), (path[k - 1], path[i]), (path[j - 1], path[k])]
+    active = [path[i - 1], path[i], path[j - 1], path[j], path[k - 1], path[k]]
+    return kicked, removed, added, active
+
+
+def solve_candidates(neighbors, costs, points, has_end_point=False, is_loop_route=False, max_solve_ms=0,
+                     seed=None):
+    """Solver for large routes that knows travel costs only to each stop's nearest candidates.
+
+    neighbors is an (n, k) array of candidate indices and costs their travel
+    costs; points are planar x/y coordinates, used to estimate the few other
+    pairs a tour may need. Builds a candidate nearest-neighbor tour, improves
+    it with candidate-list 2-opt / Or-opt and, with max_solve_ms, keeps
+    applying local double-bridge kicks until the budget runs out. Memory
+    and time per pass grow with n * k. Same route conventions and result
+    dict as solve; the objective is under the candidate cost model.
+    """
+    started = time.perf_counter()
+    deadline = started + max_solve_ms / 1000.0 if max_solve_ms else None
+    n = len(points)
+    free_end = not (has_end_point or is_loop_route)
+    end = n if free_end else n - 1
+    cost, candidates = _candidate_costs(neighbors, costs, points, free_end)
+
+    path = _candidate_nearest_neighbor(cost, candidates, np.asarray(points, dtype=float), end) if n > 1 else [0]
+    initial_objective = current_cost = _candidate_path_cost(cost, path)
+    iterations = 0
+    improvements = 0
+
+    if len(path) >= 4:
+        path, delta = _candidate_local_search(path, cost, candidates, deadline=deadline)
+        current_cost += delta
+        rng = np.random.default_rng(seed)
+        while deadline is not None and not _expired(deadline) and len(path) >= 10:
+            iterations += 1
+            kicked, removed, added, active = _candidate_kick(path, rng)
+            kick_delta = sum(cost(a, b) for a, b in added) - sum(cost(a, b) for a, b in removed)
+            candidate, delta = _candidate_local_search(kicked, cost, candidates, active=active, deadline=deadline)
+            if kick_delta + delta < -IMPROVEMENT_EPSILON:
+                path = candidate
+                current_cost += kick_delta + delta
+                improvements += 1
+
+    path = [int(i) for i in path]
+    if free_end:
+        path = path[:-1]
+    elif is_loop_route:
+        path[-1] = 0  # The start's duplicate ends the search path; routes return to index 0
+    objective = _candidate_path_cost(cost, path)
+    return {
+        'path': path,
+        'objective': objective,
+        'initial_objective': initial_objective,
+        'improvement': initial_objective - objective,
+        'iterations': iterations,
+        'improvements': improvements,
+        'elapsed_ms': (time.perf_counter() - started) * 1000.0
+    }
+
+
+def _fleet_route_cost(matrix, customers, return_to_depot):
+    path = [0] + list(customers) + ([0] if return_to_depot else [])
+    return route_cost(matrix, path)
+
+
+def _improve_fleet_route(matrix, customers, return_to_depot):
+    if len(customers) < 2:
+        return list(customers)
+    path = [0] + list(customers) + [0]
+    search_matrix, search_path = _search_space(matrix, path[:-1] if not return_to_depot else path,
+                                               has_end_point=False, is_loop_route=return_to_depot)
+    improved = _from_search_space(improve_route(search_matrix, search_path),
+                                  has_end_point=False, is_loop_route=return_to_depot)
+    return improved[1:-1] if return_to_depot else improved[1:]
+
+
+def _savings_routes(matrix, vehicles, demands, max_capacity, return_to_depot):
+    """Clarke-Wright savings merges until at most `vehicles` routes remain."""
+    n = len(matrix)
+    routes = {c: [c] for c in range(1, n)}
+    route_of = np.arange(n)
+    loads = {c: float(demands[c]) for c in range(1, n)}
+    if len(routes) <= vehicles:
+        return list(routes.values()), [loads[r] for r in routes]
+
+    # Saving of appending the route starting at j after the route ending at i
+    savings = matrix[0, None, :] - matrix
+    if return_to_depot:
+        savings = savings + matrix[:, 0, None]
+    savings = savings[1:, 1:]
+    np.fill_diagonal(savings, -np.inf)
+    order = np.argsort(-savings, axis=None)
+
+    for flat in order:
+        if len(routes) <= vehicles:
+            break
+        i, j = (int(x) + 1 for x in np.unravel_index(flat, savings.shape))
+        if i == j:
+            continue
+        a, b = route_of[i], route_of[j]
+        if a == b or routes[a][-1] != i or routes[b][0] != j:
+            continue
+        if loads[a] + loads[b] > max_capacity:
+            continue
+        routes[a].extend(routes[b])
+        loads[a] += loads.pop(b)
+        for c in routes.pop(b):
+            route_of[c] = a
+
+    if len(routes) > vehicles:
+        raise ValueError("Not enough vehicle capacity to serve all stops")
+    return list(routes.values()), [loads[r] for r in routes]
+
+
+def _assign_vehicles(loads, capacities):
+    """First-fit decreasing assignment of route loads to vehicles; returns vehicle per route."""
+    remaining = list(capacities)
+    assignment = [None] * len(loads)
+    for r in sorted(range(len(loads)), key=lambda r: -loads[r]):
+        fits = [v for v in range(len(remaining)) if remaining[v] is not None and remaining[v] >= loads[r]]
+        if not fits:
+            raise ValueError("Not enough vehicle capacity to serve all stops")
+        v = min(fits, key=lambda v: remaining[v])
+        assignment[r] = v
+        remaining[v] = None
+    return assignment
+
+
+def _relocate_between_routes(matrix, routes, loads, caps, demands, return_to_depot,
+                             balance_weight=0.0, max_passes=10):
+    """Move single stops to the cheapest position in another route.
+
+    A move is applied when it lowers total cost + balance_weight * longest
+    route cost, so a positive weight trades some total distance for shorter
+    worst-case shifts.
+    """
+    costs = [_fleet_route_cost(matrix, route, return_to_depot) for route in routes]
+    for _ in range(max_passes):
+        moved = False
+        for a in range(len(routes)):
+            position = 0
+            while position < len(routes[a]):
+                route_a = routes[a]
+                stop = route_a[position]
+                prev_node = route_a[position - 1] if position > 0 else 0
+                if position + 1 < len(route_a):
+                    next_node = route_a[position + 1]
+                    removal_gain = matrix[prev_node, stop] + matrix[stop, next_node] - matrix[prev_node, next_node]
+                elif return_to_depot:
+                    removal_gain = matrix[prev_node, stop] + matrix[stop, 0] - matrix[prev_node, 0]
+                else:
+                    removal_gain = matrix[prev_node, stop]
+                old_max = max(costs)
+
+                best = None
+                for b in range(len(routes)):
+                    if b == a or loads[b] + demands[stop] > caps[b]:
+                        continue
+                    nodes = np.array([0] + routes[b] + ([0] if return_to_depot else []))
+                    u, v = nodes[:-1], nodes[1:]
+                    insertion = matrix[u, stop] + matrix[stop, v] - matrix[u, v]
+                    if not return_to_depot:
+                        # Appending after the last stop adds only the incoming edge
+                        insertion = np.append(insertion, matrix[nodes[-1], stop])
+                    delta = insertion - removal_gain
+                    if balance_weight:
+                        others = [c for r, c in enumerate(costs) if r != a and r != b]
+                        new_max = np.maximum(max(others + [costs[a] - removal_gain]), costs[b] + insertion)
+                        delta = delta + balance_weight * (new_max - old_max)
+                    k = int(np.argmin(delta))
+                    if best is None or delta[k] < best[0]:
+                        best = (delta[k], b, k, insertion[k])
+
+                if best is not None and best[0] < -IMPROVEMENT_EPSILON:
+                    _, b, k, insertion_cost = best
+                    routes[b].insert(k, route_a.pop(position))
+                    loads[a] -= demands[stop]
+                    loads[b] += demands[stop]
+                    costs[a] -= removal_gain
+                    costs[b] += insertion_cost
+                    moved = True
+                    continue
+                position += 1
+        if not moved:
+            break
+    return routes, loads
+
+
+def _sweep_routes(matrix, coordinates, vehicles, demands, max_capacity, return_to_depot,
+                  balance_weight, max_starts=24):
+    """Split stops into contiguous angular sectors around the depot.
+
+    Tries several starting angles, cuts the sweep into `vehicles` sectors of
+    roughly equal load (stop count when there is no demand) and keeps the
+    split with the lowest nearest-neighbor cost estimate.
+    """
+    coords = np.asarray(coordinates, dtype=float)
+    depot_lat, depot_lng = coords[0]
+    customers = np.arange(1, len(coords))
+    angles = np.arctan2(coords[1:, 0] - depot_lat,
+                        (coords[1:, 1] - depot_lng) * np.cos(np.radians(depot_lat)))
+    order = customers[np.argsort(angles)]
+    weights = demands[order] if demands[1:].any() else np.ones(len(order))
+    target = weights.sum() / vehicles
+
+    best = None
+    step = max(1, len(order) // max_starts)
+    for start in range(0, len(order), step):
+        sequence = np.roll(order, -start)
+        sequence_weights = np.roll(weights, -start)
+        routes = [[]]
+        loads = [0.0]
+        for stop, weight in zip(sequence, sequence_weights):
+            load = loads[-1] + demands[stop]
+            full = loads[-1] + weight > target * 1.05 if demands[1:].any() else len(routes[-1]) >= target
+            if routes[-1] and len(routes) < vehicles and (full or load > max_capacity):
+                routes.append([])
+                loads.append(0.0)
+            routes[-1].append(int(stop))
+            loads[-1] += demands[stop]
+        if max(loads) > max_capacity:
+            continue
+        costs = []
+        for route in routes:
+            sub = [0] + route
+            path = nearest_neighbor(matrix[np.ix_(sub, sub)])
+            costs.append(_fleet_route_cost(matrix, [sub[k] for k in path[1:]], return_to_depot))
+        score = sum(costs) + balance_weight * max(costs)
+        if best is None or score < best[0]:
+            best = (score, routes, loads)
+
+    if best is None:
+        return None
+    return best[1], best[2]
+
+
+def _fleet_score(costs, balance_weight):
+    return sum(costs) + balance_weight * (max(costs) if costs else 0.0)
+
+
+def solve_fleet(distance_matrix, vehicles, demands=None, capacities=None, return_to_depot=False,
+                balance_weight=0.0, coordinates=None):
+    """Split stops 1..n-1 across vehicles starting at the depot (index 0).
+
+    Routes are built with Clarke-Wright savings merges until at most
+    `vehicles` remain, each is improved with 2-opt / Or-opt, and stops are
+    then relocated between routes while total cost plus balance_weight times
+    the longest route cost drops. demands
+    (per location, depot ignored) and capacities (per vehicle) are
+    optional. When [lat, lng] coordinates are given, a sweep construction is
+    also tried and the better of the two plans is kept. Returns a dict with
+    one entry per used vehicle and the total objective. Raises ValueError
+    when the fleet cannot carry the demand.
+    """
+    matrix = np.asarray(distance_matrix, dtype=float)
+    n = len(matrix)
+    demands = np.zeros(n) if demands is None else np.asarray(demands, dtype=float)
+    demands = demands.copy()
+    demands[0] = 0
+    caps = [float('inf')] * vehicles if capacities is None else [float(c) for c in capacities]
+    if len(caps) != vehicles:
+        raise ValueError("capacities must have one entry per vehicle")
+    if n > 1 and demands[1:].max() > max(caps):
+        raise ValueError("A stop's demand exceeds every vehicle's capacity")
+
+    constructions = [_savings_routes(matrix, vehicles, demands, max(caps), return_to_depot)]
+    if coordinates is not None and n > vehicles + 1:
+        sweep = _sweep_routes(matrix, coordinates, vehicles, demands, max(caps),
+                              return_to_depot, balance_weight)
+        if sweep is not None:
+            constructions.append(sweep)
+
+    best = None
+    for routes, loads in constructions:
+        try:
+            assignment = _assign_vehicles(loads, caps)
+        except ValueError:
+            continue
+        route_caps = [caps[v] for v in assignment]
+        routes = [_improve_fleet_route(matrix, route, return_to_depot) for route in routes]
+        routes, loads = _relocate_between_routes(matrix, routes, loads, route_caps, demands,
+                                                 return_to_depot, balance_weight)
+        routes = [_improve_fleet_route(matrix, route, return_to_depot) for route in routes]
+        score = _fleet_score([_fleet_route_cost(matrix, route, return_to_depot) for route in routes],
+                             balance_weight)
+        if best is None or score < best[0]:
+            best = (score, routes, loads, assignment)
+    if best is None:
+        raise ValueError("Not enough vehicle capacity to serve all stops")
+    _, routes, loads, assignment = best
+
+    vehicle_routes = []
+    for route, load, vehicle in sorted(zip(routes, loads, assignment), key=lambda item: item[2]):
+        if not route:
+            continue
+        path = [0] + [int(c) for c in route] + ([0] if return_to_depot else [])
+        vehicle_routes.append({
+            'vehicle': vehicle,
+            'path': path,
+            'load': float(load),
+            'objective': route_cost(matrix, path)
+        })
+    return {
+        'routes': vehicle_routes,
+        'objective': sum(route['objective'] for route in vehicle_routes)
+    }
+
+
+def schedule_times(duration_matrix, paths, service_times=None, earliest=None, latest=None):
+    """Vectorized arrival-time propagation along one path or a (k, L) batch of paths.
+
+    Service at stop k starts at max(earliest[k], start of k-1 + service[k-1]
+    + travel); with c the cumulative service + travel time this is
+    c + running_max(earliest - c), so every path is scheduled in a few
+    array operations. The tour departs at time 0 (or the start's window).
+    Returns (service_start, lateness) with the same shape as paths.
+    """
+    duration_matrix = np.asarray(duration_matrix, dtype=float)
+    paths = np.asarray(paths)
+    single = paths.ndim == 1
+    paths = np.atleast_2d(paths)
+    n = len(duration_matrix)
+    service = np.zeros(n) if service_times is None else np.asarray(service_times, dtype=float)
+    earliest = np.full(n, -np.inf) if earliest is None else np.asarray(earliest, dtype=float)
+    latest = np.full(n, np.inf) if latest is None else np.asarray(latest, dtype=float)
+
+    a, b = paths[:, :-1], paths[:, 1:]
+    step = service[a] + duration_matrix[a, b]
+    cumulative = np.concatenate((np.zeros((len(paths), 1)), np.cumsum(step, axis=1)), axis=1)
+    window_start = earliest[paths]
+    window_start[:, 0] = np.maximum(window_start[:, 0], 0.0)
+    start = cumulative + np.maximum.accumulate(window_start - cumulative, axis=1)
+    lateness = np.maximum(0.0, start - latest[paths])
+    if single:
+        return start[0], lateness[0]
+    return start, lateness
+
+
+def window_bounds(time_windows, n):
+    """(earliest, latest) arrays from per-stop (earliest, latest) pairs; None is unbounded."""
+    earliest = np.full(n, -np.inf)
+    latest = np.full(n, np.inf)
+    for i, window in enumerate(time_windows or []):
+        if window is not None:
+            earliest[i] = -np.inf if window[0] is None else window[0]
+            latest[i] = np.inf if window[1] is None else window[1]
+    return earliest, latest
+
+
+def loop_schedule_path(path, n):
+    """A loop path's closing return to index 0 as the start's duplicate n - 1.
+
+    Loop tours end on 0, but the return is a visit to the appended
+    duplicate, which has no window and no service time of its own.
+    """
+    path = [int(i) for i in path]
+    if len(path) > 1 and path[-1] == path[0] == 0:
+        path[-1] = n - 1
+    return path
+
+
+def _time_window_costs(paths, objective_matrix, duration_matrix, service, earliest, latest,
+                       objective, penalty):
+    """Objective + penalty * total lateness for a (k, L) batch of paths."""
+    start, lateness = schedule_times(duration_matrix, paths, service, earliest, latest)
+    if objective == 'duration':
+        # Shift length: from departure until service at the last stop is done
+        base = start[:, -1] + service[paths[:, -1]] - start[:, 0]
+    else:
+        base = objective_matrix[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+    return base + penalty * lateness.sum(axis=1)
+
+
+def _two_opt_candidates(path, i):
+    size = len(path)
+    j = np.arange(i + 2, size - 1)[:, None]
+    positions = np.arange(size)[None, :]
+    segment = (positions >= i + 1) & (positions <= j)
+    return path[np.where(segment, i + 1 + j - positions, positions)]
+
+
+def _or_opt_candidates(path, start, length):
+    size = len(path)
+    end = start + length - 1
+    targets = np.concatenate((np.arange(0, start - 1), np.arange(end + 1, size - 1)))[:, None]
+    if not len(targets):
+        return None
+    p = np.arange(size)[None, :]
+    before = targets < start
+    source = np.select(
+        [before & (p > targets) & (p <= targets + length),
+         before & (p > targets + length) & (p <= end),
+         ~before & (p >= start) & (p <= targets - length),
+         ~before & (p > targets - length) & (p <= targets)],
+        [start + p - targets - 1,
+         p - length,
+         p + length,
+         start + p - (targets - length + 1)],
+        default=p
+    )
+    return path[source]
+
+
+def _time_window_local_search(path, cost_of, deadline=None, max_rounds=50):
+    """Best-improvement 2-opt / Or-opt where each neighborhood is scored as one batch."""
+    path = np.array(path)
+    current = cost_of(path[None, :])[0]
+    for _ in range(max_rounds):
+        improved = False
+        neighborhoods = [('2opt', i) for i in range(len(path) - 3)]
+        neighborhoods += [('oropt', (s, k)) for k in OR_OPT_SEGMENT_LENGTHS
+                          for s in range(1, len(path) - k)]
+        for kind, arg in neighborhoods:
+            if _expired(deadline):
+                return path.tolist(), current
+            if kind == '2opt':
+                candidates = _two_opt_candidates(path, arg)
+            else:
+                candidates = _or_opt_candidates(path, *arg)
+            if candidates is None or not len(candidates):
+                continue
+            costs = cost_of(candidates)
+            best = int(np.argmin(costs))
+            if costs[best] < current - IMPROVEMENT_EPSILON:
+                path, current = candidates[best], costs[best]
+                improved = True
+        if not improved:
+            break
+    return path.tolist(), current
+
+
+def solve_time_windows(distance_matrix, duration_matrix, has_end_point=False, is_loop_route=False,
+                       service_times=None, time_windows=None, objective='distance',
+                       lateness_penalty=100.0, max_solve_ms=0, seed=None, initial_path=None):
+    """Order stops under per-stop time windows and service times.
+
+    time_windows is a sequence of (earliest, latest) seconds after departure
+    (None for no window). The objective is total distance or shift duration
+    plus lateness_penalty per second late; moves are scored by batched
+    arrival-time propagation (schedule_times). initial_path replaces the
+    nearest-neighbor construction. Returns the same dict as solve, plus
+    per-stop arrival and lateness along the path.
+    """
+    started = time.perf_counter()
+    deadline = started + max_solve_ms / 1000.0 if max_solve_ms else None
+    distance_matrix = np.asarray(distance_matrix, dtype=float)
+    duration_matrix = np.asarray(duration_matrix, dtype=float)
+    n = len(distance_matrix)
+    service = np.zeros(n) if service_times is None else np.asarray(service_times, dtype=float)
+    earliest, latest = window_bounds(time_windows, n)
+    objective_matrix = duration_matrix if objective == 'duration' else distance_matrix
+
+    if initial_path is not None:
+        path = [int(i) for i in initial_path]
+    else:
+        path = nearest_neighbor(objective_matrix, has_end_point=has_end_point, is_loop_route=is_loop_route)
+    fixed_end = has_end_point or is_loop_route
+    # Score the loop's return as the duplicate end, mapped back to 0 in the result
+    returns_to_start = is_loop_route and len(path) > 1 and path[-1] == 0
+    if returns_to_start:
+        path = loop_schedule_path(path, n)
+    if not fixed_end:
+        # Zero-cost dummy end node without a window (see _with_free_end)
+        objective_matrix = _with_free_end(objective_matrix)
+        search_durations = _with_free_end(duration_matrix)
+        service = np.append(service, 0.0)
+        earliest = np.append(earliest, -np.inf)
+        latest = np.append(latest, np.inf)
+        path = path + [n]
+    else:
+        search_durations = duration_matrix
+
+    def cost_of(paths):
+        return _time_window_costs(paths, objective_matrix, search_durations, service, earliest,
+                                  latest, objective, lateness_penalty)
+
+    initial_objective = float(cost_of(np.array(path)[None, :])[0])
+    iterations = 0
+    improvements = 0
+    best, best_cost = path, initial_objective
+    if len(path) >= 4:
+        best, best_cost = _time_window_local_search(path, cost_of, deadline)
+        rng = np.random.default_rng(seed)
+        while deadline is not None and not _expired(deadline) and len(best) > 4:
+            iterations += 1
+            candidate, candidate_cost = _time_window_local_search(_perturb(best, rng), cost_of, deadline)
+            if candidate_cost < best_cost - IMPROVEMENT_EPSILON:
+                best, best_cost = candidate, candidate_cost
+                improvements += 1
+
+    arrivals, lateness = schedule_times(search_durations, best, service, earliest, latest)
+    if not fixed_end:
+        best, arrivals, lateness = best[:-1], arrivals[:-1], lateness[:-1]
+    elif returns_to_start:
+        best = list(best[:-1]) + [0]
+    return {
+        'path': [int(i) for i in best],
+        'objective': float(best_cost),
+        'initial_objective': initial_objective,
+        'improvement': initial_objective - float(best_cost),
+        'iterations': iterations,
+        'improvements': improvements,
+        'elapsed_ms': (time.perf_counter() - started) * 1000.0,
+        'arrivals': arrivals.tolist(),
+        'lateness': lateness.tolist(),
+        'total_lateness': float(lateness.sum()),
+        'feasible': bool(lateness.sum() <= IMPROVEMENT_EPSILON)
+    }
@@ -0,0 +1,885 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from app import app, db
+from metrics import timed_stage
+from models import Route
+from geocoding import geocode_addresses, normalize_address
+import directions
+from distance_matrix import (get_distance_matrix, get_pair_costs, nearest_candidates, planar_points,
+                             OFFLINE_PROVIDERS, PROVIDERS as DISTANCE_PROVIDERS)
+from optimizer import (solve, solve_candidates, solve_fleet, solve_time_windows, reoptimize, route_cost,
+                       loop_schedule_path, schedule_times, window_bounds)
+
+# Stages reported to progress callbacks, in the order the UI shows them
+STAGES = ('geocoding', 'matrix', 'solving')
+OBJECTIVES = ('distance', 'duration')
+
+
+class OptimizationError(Exception):
+    """Pipeline failure carrying the HTTP status and JSON fields to report."""
+
+    def __init__(self, message, status=500, **details):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+    def to_dict(self):
+        return {'success': False, 'error': self.message, **self.details}
+
+
+def _parse_clock(value, field):
+    """'HH:MM' -> seconds after midnight."""
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except (TypeError, ValueError):
+        raise OptimizationError(f'{field} must be a time as HH:MM', 400)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise OptimizationError(f'{field} must be a time as HH:MM', 400)
+    return hours * 3600 + minutes * 60
+
+
+def format_clock(departure_time, seconds):
+    """Clock time seconds after departure_time ('HH:MM'), or None without a departure time."""
+    if not departure_time:
+        return None
+    total = int(round(_parse_clock(departure_time, 'departure_time') + seconds)) // 60
+    return f"{total // 60 % 24:02d}:{total % 60:02d}"
+
+
+def _parse_time_window(window, departure_time, field):
+    """[earliest, latest] in seconds after departure; bounds may be numbers or 'HH:MM'."""
+    if window is None:
+        return None
+    if isinstance(window, dict):
+        window = [window.get('start'), window.get('end')]
+    if not isinstance(window, (list, tuple)) or len(window) != 2:
+        raise OptimizationError(f'{field} must be [start, end]', 400)
+    bounds = []
+    for bound in window:
+        if bound is None or bound == '':
+            bounds.append(None)
+        elif isinstance(bound, str) and ':' in bound:
+            if not departure_time:
+                raise OptimizationError('departure_time is required for clock-time windows', 400)
+            seconds = _parse_clock(bound, field) - _parse_clock(departure_time, 'departure_time')
+            bounds.append(float(seconds % 86400))
+        else:
+            try:
+                bounds.append(float(bound))
+            except (TypeError, ValueError):
+                raise OptimizationError(f'{field} bounds must be seconds or HH:MM', 400)
+    if bounds[0] is not None and bounds[1] is not None and bounds[1] < bounds[0]:
+        raise OptimizationError(f'{field} ends before it starts', 400)
+    return bounds
+
+
+def _parse_time_windows(windows, length, departure_time):
+    if windows is None:
+        return None
+    if not isinstance(windows, list) or len(windows) != length:
+        raise OptimizationError(f'time_windows must have {length} entries', 400)
+    return [_parse_time_window(window, departure_time, f'time_windows[{i}]')
+            for i, window in enumerate(windows)]
+
+
+def parse_optimize_request(data):
+    """Validate an /optimize payload and apply the loop / end point rules.
+
+    Returns the parameters used by create_route and run_optimization.
+    Raises OptimizationError (400) for invalid input.
+    """
+    data = data or {}
+    addresses = list(data.get('addresses', []))
+    has_end_point = data.get('has_end_point', False)
+    end_point = data.get('end_point')
+    is_loop_route = data.get('is_loop_route', False)
+    distance_provider = data.get('distance_provider') or app.config["DISTANCE_PROVIDER"]
+    max_solve_ms = data.get('max_solve_ms', app.config["SOLVER_DEFAULT_BUDGET_MS"])
+    objective = data.get('objective') or 'distance'
+    departure_time = data.get('departure_time') or None
+
+    app.logger.info(f"Received {len(addresses)} addresses for optimization")
+
+    if not addresses or len(addresses) < 2:
+        raise OptimizationError('At least two addresses are required', 400)
+
+    if distance_provider not in DISTANCE_PROVIDERS:
+        raise OptimizationError(f'Unknown distance provider: {distance_provider}', 400)
+
+    try:
+        max_solve_ms = min(max(int(max_solve_ms or 0), 0), app.config["SOLVER_MAX_BUDGET_MS"])
+    except (TypeError, ValueError):
+        raise OptimizationError('max_solve_ms must be an integer number of milliseconds', 400)
+
+    if objective not in OBJECTIVES:
+        raise OptimizationError(f'objective must be one of: {", ".join(OBJECTIVES)}', 400)
+    if departure_time:
+        _parse_clock(departure_time, 'departure_time')
+
+    # Windows and service times are given per input address
+    time_windows = _parse_time_windows(data.get('time_windows'), len(addresses), departure_time)
+    service_times = _parse_number_list(data.get('service_times'), len(addresses), 'service_times')
+
+    # Handle loop route
+    if is_loop_route:
+        app.logger.info("Processing loop route")
+        has_end_point = False
+        end_point = addresses[0]
+        if addresses[0] != addresses[-1]:
+            app.logger.info("Adding start point as end point for loop route")
+            addresses.append(addresses[0])
+    elif has_end_point and not end_point:
+        raise OptimizationError('End point is required when has_end_point is true', 400)
+    elif has_end_point and end_point:
+        if end_point not in addresses:  # Only add if not already present
+            addresses.append(end_point)
+
+    # Appended loop return / end point: no window, no service
+    if time_windows is not None:
+        time_windows += [None] * (len(addresses) - len(time_windows))
+    if service_times is not None:
+        service_times += [0.0] * (len(addresses) - len(service_times))
+
+    return {
+        'addresses': addresses,
+        'has_end_point': has_end_point,
+        'is_loop_route': is_loop_route,
+        'distance_provider': distance_provider,
+        'max_solve_ms': max_solve_ms,
+        'objective': objective,
+        'departure_time': departure_time,
+        'time_windows': time_windows,
+        'service_times': service_times,
+        'name': data.get('name', f"Route {datetime.utcnow()}"),
+        'description': data.get('description', '')
+    }
+
+
+def store_route_geometry(route, locations, distance_matrix, duration_matrix, path):
+    """Persist coordinates, matrices and per-leg stats alongside the route.
+
+    locations and the matrices are aligned with route.addresses; path is
+    the optimized order as indices into them.
+    """
+    route.coordinates = [[location['lat'], location['lng']] for location in locations]
+    route.stop_order = [int(i) for i in path]
+    route.set_matrices(distance_matrix, duration_matrix)
+    route.legs = [{
+        'distance': float(distance_matrix[a, b]),
+        'duration': float(duration_matrix[a, b])
+    } for a, b in zip(path[:-1], path[1:])]
+    store_route_schedule(route, duration_matrix, path)
+
+
+def store_route_schedule(route, duration_matrix, path):
+    """Per-stop arrival, departure and lateness along path from the route's windows.
+
+    Without windows or service times this is the cumulative drive time. A
+    loop's return to the start is scheduled as the start's duplicate.
+    """
+    n = len(route.addresses)
+    service = np.array(route.service_times if route.service_times else [0.0] * n, dtype=float)
+    earliest, latest = window_bounds(route.time_windows, n)
+    if _route_flags(route)[1]:
+        path = loop_schedule_path(path, n)
+    arrivals, lateness = schedule_times(duration_matrix, path, service, earliest, latest)
+    route.schedule = [{
+        'arrival': float(arrival),
+        'departure': float(arrival + service[index]),
+        'late_by': float(late),
+        'eta': format_clock(route.departure_time, arrival)
+    } for index, arrival, late in zip(path, arrivals, lateness)]
+
+
+def store_route_legs(route, locations, path, leg_distances, leg_durations):
+    """Persist coordinates and per-leg stats for a large route, without matrices.
+
+    Large routes have no time windows or service times, so the schedule is
+    the cumulative drive time.
+    """
+    route.coordinates = [[location['lat'], location['lng']] for location in locations]
+    route.stop_order = [int(i) for i in path]
+    route.distance_matrix = None
+    route.duration_matrix = None
+    route.legs = [{'distance': float(distance), 'duration': float(duration)}
+                  for distance, duration in zip(leg_distances, leg_durations)]
+    arrivals = np.concatenate(([0.0], np.cumsum(leg_durations)))
+    route.schedule = [{
+        'arrival': float(arrival),
+        'departure': float(arrival),
+        'late_by': 0.0,
+        'eta': format_clock(route.departure_time, arrival)
+    } for arrival in arrivals]
+
+
+def _skip_offline_directions(routes, provider):
+    """Keep routes from an offline distance provider away from the Directions API.
+
+    Other routes get their road geometry from directions.request_backfill
+    once committed.
+    """
+    if provider in OFFLINE_PROVIDERS:
+        directions.skip_directions(routes)
+
+
+def _is_large_route(params, size):
+    """Routes this big (without windows or service times) use the candidate-list pipeline."""
+    threshold = app.config["LARGE_ROUTE_STOPS"]
+    return (threshold > 0 and size >= threshold
+            and not params.get('time_windows') and not params.get('service_times'))
+
+
+def _solve_large_route(coordinates, api_key, params, report):
+    """Candidate-list pipeline: costs only to each stop's nearest stops, then the chosen legs.
+
+    Returns (solution, matrix_stats, leg_distances, leg_durations). Fetches
+    and memory grow with stops * LARGE_ROUTE_CANDIDATES instead of stops^2.
+    """
+    report('matrix')
+    points = planar_points(coordinates)
+    neighbors = nearest_candidates(points, app.config["LARGE_ROUTE_CANDIDATES"])
+    origins = np.repeat(np.arange(len(coordinates)), neighbors.shape[1])
+    matrix_stats = {}
+    with timed_stage('matrix'):
+        distances, durations = get_pair_costs(coordinates, origins, neighbors.ravel(), api_key,
+                                              stats=matrix_stats, provider=params['distance_provider'])
+    costs = durations if params['objective'] == 'duration' else distances
+    app.logger.info(f"Candidate costs for {len(coordinates)} stops complete: {matrix_stats}")
+
+    report('solving')
+    with timed_stage('solve'):
+        solution = solve_candidates(neighbors, costs.reshape(neighbors.shape), points,
+                                    has_end_point=params['has_end_point'],
+                                    is_loop_route=params['is_loop_route'],
+                                    max_solve_ms=params['max_solve_ms'] or app.config["LARGE_ROUTE_BUDGET_MS"])
+    solution['candidates'] = int(neighbors.shape[1])
+
+    # Legs the tour uses outside the candidate lists are fetched now (mostly cache hits)
+    path = solution['path']
+    leg_stats = {}
+    with timed_stage('matrix'):
+        leg_distances, leg_durations = get_pair_costs(coordinates, path[:-1], path[1:], api_key,
+                                                      stats=leg_stats, provider=params['distance_provider'])
+    matrix_stats['legs'] = leg_stats
+    return solution, matrix_stats, leg_distances, leg_durations
+
+
+def _solve_route(distance_matrix, duration_matrix, options, lateness_penalty, initial_path=None):
+    """Pick the solver for a route: time-window search when windows or service times are set."""
+    if options.get('time_windows') or options.get('service_times'):
+        return solve_time_windows(
+            distance_matrix, duration_matrix,
+            has_end_point=options['has_end_point'],
+            is_loop_route=options['is_loop_route'],
+            service_times=options.get('service_times'),
+            time_windows=options.get('time_windows'),
+            objective=options.get('objective', 'distance'),
+            lateness_penalty=lateness_penalty,
+            max_solve_ms=options['max_solve_ms'],
+            initial_path=initial_path
+        )
+    matrix = duration_matrix if options.get('objective') == 'duration' else distance_matrix
+    return solve(matrix, has_end_point=options['has_end_point'], is_loop_route=options['is_loop_route'],
+                 max_solve_ms=options['max_solve_ms'], initial_path=initial_path)
+
+
+def _solver_summary(solution):
+    return {key: value for key, value in solution.items() if key not in ('path', 'arrivals', 'lateness')}
+
+
+def create_route(params):
+    """Store the route with its input order before optimization starts."""
+    try:
+        app.logger.info("Storing initial route in database")
+        route = Route()
+        route.name = params['name']
+        route.description = params['description']
+        route.addresses = params['addresses']
+        route.optimized_route = params['addresses']  # Initially same as input order
+        route.is_loop_route = params['is_loop_route']
+        route.has_end_point = params['has_end_point']
+        route.objective = params['objective']
+        route.time_windows = params['time_windows']
+        route.service_times = params['service_times']
+        route.departure_time = params['departure_time']
+        db.session.add(route)
+        db.session.commit()
+        app.logger.info(f"Initial route stored with ID: {route.id}")
+        return route
+    except Exception as db_error:
+        db.session.rollback()
+        app.logger.error(f"Database error: {str(db_error)}")
+        raise OptimizationError('Failed to store route information', 500)
+
+
+def run_optimization(route, params, progress=None):
+    """Geocode, build the matrices, solve and persist the result on route.
+
+    progress, when given, is called with each name in STAGES as the pipeline
+    reaches it. Returns the JSON-ready result; raises OptimizationError.
+    """
+    def report(stage):
+        if progress:
+            progress(stage)
+
+    addresses = params['addresses']
+
+    # Geocode addresses using Google Maps Geocoding API
+    report('geocoding')
+    app.logger.info("Starting geocoding process")
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not api_key:
+        app.logger.error("Google Maps API key not found in environment variables")
+        raise OptimizationError('Missing API configuration', 500)
+
+    with timed_stage('geocode'):
+        locations, geocode_errors = geocode_addresses(addresses, api_key)
+    if geocode_errors:
+        failed = [addresses[i] for i in sorted(geocode_errors)]
+        raise OptimizationError(geocode_errors[min(geocode_errors)], 400, failed_addresses=failed)
+
+    geocoded_addresses = [location['formatted_address'] for location in locations]
+    coordinates = [f"{location['lat']},{location['lng']}" for location in locations]
+
+    large = _is_large_route(params, len(coordinates))
+    try:
+        if large:
+            app.logger.info(f"Large route ({len(coordinates)} stops): using candidate lists")
+            solution, matrix_stats, leg_distances, leg_durations = _solve_large_route(
+                coordinates, api_key, params, report)
+            total_distance = float(np.sum(leg_distances))
+            total_duration = float(np.sum(leg_durations))
+        else:
+            # Get distance matrix
+            report('matrix')
+            app.logger.info("Calculating distance matrix")
+            matrix_stats = {}
+            with timed_stage('matrix'):
+                distance_matrix, duration_matrix = get_distance_matrix(
+                    coordinates, api_key, stats=matrix_stats, provider=params['distance_provider'])
+            app.logger.info(f"Distance matrix calculation complete: {matrix_stats}")
+
+            # Calculate optimal route
+            report('solving')
+            app.logger.info("Calculating optimal route")
+            with timed_stage('solve'):
+                solution = _solve_route(distance_matrix, duration_matrix, params,
+                                        app.config["TIME_WINDOW_LATENESS_PENALTY"])
+            total_distance = route_cost(distance_matrix, solution['path'])
+            total_duration = route_cost(duration_matrix, solution['path'])
+
+        optimal_route_indices = solution['path']
+        optimized_addresses = [geocoded_addresses[i] for i in optimal_route_indices]
+        app.logger.info(f"Route optimization complete: {solution['iterations']} iterations, "
+                        f"objective {solution['initial_objective']:.0f} -> {solution['objective']:.0f} "
+                        f"in {solution['elapsed_ms']:.0f} ms")
+
+        # Update route with optimized addresses and statistics
+        app.logger.info("Updating route with optimized addresses")
+        route.optimized_route = optimized_addresses
+        route.total_distance = total_distance
+        route.total_duration = total_duration
+        with timed_stage('persist'):
+            if large:
+                store_route_legs(route, locations, optimal_route_indices, leg_distances, leg_durations)
+            else:
+                store_route_geometry(route, locations, distance_matrix, duration_matrix, optimal_route_indices)
+            _skip_offline_directions([route], params['distance_provider'])
+            db.session.commit()
+        directions.request_backfill([route])
+        app.logger.info(f"Route {route.id} successfully optimized")
+    except Exception as opt_error:
+        db.session.rollback()
+        app.logger.error(f"Optimization error: {str(opt_error)}")
+        raise OptimizationError('Failed to optimize route', 500)
+
+    return {
+        'success': True,
+        'route_id': route.id,
+        'addresses': optimized_addresses,
+        'coordinates': route.optimized_coordinates(),
+        'legs': route.legs,
+        'schedule': route.schedule,
+        'total_distance': total_distance,
+        'total_duration': total_duration,
+        'matrix_stats': matrix_stats,
+        'solver': _solver_summary(solution)
+    }
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _solver_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=app.config["BATCH_SOLVER_PROCESSES"])
+        return _process_pool
+
+
+def _solve_all(jobs):
+    """Run _solve_route(*args) for each job across the process pool, in order.
+
+    Falls back to solving in-process if the pool cannot be used.
+    """
+    if len(jobs) > 1 and app.config["BATCH_SOLVER_PROCESSES"] > 1:
+        try:
+            return list(_solver_pool().map(_solve_job, jobs))
+        except Exception as e:
+            app.logger.warning(f"Process pool unavailable, solving batch in-process: {e}")
+    return [_solve_job(job) for job in jobs]
+
+
+def _solve_job(job):
+    return _solve_route(*job)
+
+
+def run_batch_optimization(data):
+    """Optimize many route specs with shared geocoding and matrix fetches.
+
+    Addresses are deduplicated across all specs and geocoded once; each
+    distance provider used builds one matrix over the union of stops,
+    fetching only the pairs some route needs. Routes are solved in parallel
+    in a process pool and stored in a single transaction.
+    """
+    data = data or {}
+    specs = data.get('routes') or []
+    if not specs:
+        raise OptimizationError('At least one route is required', 400)
+    if len(specs) > app.config["BATCH_MAX_ROUTES"]:
+        raise OptimizationError(f'At most {app.config["BATCH_MAX_ROUTES"]} routes per batch', 400)
+
+    all_params = []
+    for index, spec in enumerate(specs):
+        try:
+            all_params.append(parse_optimize_request(spec))
+        except OptimizationError as e:
+            raise OptimizationError(f'Route {index + 1}: {e.message}', e.status, route_index=index)
+
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not api_key:
+        app.logger.error("Google Maps API key not found in environment variables")
+        raise OptimizationError('Missing API configuration', 500)
+
+    # Union of stops across every route, keyed like the geocode cache
+    unique_addresses = []
+    union_index = {}
+    route_indices = []
+    for params in all_params:
+        indices = []
+        for address in params['addresses']:
+            key = normalize_address(address)
+            if key not in union_index:
+                union_index[key] = len(unique_addresses)
+                unique_addresses.append(address)
+            indices.append(union_index[key])
+        route_indices.append(indices)
+    app.logger.info(f"Batch of {len(all_params)} routes uses {len(unique_addresses)} unique addresses")
+
+    with timed_stage('geocode'):
+        locations, geocode_errors = geocode_addresses(unique_addresses, api_key)
+    if geocode_errors:
+        failed = [unique_addresses[i] for i in sorted(geocode_errors)]
+        raise OptimizationError(geocode_errors[min(geocode_errors)], 400, failed_addresses=failed)
+    coordinates = [f"{location['lat']},{location['lng']}" for location in locations]
+
+    try:
+        # One union matrix per distance provider, limited to the pairs its routes use
+        n = len(unique_addresses)
+        matrices = {}
+        matrix_stats = {}
+        for provider in sorted({params['distance_provider'] for params in all_params}):
+            required = np.zeros((n, n), dtype=bool)
+            for params, indices in zip(all_params, route_indices):
+                if params['distance_provider'] == provider:
+                    required[np.ix_(indices, indices)] = True
+            stats = {}
+            with timed_stage('matrix'):
+                matrices[provider] = get_distance_matrix(coordinates, api_key, stats=stats,
+                                                         provider=provider, required=required)
+            matrix_stats[provider] = stats
+        app.logger.info(f"Batch distance matrices complete: {matrix_stats}")
+
+        jobs = []
+        options = ('has_end_point', 'is_loop_route', 'max_solve_ms', 'objective',
+                   'time_windows', 'service_times')
+        for params, indices in zip(all_params, route_indices):
+            distance_matrix, duration_matrix = matrices[params['distance_provider']]
+            block = np.ix_(indices, indices)
+            jobs.append((distance_matrix[block], duration_matrix[block],
+                         {key: params[key] for key in options},
+                         app.config["TIME_WINDOW_LATENESS_PENALTY"]))
+        with timed_stage('solve'):
+            solutions = _solve_all(jobs)
+
+        routes = []
+        results = []
+        for params, indices, solution in zip(all_params, route_indices, solutions):
+            distance_matrix, duration_matrix = matrices[params['distance_provider']]
+            stops = [indices[i] for i in solution['path']]
+            route = Route()
+            route.name = params['name']
+            route.description = params['description']
+            route.addresses = params['addresses']
+            route.optimized_route = [locations[i]['formatted_address'] for i in stops]
+            route.is_loop_route = params['is_loop_route']
+            route.has_end_point = params['has_end_point']
+            route.objective = params['objective']
+            route.time_windows = params['time_windows']
+            route.service_times = params['service_times']
+            route.departure_time = params['departure_time']
+            route.total_distance = route_cost(distance_matrix, stops)
+            route.total_duration = route_cost(duration_matrix, stops)
+            block = np.ix_(indices, indices)
+            store_route_geometry(route, [locations[i] for i in indices],
+                                 distance_matrix[block], duration_matrix[block], solution['path'])
+            _skip_offline_directions([route], params['distance_provider'])
+            db.session.add(route)
+            routes.append(route)
+            results.append(solution)
+        with timed_stage('persist'):
+            db.session.commit()
+        directions.request_backfill(routes)
+        app.logger.info(f"Batch of {len(routes)} routes stored")
+    except Exception as opt_error:
+        db.session.rollback()
+        app.logger.error(f"Batch optimization error: {str(opt_error)}")
+        raise OptimizationError('Failed to optimize routes', 500)
+
+    return {
+        'success': True,
+        'unique_addresses': len(unique_addresses),
+        'matrix_stats': matrix_stats,
+        'routes': [{
+            'route_id': route.id,
+            'name': route.name,
+            'addresses': route.optimized_route,
+            'coordinates': route.optimized_coordinates(),
+            'total_distance': route.total_distance,
+            'total_duration': route.total_duration,
+            'schedule': route.schedule,
+            'solver': _solver_summary(solution)
+        } for route, solution in zip(routes, results)]
+    }
+
+
+def _parse_number_list(values, length, field):
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        values = [values] * length
+    if len(values) != length:
+        raise OptimizationError(f'{field} must have {length} entries', 400)
+    try:
+        numbers = [float(value or 0) for value in values]
+    except (TypeError, ValueError):
+        raise OptimizationError(f'{field} must be numbers', 400)
+    if any(number < 0 for number in numbers):
+        raise OptimizationError(f'{field} must not be negative', 400)
+    return numbers
+
+
+def run_fleet_optimization(data):
+    """Split one pool of stops across several vehicles and store a Route per vehicle.
+
+    addresses[0] is the depot every vehicle starts from (and returns to
+    when return_to_depot is set). demands (per address) and capacities (per
+    vehicle, or one number for all) are optional. Reuses a single distance
+    matrix for clustering and sequencing.
+    """
+    data = data or {}
+    addresses = list(data.get('addresses', []))
+    return_to_depot = bool(data.get('return_to_depot', False))
+    distance_provider = data.get('distance_provider') or app.config["DISTANCE_PROVIDER"]
+    name = data.get('name', f"Route {datetime.utcnow()}")
+    description = data.get('description', '')
+
+    if len(addresses) < 2:
+        raise OptimizationError('At least two addresses are required', 400)
+    if distance_provider not in DISTANCE_PROVIDERS:
+        raise OptimizationError(f'Unknown distance provider: {distance_provider}', 400)
+    try:
+        vehicles = int(data.get('vehicles', 1))
+        balance_weight = float(data.get('balance_weight', app.config["FLEET_BALANCE_WEIGHT"]))
+    except (TypeError, ValueError):
+        raise OptimizationError('vehicles and balance_weight must be numbers', 400)
+    if vehicles < 1 or vehicles > app.config["FLEET_MAX_VEHICLES"]:
+        raise OptimizationError(f'vehicles must be between 1 and {app.config["FLEET_MAX_VEHICLES"]}', 400)
+    demands = _parse_number_list(data.get('demands'), len(addresses), 'demands')
+    capacities = _parse_number_list(data.get('capacities'), vehicles, 'capacities')
+
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not api_key:
+        app.logger.error("Google Maps API key not found in environment variables")
+        raise OptimizationError('Missing API configuration', 500)
+
+    app.logger.info(f"Received {len(addresses)} addresses for {vehicles} vehicles")
+    with timed_stage('geocode'):
+        locations, geocode_errors = geocode_addresses(addresses, api_key)
+    if geocode_errors:
+        failed = [addresses[i] for i in sorted(geocode_errors)]
+        raise OptimizationError(geocode_errors[min(geocode_errors)], 400, failed_addresses=failed)
+    coordinates = [f"{location['lat']},{location['lng']}" for location in locations]
+
+    try:
+        matrix_stats = {}
+        with timed_stage('matrix'):
+            distance_matrix, duration_matrix = get_distance_matrix(
+                coordinates, api_key, stats=matrix_stats, provider=distance_provider)
+        app.logger.info(f"Distance matrix calculation complete: {matrix_stats}")
+
+        with timed_stage('solve'):
+            plan = solve_fleet(
+                distance_matrix, vehicles,
+                demands=demands,
+                capacities=capacities,
+                return_to_depot=return_to_depot,
+                balance_weight=balance_weight,
+                coordinates=[[location['lat'], location['lng']] for location in locations]
+            )
+    except ValueError as e:
+        raise OptimizationError(str(e), 400)
+    except Exception as opt_error:
+        app.logger.error(f"Fleet optimization error: {str(opt_error)}")
+        raise OptimizationError('Failed to optimize routes', 500)
+
+    try:
+        routes = []
+        for vehicle_route in plan['routes']:
+            path = vehicle_route['path']
+            route = Route()
+            route.name = f"{name} - Vehicle {vehicle_route['vehicle'] + 1}"
+            route.description = description
+            route.addresses = [addresses[i] for i in path]
+            route.optimized_route = [locations[i]['formatted_address'] for i in path]
+            route.is_loop_route = return_to_depot
+            route.has_end_point = False
+            route.objective = 'distance'
+            route.total_distance = route_cost(distance_matrix, path)
+            route.total_duration = route_cost(duration_matrix, path)
+            block = np.ix_(path, path)
+            store_route_geometry(route, [locations[i] for i in path],
+                                 distance_matrix[block], duration_matrix[block], list(range(len(path))))
+            db.session.add(route)
+            routes.append((route, vehicle_route))
+        _skip_offline_directions([route for route, _ in routes], distance_provider)
+        with timed_stage('persist'):
+            db.session.commit()
+        directions.request_backfill([route for route, _ in routes])
+        app.logger.info(f"Stored {len(routes)} vehicle routes")
+    except Exception as db_error:
+        db.session.rollback()
+        app.logger.error(f"Database error: {str(db_error)}")
+        raise OptimizationError('Failed to store route information', 500)
+
+    return {
+        'success': True,
+        'vehicles_used': len(routes),
+        'total_distance': sum(route.total_distance for route, _ in routes),
+        'total_duration': sum(route.total_duration for route, _ in routes),
+        'longest_distance': max(route.total_distance for route, _ in routes),
+        'longest_duration': max(route.total_duration for route, _ in routes),
+        'matrix_stats': matrix_stats,
+        'routes': [{
+            'route_id': route.id,
+            'vehicle': vehicle_route['vehicle'] + 1,
+            'name': route.name,
+            'addresses': route.optimized_route,
+            'coordinates': route.optimized_coordinates(),
+            'load': vehicle_route['load'],
+            'total_distance': route.total_distance,
+            'total_duration': route.total_duration
+        } for route, vehicle_route in routes]
+    }
+
+
+def _route_flags(route):
+    """(has_end_point, is_loop_route) for a stored route, inferred for older rows."""
+    if route.is_loop_route is not None:
+        return bool(route.has_end_point), bool(route.is_loop_route)
+    addresses = route.addresses or []
+    return False, len(addresses) > 2 and addresses[0] == addresses[-1]
+
+
+def update_route_stops(route, data):
+    """Add and/or remove stops on a saved route without re-optimizing from scratch.
+
+    data['add'] lists new addresses (or {address, time_window, service_time}
+    objects); data['remove'] lists stops to drop, either as positions in the
+    optimized route or as address strings. Only the new matrix rows and
+    columns are fetched; new stops go in by cheapest insertion and the
+    stored tour is repaired with local search (optionally for max_solve_ms),
+    honoring the route's objective and time windows. The route is updated
+    in place.
+    """
+    data = data or {}
+    added = []
+    added_windows = []
+    added_service = []
+    for item in data.get('add') or []:
+        details = item if isinstance(item, dict) else {'address': item}
+        address = details.get('address')
+        if not isinstance(address, str) or not address.strip():
+            continue
+        added.append(address.strip())
+        added_windows.append(_parse_time_window(details.get('time_window'), route.departure_time,
+                                                'time_window'))
+        added_service.append(_parse_number_list(details.get('service_time') or 0, 1, 'service_time')[0])
+    removals = data.get('remove') or []
+    distance_provider = data.get('distance_provider') or app.config["DISTANCE_PROVIDER"]
+    try:
+        max_solve_ms = min(max(int(data.get('max_solve_ms') or 0), 0), app.config["SOLVER_MAX_BUDGET_MS"])
+    except (TypeError, ValueError):
+        raise OptimizationError('max_solve_ms must be an integer number of milliseconds', 400)
+    if not added and not removals:
+        raise OptimizationError('Nothing to add or remove', 400)
+    if distance_provider not in DISTANCE_PROVIDERS:
+        raise OptimizationError(f'Unknown distance provider: {distance_provider}', 400)
+
+    distance_matrix, duration_matrix = route.get_matrices()
+    if distance_matrix is None and route.coordinates and _is_large_route({}, len(route.addresses)):
+        raise OptimizationError('Large routes keep no matrix; optimize the new stop list instead', 409)
+    if distance_matrix is None or not route.coordinates or route.stop_order is None:
+        raise OptimizationError('Route has no stored matrix, optimize it again first', 409)
+
+    addresses = list(route.addresses)
+    n = len(addresses)
+    order = list(route.stop_order)
+    has_end_point, is_loop_route = _route_flags(route)
+    fixed = {0, n - 1} if (has_end_point or is_loop_route) else {0}
+    formatted = list(addresses)
+    for position, index in enumerate(order):
+        formatted[index] = route.optimized_route[position]
+
+    # Resolve removals to address indices
+    removed = set()
+    for item in removals:
+        if isinstance(item, int) and not isinstance(item, bool):
+            if not 0 <= item < len(order):
+                raise OptimizationError(f'No stop at position {item}', 400)
+            index = order[item]
+        else:
+            key = normalize_address(str(item))
+            matches = [i for i in range(n)
+                       if key in (normalize_address(addresses[i]), normalize_address(formatted[i]))]
+            if not matches:
+                raise OptimizationError(f'Stop not found: {item}', 400)
+            # An address that occurs several times removes its next occurrence
+            index = next((i for i in matches if i not in removed), matches[0])
+        if index in fixed:
+            raise OptimizationError('The start and end points cannot be removed', 400)
+        if index in removed:
+            raise OptimizationError(f'Stop listed more than once in remove: {item}', 400)
+        removed.add(index)
+
+    kept = [i for i in range(n) if i not in removed]
+    if len(kept) + len(added) < 2:
+        raise OptimizationError('At least two addresses are required', 400)
+
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if added and not api_key:
+        app.logger.error("Google Maps API key not found in environment variables")
+        raise OptimizationError('Missing API configuration', 500)
+
+    new_locations = []
+    if added:
+        with timed_stage('geocode'):
+            new_locations, geocode_errors = geocode_addresses(added, api_key)
+        if geocode_errors:
+            failed = [added[i] for i in sorted(geocode_errors)]
+            raise OptimizationError(geocode_errors[min(geocode_errors)], 400, failed_addresses=failed)
+
+    # New layout: kept stops in their old order, new ones before a fixed end
+    sources = [('old', i) for i in kept]
+    insert_at = len(sources) - 1 if (has_end_point or is_loop_route) else len(sources)
+    sources[insert_at:insert_at] = [('new', j) for j in range(len(added))]
+    old_positions = [p for p, (kind, _) in enumerate(sources) if kind == 'old']
+    new_positions = [p for p, (kind, _) in enumerate(sources) if kind == 'new']
+    position_of_old = {i: p for p, (kind, i) in enumerate(sources) if kind == 'old'}
+
+    coordinates = [route.coordinates[i] if kind == 'old' else
+                   [new_locations[i]['lat'], new_locations[i]['lng']] for kind, i in sources]
+    new_addresses = [addresses[i] if kind == 'old' else added[i] for kind, i in sources]
+    new_formatted = [formatted[i] if kind == 'old' else new_locations[i]['formatted_address']
+                     for kind, i in sources]
+    old_windows = route.time_windows or [None] * n
+    old_service = route.service_times or [0.0] * n
+    new_windows = [old_windows[i] if kind == 'old' else added_windows[i] for kind, i in sources]
+    new_service = [old_service[i] if kind == 'old' else added_service[i] for kind, i in sources]
+    has_windows = any(window is not None for window in new_windows)
+    has_service = any(new_service)
+
+    try:
+        size = len(sources)
+        matrix_stats = {}
+        if new_positions:
+            required = np.zeros((size, size), dtype=bool)
+            required[new_positions, :] = True
+            required[:, new_positions] = True
+            with timed_stage('matrix'):
+                distance, duration = get_distance_matrix(
+                    [f"{lat},{lng}" for lat, lng in coordinates], api_key, stats=matrix_stats,
+                    provider=distance_provider, required=required)
+        else:
+            distance, duration = np.zeros((size, size)), np.zeros((size, size))
+        block = np.ix_(old_positions, old_positions)
+        distance[block] = distance_matrix[np.ix_(kept, kept)]
+        duration[block] = duration_matrix[np.ix_(kept, kept)]
+
+        path = [position_of_old[i] for i in order if i in position_of_old]
+        objective = route.objective or 'distance'
+        with timed_stage('solve'):
+            solution = reoptimize(duration if objective == 'duration' else distance, path, new_positions,
+                                  has_end_point=has_end_point, is_loop_route=is_loop_route,
+                                  max_solve_ms=max_solve_ms)
+            if has_windows or has_service:
+                solution = _solve_route(distance, duration, {
+                    'has_end_point': has_end_point,
+                    'is_loop_route': is_loop_route,
+                    'max_solve_ms': max_solve_ms,
+                    'objective': objective,
+                    'time_windows': new_windows if has_windows else None,
+                    'service_times': new_service if has_service else None
+                }, app.config["TIME_WINDOW_LATENESS_PENALTY"], initial_path=solution['path'])
+        stops = solution['path']
+
+        route.addresses = new_addresses
+        route.time_windows = new_windows if has_windows else None
+        route.service_times = new_service if has_service else None
+        route.optimized_route = [new_formatted[i] for i in stops]
+        route.total_distance = route_cost(distance, stops)
+        route.total_duration = route_cost(duration, stops)
+        with timed_stage('persist'):
+            store_route_geometry(route, [{'lat': lat, 'lng': lng} for lat, lng in coordinates],
+                                 distance, duration, stops)
+            _skip_offline_directions([route], distance_provider)
+            db.session.commit()
+        directions.request_backfill([route])
+        app.logger.info(f"Route {route.id} updated: {len(added)} stops added, {len(removed)} removed")
+    except Exception as opt_error:
+        db.session.rollback()
+        app.logger.error(f"Route update error: {str(opt_error)}")
+        raise OptimizationError('Failed to update route', 500)
+
+    return {
+        'success': True,
+        'route_id': route.id,
+        'addresses': route.optimized_route,
+        'coordinates': route.optimized_coordinates(),
+        'legs': route.legs,
+        'schedule': route.schedule,
+        'total_distance': route.total_distance,
+        'total_duration': route.total_duration,
+        'added': len(added),
+        'removed': len(removed),
+        'matrix_stats': matrix_stats,
+        'solver': _solver_summary(solution)
+    }
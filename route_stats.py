@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event, select, update, delete, insert, bindparam, tuple_
+from sqlalchemy.orm import Session
+
+from app import app, db
+from models import Route, RouteTotals, RouteMonthlyCount, RouteDistanceBucket, StopFrequency
+
+# Route attributes the aggregates depend on
+TRACKED_FIELDS = ('created_at', 'total_distance', 'total_duration', 'addresses')
+DISTANCE_BUCKETS = ('<5km', '5-10km', '10-20km', '>20km')
+TOP_DESTINATIONS = 10
+
+_page_cache = {}
+_page_cache_lock = threading.Lock()
+
+
+def distance_bucket(total_distance):
+    # Same ranges as the original CASE; routes without a distance land in the last one
+    if total_distance is not None:
+        if total_distance < 5000:
+            return '<5km'
+        if total_distance < 10000:
+            return '5-10km'
+        if total_distance < 20000:
+            return '10-20km'
+    return '>20km'
+
+
+class _Delta:
+    """Aggregate changes collected over one flush."""
+
+    def __init__(self):
+        self.totals = Counter()
+        self.months = Counter()
+        self.buckets = Counter()
+        self.stops = Counter()
+
+    def add(self, values, sign):
+        created_at = values['created_at'] or datetime.utcnow()
+        self.totals['route_count'] += sign
+        for field, count, total in (('total_distance', 'distance_count', 'distance_sum'),
+                                    ('total_duration', 'duration_count', 'duration_sum')):
+            if values[field] is not None:
+                self.totals[count] += sign
+                self.totals[total] += sign * values[field]
+        self.months[(created_at.year, created_at.month)] += sign
+        self.buckets[distance_bucket(values['total_distance'])] += sign
+        for address in values['addresses'] or []:
+            self.stops[address] += sign
+
+    def __bool__(self):
+        return any(any(counter.values()) for counter in (self.totals, self.months, self.buckets, self.stops))
+
+
+def _bump_counts(session, model, key_columns, counts):
+    """route_count += delta per key: update existing rows, insert new ones, drop empty ones."""
+    counts = {key if isinstance(key, tuple) else (key,): delta for key, delta in counts.items() if delta}
+    if not counts:
+        return
+    columns = [getattr(model, name) for name in key_columns]
+    connection = session.connection()
+    existing = {tuple(row) for row in connection.execute(select(*columns).where(tuple_(*columns).in_(list(counts))))}
+
+    updates = [{**{f'key_{name}': value for name, value in zip(key_columns, key)}, 'delta': delta}
+               for key, delta in counts.items() if key in existing]
+    inserts = [{**dict(zip(key_columns, key)), 'route_count': delta}
+               for key, delta in counts.items() if key not in existing]
+    if updates:
+        connection.execute(
+            update(model)
+            .where(*[column == bindparam(f'key_{name}') for name, column in zip(key_columns, columns)])
+            .values(route_count=model.route_count + bindparam('delta')),
+            updates
+        )
+    if inserts:
+        connection.execute(insert(model), inserts)
+    connection.execute(delete(model).where(model.route_count <= 0))
+
+
+def _apply(session, delta):
+    totals = {name: value for name, value in delta.totals.items() if value}
+    if totals:
+        connection = session.connection()
+        values = {name: getattr(RouteTotals, name) + value for name, value in totals.items()}
+        result = connection.execute(update(RouteTotals).where(RouteTotals.id == 1).values(**values))
+        if not result.rowcount:
+            connection.execute(insert(RouteTotals).values(id=1, **{
+                name: totals.get(name, 0) for name in
+                ('route_count', 'distance_count', 'distance_sum', 'duration_count', 'duration_sum')
+            }))
+    _bump_counts(session, RouteMonthlyCount, ('year', 'month'), delta.months)
+    _bump_counts(session, RouteDistanceBucket, ('bucket',), delta.buckets)
+    _bump_counts(session, StopFrequency, ('address',), delta.stops)
+
+
+def _stored_values(session, route_ids):
+    """Values currently in the database (attribute history is empty for expired attributes)."""
+    if not route_ids:
+        return {}
+    rows = session.execute(
+        select(Route.id, *[getattr(Route, field) for field in TRACKED_FIELDS]).where(Route.id.in_(route_ids))
+    )
+    return {row.id: {field: getattr(row, field) for field in TRACKED_FIELDS} for row in rows}
+
+
+def _current_values(route):
+    return {field: getattr(route, field) for field in TRACKED_FIELDS}
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_route_changes(session, flush_context, instances):
+    changed = [route for route in session.dirty if isinstance(route, Route) and route.id is not None and
+               any(db.inspect(route).attrs[field].history.has_changes() for field in TRACKED_FIELDS)]
+    deleted = [route for route in session.deleted if isinstance(route, Route)]
+    created = [route for route in session.new if isinstance(route, Route)]
+    if not (changed or deleted or created):
+        return
+
+    delta = _Delta()
+    stored = _stored_values(session, [route.id for route in changed + deleted])
+    for route in changed + deleted:
+        if route.id in stored:
+            delta.add(stored[route.id], -1)
+    for route in changed + created:
+        delta.add(_current_values(route), +1)
+    if delta:
+        _apply(session, delta)
+        clear_page_cache()
+
+
+def rebuild():
+    """Recompute every aggregate from the route table (initial fill or repair)."""
+    for model in (RouteTotals, RouteMonthlyCount, RouteDistanceBucket, StopFrequency):
+        db.session.execute(delete(model))
+    delta = _Delta()
+    rows = db.session.execute(
+        select(*[getattr(Route, field) for field in TRACKED_FIELDS]).execution_options(yield_per=500))
+    for row in rows:
+        delta.add(row._asdict(), +1)
+    _apply(db.session, delta)
+    db.session.commit()
+    clear_page_cache()
+    app.logger.info(f"Rebuilt route statistics for {delta.totals['route_count']} routes")
+
+
+def ensure_aggregates():
+    """Fill the aggregate tables the first time they exist next to stored routes."""
+    if db.session.get(RouteTotals, 1) is None and db.session.query(Route.id).first() is not None:
+        rebuild()
+
+
+def dashboard():
+    """Template context for /statistics, read from the aggregate tables only."""
+    totals = db.session.get(RouteTotals, 1)
+    months = RouteMonthlyCount.query.order_by(RouteMonthlyCount.year, RouteMonthlyCount.month).all()
+    buckets = {row.bucket: row.route_count for row in RouteDistanceBucket.query.all()}
+    top = StopFrequency.query.order_by(StopFrequency.route_count.desc()).limit(TOP_DESTINATIONS).all()
+    return {
+        'total_routes': totals.route_count if totals else 0,
+        'avg_distance': totals.distance_sum / totals.distance_count if totals and totals.distance_count else 0,
+        'avg_duration': totals.duration_sum / totals.duration_count if totals and totals.duration_count else 0,
+        'months_data': [{'year': row.year, 'month': row.month, 'count': row.route_count} for row in months],
+        'routes_by_distance': [{'range': bucket, 'count': buckets[bucket]}
+                               for bucket in DISTANCE_BUCKETS if buckets.get(bucket)],
+        'top_destinations': [(row.address, row.route_count) for row in top]
+    }
+
+
+def cached_page(key, render):
+    """Serve render() from a per-process cache for STATISTICS_CACHE_SECONDS (0 disables)."""
+    ttl = app.config["STATISTICS_CACHE_SECONDS"]
+    if ttl <= 0:
+        return render()
+    now = time.monotonic()
+    with _page_cache_lock:
+        entry = _page_cache.get(key)
+        if entry and now - entry[0] < ttl:
+            return entry[1]
+    page = render()
+    with _page_cache_lock:
+        _page_cache[key] = (now, page)
+    return page
+
+
+def clear_page_cache():
+    with _page_cache_lock:
+        _page_cache.clear()
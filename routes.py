@@ -1,8 +1,10 @@
 import json
-import requests
+import re
+import threading
+import time
 from flask import redirect, request, url_for, session
 from flask_login import login_user, logout_user, login_required, current_user
-from app import app, client, db, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_DISCOVERY_URL
+from app import app, client, db, http_session, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_DISCOVERY_URL
 from models import User
 
 @app.errorhandler(403)
@@ -11,12 +13,43 @@ def forbidden_error(error):
         error_code=403,
         error_message="Access Forbidden. Please check your authentication configuration."), 403
 
+_provider_cfg = {'value': None, 'expires_at': 0.0}
+_provider_cfg_lock = threading.Lock()
+
+
+def _max_age(cache_control):
+    """Seconds the response may be reused per its Cache-Control header, or None if it does not say."""
+    directives = [directive.strip().lower() for directive in (cache_control or '').split(',')]
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    for directive in directives:
+        match = re.fullmatch(r'max-age=(\d+)', directive)
+        if match:
+            return int(match.group(1))
+    return None
+
+
 def get_google_provider_cfg():
-    try:
-        return requests.get(GOOGLE_DISCOVERY_URL).json()
-    except Exception as e:
-        app.logger.error(f"Failed to get Google provider config: {e}")
-        return None
+    """Google's OpenID discovery document, cached for as long as its Cache-Control allows.
+
+    Without a max-age it is kept for OAUTH_DISCOVERY_TTL_SECONDS. If a
+    refresh fails the previous document is used until the next attempt.
+    """
+    with _provider_cfg_lock:
+        if _provider_cfg['value'] is not None and time.time() < _provider_cfg['expires_at']:
+            return _provider_cfg['value']
+        try:
+            response = http_session.get(GOOGLE_DISCOVERY_URL, timeout=app.config["GOOGLE_API_TIMEOUT"])
+            response.raise_for_status()
+            config = response.json()
+        except Exception as e:
+            app.logger.error(f"Failed to get Google provider config: {e}")
+            return _provider_cfg['value']
+        max_age = _max_age(response.headers.get('Cache-Control'))
+        if max_age is None:
+            max_age = app.config["OAUTH_DISCOVERY_TTL_SECONDS"]
+        _provider_cfg.update(value=config, expires_at=time.time() + max_age)
+        return config
 
 @app.route("/login")
 def login():
@@ -68,14 +101,15 @@ def callback():
             redirect_url=url_for('callback', _external=True),
             code=code
         )
-        token_response = requests.post(
+        token_response = http_session.post(
             token_url,
             headers=headers,
             data=body,
             auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+            timeout=app.config["GOOGLE_API_TIMEOUT"],
         )
 
-        client.parse_request_body_response(json.dumps(token_response.json()))
+        client.parse_request_body_response(token_response.text)
     except Exception as e:
         app.logger.error(f"Token request failed: {e}")
         return "Failed to get token from Google", 500
@@ -83,13 +117,18 @@ def callback():
     # Get user info from Google
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
     uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
-    
-    if userinfo_response.json().get("email_verified"):
-        google_id = userinfo_response.json()["sub"]
-        email = userinfo_response.json()["email"]
-        name = userinfo_response.json().get("name", email.split('@')[0])
-        picture = userinfo_response.json().get("picture")
+    try:
+        userinfo = http_session.get(uri, headers=headers, data=body,
+                                    timeout=app.config["GOOGLE_API_TIMEOUT"]).json()
+    except Exception as e:
+        app.logger.error(f"User info request failed: {e}")
+        return "Failed to get user info from Google", 500
+
+    if userinfo.get("email_verified"):
+        google_id = userinfo["sub"]
+        email = userinfo["email"]
+        name = userinfo.get("name", email.split('@')[0])
+        picture = userinfo.get("picture")
         
         # Find or create user
         user = User.query.filter_by(google_id=google_id).first()
@@ -117,13 +156,21 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
-from flask import render_template, jsonify, request, redirect, url_for
+from flask import render_template, jsonify, request, redirect, url_for, Response, stream_with_context
 from app import app, db
 from models import Route, Contact
+from pipeline import (OptimizationError, parse_optimize_request, create_route, run_optimization,
+                      run_batch_optimization, run_fleet_optimization, update_route_stops)
+from jobs import submit_optimization, get_job, find_active_job
+import route_stats
+import contact_search
+import contact_io
+import exports
+import metrics
+import optimize_cache
+import directions
 from datetime import datetime
-import requests
-import numpy as np
-from sqlalchemy import func, extract, case
+from sqlalchemy import or_, and_
 
 @app.route('/')
 def index():
@@ -133,72 +180,68 @@ def index():
         route = Route.query.get(route_id)
     return render_template('index.html', route=route)
 
+def _route_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+def _route_page(cursor=None, limit=None):
+    """One page of the route listing, newest first, as (rows, next_cursor).
+
+    Keyset pagination on (created_at, id): cursor is the position of the
+    last row already shown. Only the columns the listing displays are loaded.
+    """
+    limit = min(max(limit or app.config["ROUTES_PAGE_SIZE"], 1), app.config["ROUTES_MAX_PAGE_SIZE"])
+    query = db.session.query(
+        Route.id, Route.name, Route.description, Route.created_at,
+        Route.stop_count, Route.total_distance, Route.total_duration
+    )
+    if cursor:
+        created_at, route_id = cursor.rsplit('_', 1)
+        created_at, route_id = datetime.fromisoformat(created_at), int(route_id)
+        query = query.filter(or_(Route.created_at < created_at,
+                                 and_(Route.created_at == created_at, Route.id < route_id)))
+    rows = query.order_by(Route.created_at.desc(), Route.id.desc()).limit(limit + 1).all()
+    next_cursor = _route_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
 @app.route('/routes')
 def list_routes():
-    routes = Route.query.order_by(Route.created_at.desc()).all()
-    return render_template('routes.html', routes=routes)
+    try:
+        rows, next_cursor = _route_page(request.args.get('cursor'), request.args.get('limit', type=int))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    if request.args.get('format') == 'json' or \
+            request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify({
+            'success': True,
+            'routes': [{
+                'id': row.id,
+                'name': row.name,
+                'description': row.description,
+                'created_at': row.created_at.isoformat(),
+                'stop_count': row.stop_count,
+                'total_distance': row.total_distance,
+                'total_duration': row.total_duration
+            } for row in rows],
+            'next_cursor': next_cursor
+        })
+    return render_template('routes.html', routes=rows, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'))
 
 @app.route('/statistics')
 def route_statistics():
-    # Get basic statistics
-    total_routes = Route.query.count()
-    avg_distance = db.session.query(func.avg(Route.total_distance)).scalar() or 0
-    avg_duration = db.session.query(func.avg(Route.total_duration)).scalar() or 0
-    
-    # Get routes created per month
-    monthly_routes = db.session.query(
-        extract('year', Route.created_at).label('year'),
-        extract('month', Route.created_at).label('month'),
-        func.count(Route.id).label('count')
-    ).group_by('year', 'month').order_by('year', 'month').all()
-    
-    # Format the data for charts
-    months_data = [{'year': int(r[0]), 'month': int(r[1]), 'count': int(r[2])} 
-                  for r in monthly_routes]
-    
-    # Get routes by distance ranges
-    routes_by_distance = db.session.query(
-        case(
-            (Route.total_distance < 5000, '<5km'),
-            (Route.total_distance < 10000, '5-10km'),
-            (Route.total_distance < 20000, '10-20km'),
-            else_='>20km'
-        ).label('range'),
-        func.count(Route.id).label('count')
-    ).group_by('range').all()
-    
-    # Convert routes_by_distance to serializable format
-    distance_data = [{'range': str(r[0]), 'count': int(r[1])} for r in routes_by_distance]
-    
-    # Get most frequent destinations
-    all_addresses = []
-    routes_with_addresses = Route.query.with_entities(Route.addresses).all()
-    for route in routes_with_addresses:
-        if route.addresses:
-            all_addresses.extend(route.addresses)
-    
-    address_frequency = {}
-    for addr in all_addresses:
-        address_frequency[addr] = address_frequency.get(addr, 0) + 1
-    
-    top_destinations = sorted(
-        address_frequency.items(), 
-        key=lambda x: x[1], 
-        reverse=True
-    )[:10]
-    
-    return render_template('statistics.html',
-                         total_routes=total_routes,
-                         avg_distance=avg_distance,
-                         avg_duration=avg_duration,
-                         months_data=months_data,
-                         routes_by_distance=distance_data,
-                         top_destinations=top_destinations)
+    # Aggregates are maintained on write by route_stats; the page itself is cached briefly
+    return route_stats.cached_page(
+        ('statistics', current_user.get_id()),
+        lambda: render_template('statistics.html', **route_stats.dashboard())
+    )
 
 @app.route('/routes/<int:route_id>', methods=['GET'])
 def get_route(route_id):
     try:
         route = Route.query.get_or_404(route_id)
+        # Routes still without geometry (older rows, or a fill lost to a restart) get it in the background
+        directions.request_backfill([route])
         return jsonify({
             'success': True,
             'route': route.to_dict()
@@ -210,6 +253,20 @@ def get_route(route_id):
             'error': 'Failed to fetch route'
         }), 404
 
+@app.route('/routes/<int:route_id>/stops', methods=['PATCH'])
+def update_route_stops_endpoint(route_id):
+    route = Route.query.get_or_404(route_id)
+    try:
+        return jsonify(update_route_stops(route, request.get_json()))
+    except OptimizationError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
 @app.route('/routes/<int:route_id>', methods=['DELETE'])
 def delete_route(route_id):
     try:
@@ -228,139 +285,33 @@ def delete_route(route_id):
 def optimize_route():
     try:
         data = request.get_json()
-        addresses = data.get('addresses', [])
-        has_end_point = data.get('has_end_point', False)
-        end_point = data.get('end_point')
-        is_loop_route = data.get('is_loop_route', False)
-        route_name = data.get('name', f"Route {datetime.utcnow()}")
-        route_description = data.get('description', '')
-        
-        app.logger.info(f"Received {len(addresses)} addresses for optimization")
-        
-        if not addresses or len(addresses) < 2:
-            return jsonify({
-                'success': False,
-                'error': 'At least two addresses are required'
-            }), 400
-
-        # Handle loop route
-        if is_loop_route:
-            app.logger.info("Processing loop route")
-            has_end_point = False
-            end_point = addresses[0]
-            if addresses[0] != addresses[-1]:
-                app.logger.info("Adding start point as end point for loop route")
-                addresses.append(addresses[0])
-        elif has_end_point and not end_point:
-            return jsonify({
-                'success': False,
-                'error': 'End point is required when has_end_point is true'
-            }), 400
-        elif has_end_point and end_point:
-            if end_point not in addresses:  # Only add if not already present
-                addresses.append(end_point)
-
-        # Store initial route in database
-        try:
-            app.logger.info("Storing initial route in database")
-            route = Route()
-            route.name = route_name
-            route.description = route_description
-            route.addresses = addresses
-            route.optimized_route = addresses  # Initially same as input order
-            db.session.add(route)
-            db.session.commit()
-            app.logger.info(f"Initial route stored with ID: {route.id}")
-        except Exception as db_error:
-            app.logger.error(f"Database error: {str(db_error)}")
-            return jsonify({
-                'success': False,
-                'error': 'Failed to store route information'
-            }), 500
-
-        # Geocode addresses using Google Maps Geocoding API
-        app.logger.info("Starting geocoding process")
-        api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
-        if not api_key:
-            app.logger.error("Google Maps API key not found in environment variables")
-            return jsonify({
-                'success': False,
-                'error': 'Missing API configuration'
-            }), 500
-            
-        geocoded_addresses = []
-        coordinates = []
-        
-        for address in addresses:
-            try:
-                params = {
-                    'address': address,
-                    'key': api_key
-                }
-                app.logger.info(f"Geocoding address: {address}")
-                response = requests.get('https://maps.googleapis.com/maps/api/geocode/json', params=params)
-                result = response.json()
-                
-                if result['status'] != 'OK':
-                    raise Exception(f"Geocoding failed for address: {address}")
-                
-                location = result['results'][0]
-                formatted_address = location['formatted_address']
-                geocoded_addresses.append(formatted_address)
-                coordinates.append(f"{location['geometry']['location']['lat']},{location['geometry']['location']['lng']}")
-                app.logger.info(f"Successfully geocoded address: {formatted_address}")
-            except Exception as geo_error:
-                app.logger.error(f"Geocoding error: {str(geo_error)}")
-                return jsonify({
-                    'success': False,
-                    'error': f'Failed to geocode address: {address}'
-                }), 400
+        params = parse_optimize_request(data)
+        key = optimize_cache.request_key(params)
 
-        try:
-            # Get distance matrix
-            app.logger.info("Calculating distance matrix")
-            distance_matrix, duration_matrix = get_distance_matrix(coordinates, api_key)
-            app.logger.info("Distance matrix calculation complete")
-            
-            # Calculate optimal route
-            app.logger.info("Calculating optimal route")
-            optimal_route_indices = nearest_neighbor(
-                distance_matrix, 
-                has_end_point=has_end_point,
-                is_loop_route=is_loop_route
-            )
-            optimized_addresses = [geocoded_addresses[i] for i in optimal_route_indices]
-            app.logger.info("Route optimization complete")
-            
-            # Calculate total distance and duration
-            total_distance = sum(distance_matrix[optimal_route_indices[i]][optimal_route_indices[i+1]] 
-                            for i in range(len(optimal_route_indices)-1))
-            total_duration = sum(duration_matrix[optimal_route_indices[i]][optimal_route_indices[i+1]] 
-                            for i in range(len(optimal_route_indices)-1))
-            
-            # Update route with optimized addresses and statistics
-            app.logger.info("Updating route with optimized addresses")
-            route.optimized_route = optimized_addresses
-            route.total_distance = total_distance
-            route.total_duration = total_duration
-            db.session.commit()
-            app.logger.info(f"Route {route.id} successfully optimized")
-            
+        if data.get('async'):
+            # Join an identical queued job; an identical cached or running request lends its route,
+            # and the new job just waits for that result
+            job = find_active_job(key)
+            shared = job is not None
+            if shared:
+                job_id, route_id = job['id'], job['route_id']
+            else:
+                route_id, flight, shared = optimize_cache.claim_route(key, lambda: create_route(params))
+                job_id = submit_optimization(route_id, params, key, flight)
             return jsonify({
                 'success': True,
-                'route_id': route.id,
-                'addresses': optimized_addresses,
-                'total_distance': total_distance,
-                'total_duration': total_duration
-            })
-            
-        except Exception as opt_error:
-            app.logger.error(f"Optimization error: {str(opt_error)}")
-            return jsonify({
-                'success': False,
-                'error': 'Failed to optimize route'
-            }), 500
+                'job_id': job_id,
+                'route_id': route_id,
+                'deduplicated': shared,
+                'status_url': url_for('optimization_job_status', job_id=job_id)
+            }), 202
 
+        result, shared = optimize_cache.run_once(key, lambda: create_route(params),
+                                                 lambda route: run_optimization(route, params))
+        return jsonify({**result, 'deduplicated': shared})
+
+    except OptimizationError as e:
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         app.logger.error(f"Unexpected error: {str(e)}")
         return jsonify({
@@ -368,16 +319,56 @@ def optimize_route():
             'error': 'An unexpected error occurred'
         }), 500
 
+@app.route('/optimize/batch', methods=['POST'])
+def optimize_batch():
+    try:
+        return jsonify(run_batch_optimization(request.get_json()))
+    except OptimizationError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/optimize/fleet', methods=['POST'])
+def optimize_fleet():
+    try:
+        return jsonify(run_fleet_optimization(request.get_json()))
+    except OptimizationError as e:
+        return jsonify(e.to_dict()), e.status
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+@app.route('/optimize/jobs/<job_id>', methods=['GET'])
+def optimization_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
 @app.route('/export/<int:route_id>')
 def export_route(route_id):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return jsonify({'success': False, 'error': f'Unknown format: {fmt}'}), 400
     try:
         route = Route.query.get_or_404(route_id)
-        # Generate CSV of addresses
-        addresses = '\n'.join(route.optimized_route)
-        return addresses, 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': f'attachment; filename=route_{route_id}.csv'
-        }
+        return Response(stream_with_context(exports.export_chunks(route, fmt)), headers={
+            'Content-Type': exports.FORMATS[fmt][0],
+            'Content-Disposition': f'attachment; filename={exports.filename(route, fmt)}'
+        })
     except Exception as e:
         app.logger.error(f"Export error: {str(e)}")
         return jsonify({
@@ -385,75 +376,23 @@ def export_route(route_id):
             'error': 'Failed to export route'
         }), 500
 
-def get_distance_matrix(locations, api_key):
-    if not api_key:
-        raise ValueError("API key is required for distance matrix calculation")
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    
-    # Create a matrix of all distances
-    n = len(locations)
-    distance_matrix = np.zeros((n, n))
-    duration_matrix = np.zeros((n, n))
-    
-    for i in range(n):
-        params = {
-            'origins': locations[i],
-            'destinations': '|'.join(locations),
-            'key': api_key,
-            'mode': 'driving'
-        }
-        
-        response = requests.get(url, params=params)
-        result = response.json()
-        
-        if result['status'] != 'OK':
-            raise Exception(f"Distance Matrix API failed: {result['status']}")
-            
-        for j in range(n):
-            element = result['rows'][0]['elements'][j]
-            if element['status'] == 'OK':
-                distance_matrix[i][j] = element['distance']['value']
-                duration_matrix[i][j] = element['duration']['value']
-            else:
-                raise Exception(f"Unable to calculate distance between points {i} and {j}")
-    
-    return distance_matrix, duration_matrix
+@app.route('/export')
+def export_routes():
+    # Zip of several routes: ?ids=1,2,3, ?date=YYYY-MM-DD, or the whole archive
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return jsonify({'success': False, 'error': f'Unknown format: {fmt}'}), 400
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'ids must be integers and date YYYY-MM-DD'}), 400
+    name = f"routes_{day.isoformat() if day else 'all'}_{fmt}.zip"
+    return Response(stream_with_context(exports.zip_chunks(fmt, ids, day)), headers={
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename={name}'
+    })
 
-def nearest_neighbor(distance_matrix, has_end_point=False, is_loop_route=False):
-    n = len(distance_matrix)
-    
-    if n <= 2:  # If only start and end points, return as is
-        return list(range(n))
-        
-    if has_end_point or is_loop_route:
-        # Only optimize intermediate points (excluding start and end)
-        unvisited = set(range(1, n-1))  # Skip start and end points
-        current = 0  # Start from first location
-        path = [current]
-        
-        while unvisited:
-            next_point = min(unvisited, key=lambda x: distance_matrix[current][x])
-            path.append(next_point)
-            unvisited.remove(next_point)
-            current = next_point
-            
-        if is_loop_route:
-            path.append(0)  # Return to start point for loop routes
-        else:
-            path.append(n-1)  # Add end point for regular routes
-    else:
-        # Optimize all points except start
-        unvisited = set(range(1, n))  # Skip start point
-        current = 0  # Start from first location
-        path = [current]
-        
-        while unvisited:
-            next_point = min(unvisited, key=lambda x: distance_matrix[current][x])
-            path.append(next_point)
-            unvisited.remove(next_point)
-            current = next_point
-    
-    return path
 # Contact Management Routes
 @app.route('/contacts')
 def list_contacts():
@@ -499,6 +438,41 @@ def update_contact(contact_id):
         app.logger.error(f"Error updating contact: {str(e)}")
         return render_template('contact_form.html', contact=contact, error="Failed to update contact"), 400
 
+@app.route('/contacts/import', methods=['POST'])
+def import_contacts():
+    # Raw CSV/JSONL body, or a multipart upload in the "file" field
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    try:
+        fmt = contact_io.detect_format(
+            request.args.get('format'),
+            upload.mimetype if upload else request.mimetype,
+            upload.filename if upload else None
+        )
+    except contact_io.ImportFormatError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    geocode = request.args.get('geocode', '').lower() in ('1', 'true', 'yes')
+    stream = contact_io.detach_upload(upload) if upload else request.stream
+
+    def generate():
+        try:
+            for event in contact_io.import_contacts(stream, fmt, geocode=geocode):
+                yield json.dumps(event) + '\n'
+        finally:
+            if upload:
+                stream.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/contacts/export')
+def export_contacts():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in contact_io.FORMATS:
+        return jsonify({'success': False, 'error': f'Unknown format: {fmt}'}), 400
+    return Response(stream_with_context(contact_io.export_contacts(fmt)), headers={
+        'Content-Type': 'text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        'Content-Disposition': f'attachment; filename=contacts.{fmt}'
+    })
+
 @app.route('/contacts/<int:contact_id>/select')
 def select_contact_address(contact_id):
     contact = Contact.query.get_or_404(contact_id)
@@ -514,18 +488,16 @@ def suggest_contacts():
     if not search_term:
         return jsonify({'suggestions': []})
     
-    # Search contacts where business name, contact name, or address contains the search term
-    contacts = Contact.query.filter(
-        db.or_(
-            Contact.business_name.ilike(f'%{search_term}%'),
-            Contact.contact_name.ilike(f'%{search_term}%'),
-            Contact.address.ilike(f'%{search_term}%')
-        )
-    ).limit(5).all()
+    # Ranked, typo-tolerant match on business name, contact name and address
+    contacts = contact_search.search(search_term, limit=5)
     
     suggestions = [{
         'label': f"{contact.business_name} - {contact.address}",
         'value': contact.address
     } for contact in contacts]
     
-    return jsonify({'suggestions': suggestions})
\ No newline at end of file
+    return jsonify({'suggestions': suggestions})
+@app.route('/metrics')
+def prometheus_metrics():
+    # Counters are per process: scrape every worker, Prometheus sums them
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -126,6 +126,30 @@ function updateProgress(step, total = 3) {
     });
 }
 
+const JOB_STAGE_MESSAGES = {
+    queued: 'Waiting for a free worker...',
+    geocoding: 'Geocoding addresses...',
+    matrix: 'Calculating travel distances...',
+    solving: 'Optimizing stop order...'
+};
+
+// Poll an asynchronous /optimize job until it finishes; resolves with the job result
+async function pollOptimizationJob(statusUrl, interval = 1000) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        if (!data.success) return data;
+
+        const job = data.job;
+        if (job.status === 'completed') return job.result;
+        if (job.status === 'failed') return job.error;
+
+        if (job.step > 0) updateProgress(job.step, job.total_steps);
+        showLoadingOverlay(JOB_STAGE_MESSAGES[job.stage] || 'Optimizing route...');
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
 function showLoadingOverlay(message = 'Processing...') {
     const overlay = document.querySelector('.loading-overlay');
     const messageElement = document.getElementById('loading-message');
@@ -299,7 +323,6 @@ document.getElementById('addressForm').addEventListener('submit', async (e) => {
         showLoadingOverlay('Optimizing route...');
         
         updateProgress(1, 3); // Starting
-        await new Promise(resolve => setTimeout(resolve, 500)); // Add slight delay
         
         const response = await fetch('/optimize', {
             method: 'POST',
@@ -312,15 +335,18 @@ document.getElementById('addressForm').addEventListener('submit', async (e) => {
                 end_point: hasEndPoint ? endPointInput.value.trim() : null,
                 is_loop_route: isLoopRoute,
                 name: routeName,
-                description: routeDescription
+                description: routeDescription,
+                async: true
             })
         });
         
-        const data = await response.json();
+        let data = await response.json();
+        if (data.success && data.job_id) {
+            data = await pollOptimizationJob(data.status_url);
+        }
         if (data.success) {
-            updateProgress(2, 3); // Route calculation
             currentRouteId = data.route_id;
-            await displayRoute(data.addresses, data.total_distance, data.total_duration);
+            await displayRoute(data.addresses, data.total_distance, data.total_duration, data.coordinates);
             updateProgress(3, 3); // Display complete
             updateOptimizedRouteList(data.addresses);
             document.getElementById('exportRoute').style.display = 'block';
@@ -450,7 +476,8 @@ document.addEventListener('DOMContentLoaded', async () => {
                 
                 // Display the route on the map
                 if (route.optimized_route) {
-                    await displayRoute(route.optimized_route, route.total_distance, route.total_duration);
+                    await displayRoute(route.optimized_route, route.total_distance, route.total_duration,
+                                       route.optimized_coordinates, route.polyline);
                     updateOptimizedRouteList(route.optimized_route);
                     document.getElementById('exportRoute').style.display = 'block';
                 }
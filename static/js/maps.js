@@ -2,8 +2,10 @@ let map;
 let markers = [];
 let directionsService;
 let directionsRenderer;
+let routePolyline;
 let isProcessing = false;
 let mapBounds;
+const MAX_CLIENT_WAYPOINTS = 25;
 
 function waitForGoogleMaps() {
     return new Promise((resolve, reject) => {
@@ -111,6 +113,10 @@ function clearMarkers() {
     if (directionsRenderer) {
         directionsRenderer.setDirections({routes: []});
     }
+    if (routePolyline) {
+        routePolyline.setMap(null);
+        routePolyline = null;
+    }
     if (mapBounds) {
         mapBounds = new google.maps.LatLngBounds();
     }
@@ -143,7 +149,49 @@ function updateRouteInfo(totalDistance, totalDuration) {
     routeInfo.style.display = 'block';
 }
 
-async function displayRoute(addresses, totalDistance = null, totalDuration = null) {
+function geocodeAddress(geocoder, address) {
+    return new Promise((resolve, reject) => {
+        geocoder.geocode({ address }, (results, status) => {
+            if (status === 'OK') resolve(results[0].geometry.location);
+            else reject(new Error(`Geocoding failed: ${status}`));
+        });
+    });
+}
+
+// Google encoded polyline -> [{lat, lng}, ...]
+function decodePolyline(encoded) {
+    const points = [];
+    let index = 0, lat = 0, lng = 0;
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let k = 0; k < 2; k++) {
+            let shift = 0, result = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        points.push({ lat: lat / 1e5, lng: lng / 1e5 });
+    }
+    return points;
+}
+
+function drawRoutePath(path) {
+    routePolyline = new google.maps.Polyline({
+        map: map,
+        path: path,
+        strokeColor: '#1a73e8',
+        strokeOpacity: 0.8,
+        strokeWeight: 5
+    });
+}
+
+async function displayRoute(addresses, totalDistance = null, totalDuration = null, coordinates = null,
+                            polyline = null) {
     if (!directionsService || !directionsRenderer || addresses.length < 2) return;
 
     clearMarkers();
@@ -151,16 +199,19 @@ async function displayRoute(addresses, totalDistance = null, totalDuration = nul
     const isLoopRoute = addresses.length >= 2 && 
                        addresses[0] === addresses[addresses.length - 1];
 
-    // First, geocode all addresses and create markers
+    // Use the coordinates stored with the route when available, otherwise geocode
+    const hasCoordinates = Array.isArray(coordinates) && coordinates.length === addresses.length;
+    const geocoder = hasCoordinates ? null : new google.maps.Geocoder();
+    const locations = hasCoordinates
+        ? coordinates.map(([lat, lng]) => ({ lat, lng }))
+        : addresses;
+
+    // First, create a marker for every stop
     for (let i = 0; i < addresses.length; i++) {
-        const geocoder = new google.maps.Geocoder();
         try {
-            const result = await new Promise((resolve, reject) => {
-                geocoder.geocode({ address: addresses[i] }, (results, status) => {
-                    if (status === 'OK') resolve(results[0].geometry.location);
-                    else reject(new Error(`Geocoding failed: ${status}`));
-                });
-            });
+            const result = hasCoordinates
+                ? locations[i]
+                : await geocodeAddress(geocoder, addresses[i]);
             
             const isStart = i === 0;
             const isEnd = i === addresses.length - 1;
@@ -179,12 +230,24 @@ async function displayRoute(addresses, totalDistance = null, totalDuration = nul
         }
     }
 
-    // Then calculate and display the route
+    // Then display the route: stored road geometry, else client-side directions
     try {
-        const origin = addresses[0];
-        const destination = addresses[addresses.length - 1];
-        const waypoints = addresses.slice(1, -1).map(address => ({
-            location: address,
+        if (polyline || (hasCoordinates && locations.length > MAX_CLIENT_WAYPOINTS + 2)) {
+            // Without stored geometry, routes over the Directions waypoint limit get straight lines
+            drawRoutePath(polyline ? decodePolyline(polyline) : locations);
+            if (mapBounds) {
+                map.fitBounds(mapBounds);
+            }
+            if (totalDistance !== null && totalDuration !== null) {
+                updateRouteInfo(totalDistance, totalDuration);
+            }
+            return;
+        }
+
+        const origin = locations[0];
+        const destination = locations[locations.length - 1];
+        const waypoints = locations.slice(1, -1).map(location => ({
+            location: location,
             stopover: true
         }));
 
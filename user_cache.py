@@ -0,0 +1,62 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app import app, db
+from models import User
+from lru import LRUCache
+
+_users = LRUCache(app.config["USER_CACHE_SIZE"])
+
+
+def _columns(user):
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+
+def load_user(user_id):
+    """The User for Flask-Login, from the in-process cache when fresh, else from the database.
+
+    Cached users are merged into the request's session without a query, so
+    current_user behaves like a loaded instance. Entries live for
+    USER_CACHE_TTL_SECONDS (0 disables) and are dropped when the user row
+    is changed through the ORM.
+    """
+    ttl = app.config["USER_CACHE_TTL_SECONDS"]
+    entry = _users.get(user_id) if ttl > 0 else None
+    if entry is not None and time.time() - entry[1] < ttl:
+        user = User(**entry[0])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None and ttl > 0:
+        _users.put(user_id, (_columns(user), time.time()))
+    return user
+
+
+def forget_users(user_ids):
+    user_ids = set(user_ids)
+    _users.remove_if(lambda entry: entry[0]['id'] in user_ids)
+
+
+@event.listens_for(Session, 'before_flush')
+def _forget_changed_users(session, flush_context, instances):
+    changed = [user.id for user in list(session.dirty) + list(session.deleted)
+               if isinstance(user, User) and user.id is not None]
+    if changed:
+        forget_users(changed)
+        session.info.setdefault('stale_user_ids', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_users(session):
+    # A request may have cached the old row between the flush and the commit
+    stale = session.info.pop('stale_user_ids', None)
+    if stale:
+        forget_users(stale)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stale_users(session):
+    session.info.pop('stale_user_ids', None)